@@ -0,0 +1,426 @@
+"""
+Headless HTTP API of the chatbot. Serves concurrent requests from one process, with the BM25 index, facet index,
+subzone lookup, Chroma collection and caches loaded once and shared by all sessions.
+
+Endpoints:
+    GET  /health    Liveness, always 200 while the process is up
+    GET  /ready     Readiness, 503 until the indexes are loaded
+    GET  /metrics   Prometheus metrics
+    POST /chat      {"message": "...", "session_id": "... (optional)", "stream": true}
+                    Streams the answer as Server-Sent Events (token, sources, done), or returns JSON if stream is false
+    POST /retrieve  {"query": "...", "location": "...", "search_more": false, "include_text": false}
+                    Returns retrieved places as JSON, without calling the LLM
+
+Usage (from the app folder):
+    python api_server.py --port 8000
+"""
+import argparse
+import json
+import os
+import threading
+import uuid
+from datetime import datetime, UTC
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+
+from dotenv import load_dotenv
+
+from llm_gmap import FoodRecommendationBot, load_shared_indexes
+from query_cache import TTLCache, ResponseCache, RetrievalCache, DocumentStore
+from rate_limiter import SlidingWindowRateLimiter, client_address
+from log_writer import BackgroundLogWriter, JsonlSink, SQLiteSink, NullSink
+from metrics import REGISTRY
+from tracing import Tracer
+from llm_scheduler import ScheduledClient, SchedulerRejected
+from embedding_batcher import BatchedEmbeddingClient
+from llm_backends import make_client
+from resilience import ResiliencePolicy
+
+load_dotenv()
+
+# LLM & embedding settings, same as the Streamlit app
+llm_model = "meta-llama/Meta-Llama-3.1-8B-Instruct-Turbo-128K"
+tool_model = "meta-llama/Meta-Llama-3.1-8B-Instruct-Turbo-128K"  # For query re-write and re-format
+tool_backend = "together"  # "ollama" or "llamacpp" to run tool_model on a local server, see streamlit_app.py
+embed_model_name = "BAAI/bge-large-en-v1.5"
+bm25_file = "rank_bm25result_k50"
+chroma_path = "chroma_bge_large_gmapfood_long_14Mar"
+facet_file = "facet_index"  # Optional facet table for pre-filtering
+if not os.path.exists(facet_file):
+    facet_file = None
+n_first_lines = 3
+
+# Sessions
+MAX_SESSIONS = 10000  # Least recently used sessions are dropped beyond this
+SESSION_TTL_SECONDS = 3600  # Sessions idle for this long are dropped
+MAX_MESSAGE_CHARS = 1000
+MAX_BODY_BYTES = 64 * 1024
+
+# Caches shared by all sessions
+RESPONSE_CACHE_SIZE = 500
+RESPONSE_CACHE_TTL_SECONDS = 6 * 3600
+RETRIEVAL_CACHE_SIZE = 2000
+RETRIEVAL_CACHE_TTL_SECONDS = 6 * 3600
+DOCUMENT_STORE_SIZE = 5000
+
+# Rate limiting per client
+COOLDOWN_SECONDS = 2
+MAX_QUERIES_PER_HOUR = 30
+# Reverse proxies in front of the server that append to X-Forwarded-For, 0 if clients connect directly
+TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS", "1"))
+
+# Provider call scheduling and embedding batching, see streamlit_app.py
+LLM_MAX_CONCURRENCY = 8
+EMBED_MAX_CONCURRENCY = 16
+LLM_QUEUE_SIZE = 32
+LLM_QUEUE_TIMEOUT_SECONDS = 10
+EMBED_BATCH_SIZE = 32
+EMBED_BATCH_WINDOW_MS = 5
+TOOL_MAX_CONCURRENCY = 2
+
+# Latency budget, stage timeouts, hedging and fallback model, see streamlit_app.py
+REQUEST_BUDGET_SECONDS = 20
+STAGE_TIMEOUT_SECONDS = {"rewrite": 4, "reformat": 4, "embedding": 3, "generation": 10}
+HEDGE_PERCENTILE = 95
+FALLBACK_MODEL = "meta-llama/Llama-3.2-3B-Instruct-Turbo"
+
+# Conversation memory per session, see streamlit_app.py
+HISTORY_TURNS = 3
+HISTORY_TOKENS = 400
+HISTORY_SUMMARY_TOKENS = 150
+SUMMARIZE_HISTORY = True
+
+# Query logs go to QUERY_LOG_FILE (.jsonl or .db) if set
+QUERY_LOG_FILE = None
+TRACE_REQUESTS = True
+
+
+class SessionStore(TTLCache):
+    """Chat sessions by session id, expiring when idle"""
+    cache_name = "session"
+
+
+class ChatSession:
+    def __init__(self, session_id: str, bot: FoodRecommendationBot):
+        self.session_id = session_id
+        self.bot = bot
+        self.messages: List[Dict] = []
+        self.lock = threading.Lock()  # One turn at a time per session
+
+
+class ChatService:
+    def __init__(self):
+        """Bot engine shared by all requests. Call load() before serving chat or retrieval requests"""
+        self.ready = threading.Event()
+        self.load_error = None
+        self.sessions = SessionStore(max_size=MAX_SESSIONS, ttl_seconds=SESSION_TTL_SECONDS)
+        self.rate_limiter = SlidingWindowRateLimiter(COOLDOWN_SECONDS, MAX_QUERIES_PER_HOUR, 3600)
+        if QUERY_LOG_FILE and QUERY_LOG_FILE.endswith(".db"):
+            sink = SQLiteSink(QUERY_LOG_FILE)
+        elif QUERY_LOG_FILE:
+            sink = JsonlSink(QUERY_LOG_FILE)
+        else:
+            sink = NullSink()
+        self.log_writer = BackgroundLogWriter(sink)
+        self.tracer = Tracer(enabled=TRACE_REQUESTS)
+        self.client = None
+        self.tool_client = None
+        self.resilience = ResiliencePolicy(budget_seconds=REQUEST_BUDGET_SECONDS, stage_timeouts=STAGE_TIMEOUT_SECONDS,
+                                           hedge_percentile=HEDGE_PERCENTILE, fallback_model=FALLBACK_MODEL)
+        self.vector_store = None
+        self.shared_indexes = None
+        self.retrieval_bot = None
+
+    def load(self):
+        """Load indexes and connect to Chroma and Together once for all sessions"""
+        try:
+            import chromadb
+            from chromadb.config import Settings
+            from together import Together
+
+            self.client = ScheduledClient(Together(), model_limits={embed_model_name: EMBED_MAX_CONCURRENCY},
+                                          default_limit=LLM_MAX_CONCURRENCY, max_queue_size=LLM_QUEUE_SIZE,
+                                          queue_timeout=LLM_QUEUE_TIMEOUT_SECONDS)
+            if tool_backend != "together":
+                self.tool_client = ScheduledClient(make_client(tool_backend), default_limit=TOOL_MAX_CONCURRENCY,
+                                                   max_queue_size=LLM_QUEUE_SIZE,
+                                                   queue_timeout=LLM_QUEUE_TIMEOUT_SECONDS)
+            if EMBED_BATCH_WINDOW_MS is not None:
+                self.client = BatchedEmbeddingClient(self.client, max_batch_size=EMBED_BATCH_SIZE,
+                                                     max_wait_ms=EMBED_BATCH_WINDOW_MS)
+            self.vector_store = chromadb.PersistentClient(
+                path=chroma_path,
+                settings=Settings(anonymized_telemetry=False)
+            ).get_collection("gmap_food")
+            self.shared_indexes = load_shared_indexes(bm25_file, facet_file, self.vector_store, chroma_path)
+            self.response_cache = ResponseCache(max_size=RESPONSE_CACHE_SIZE, ttl_seconds=RESPONSE_CACHE_TTL_SECONDS)
+            self.retrieval_cache = RetrievalCache(max_size=RETRIEVAL_CACHE_SIZE,
+                                                  ttl_seconds=RETRIEVAL_CACHE_TTL_SECONDS)
+            self.document_store = DocumentStore(max_size=DOCUMENT_STORE_SIZE, ttl_seconds=RETRIEVAL_CACHE_TTL_SECONDS)
+            # Retrieval keeps no conversation, so one bot serves all retrieval requests
+            self.retrieval_bot = self.create_bot()
+            self.ready.set()
+            print("Indexes loaded, ready to serve")
+        except Exception as e:
+            self.load_error = f"{type(e).__name__}: {e}"
+            print(f"Error loading indexes: {self.load_error}")
+
+    def create_bot(self) -> FoodRecommendationBot:
+        return FoodRecommendationBot(
+            embded_model_name=embed_model_name,
+            llm_model=llm_model,
+            tool_model=tool_model,
+            bm25_file=bm25_file,
+            n_first_lines=n_first_lines,
+            vector_store=self.vector_store,
+            facet_file=facet_file,
+            response_cache=self.response_cache,
+            retrieval_cache=self.retrieval_cache,
+            document_store=self.document_store,
+            tracer=self.tracer,
+            client_endpoint=self.client,
+            tool_client_endpoint=self.tool_client,
+            max_history_turns=HISTORY_TURNS,
+            max_history_tokens=HISTORY_TOKENS,
+            max_summary_tokens=HISTORY_SUMMARY_TOKENS,
+            summarize_history=SUMMARIZE_HISTORY,
+            shared_indexes=self.shared_indexes,
+            resilience=self.resilience,
+        )
+
+    def get_session(self, session_id: str = None) -> ChatSession:
+        """Get session by id, or start a new one if not given or expired"""
+        session = self.sessions.get(session_id) if session_id else None
+        if session is None:
+            session = ChatSession(session_id or uuid.uuid4().hex, self.create_bot())
+        self.sessions.put(session.session_id, session)  # Refresh idle expiry
+        return session
+
+    def chat(self, session: ChatSession, message: str):
+        """Stream the answer to message within session. Session lock must be held by the caller"""
+        session.messages.append({"role": "user", "content": message})
+        full_response = ""
+        try:
+            for response in session.bot.get_response(message, session.messages):
+                if isinstance(response, str):
+                    full_response += response
+                else:
+                    full_response += response.get("sources", "")
+                yield response
+        finally:
+            session.messages.append({"role": "assistant", "content": full_response})
+            self.log_writer.submit({
+                "session_id": session.session_id,
+                "query": message,
+                "response": full_response,
+                "timestamp": datetime.now(UTC).isoformat()
+            })
+
+    def retrieve(self, query: str, location: str = "", search_more: bool = False,
+                 include_text: bool = False) -> List[Dict]:
+        docs = self.retrieval_bot.retrieve(query, location=location, get_nearby=search_more)
+        places = []
+        for doc in docs:
+            place = {
+                "place_id": doc["place_id"],
+                "place_name": doc["place_name"],
+                "place_zone": doc["place_zone"],
+                "place_area": doc["place_area"],
+                "rating": doc["rating"],
+                "score": float(doc["score"]),
+                "distance": doc.get("distance"),
+            }
+            if include_text:
+                place["text"] = doc["text"]
+            places.append(place)
+        return places
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+    service: ChatService = None  # Set by make_server
+
+    def log_message(self, format, *args):
+        pass
+
+    def _client_id(self) -> str:
+        """Address added by the trusted proxy, as entries left of it are written by the client, else the peer"""
+        return client_address(self.headers.get("X-Forwarded-For", ""), TRUSTED_PROXY_HOPS, self.client_address[0])
+
+    def _send_json(self, status: int, body: Dict):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_json(self) -> Dict | None:
+        """Request body as a JSON object, None after sending an error response if invalid"""
+        length = int(self.headers.get("Content-Length", 0) or 0)
+        if length > MAX_BODY_BYTES:
+            self._send_json(413, {"error": "Request body too large"})
+            return None
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            self._send_json(400, {"error": "Request body must be JSON"})
+            return None
+        if not isinstance(body, dict):
+            self._send_json(400, {"error": "Request body must be a JSON object"})
+            return None
+        return body
+
+    def _check_ready(self) -> bool:
+        if not self.service.ready.is_set():
+            self._send_json(503, {"error": "Service is loading", "load_error": self.service.load_error})
+            return False
+        return True
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        if path == "/health":
+            self._send_json(200, {"status": "ok"})
+        elif path == "/ready":
+            if self.service.ready.is_set():
+                self._send_json(200, {"status": "ready", "sessions": len(self.service.sessions)})
+            else:
+                self._send_json(503, {"status": "loading", "load_error": self.service.load_error})
+        elif path == "/metrics":
+            data = REGISTRY.render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        else:
+            self._send_json(404, {"error": "Not found"})
+
+    def do_POST(self):
+        path = self.path.split("?")[0]
+        if path not in ("/chat", "/retrieve"):
+            self._send_json(404, {"error": "Not found"})
+            return
+        body = self._read_json()
+        if body is None or not self._check_ready():
+            return
+        try:
+            if path == "/chat":
+                self._handle_chat(body)
+            else:
+                self._handle_retrieve(body)
+        except SchedulerRejected:
+            self._send_json(503, {"error": "Service is busy, please retry shortly"})
+        except Exception as e:
+            print(f"Error handling {path}: {type(e).__name__}: {e}")
+            self._send_json(500, {"error": "Internal server error"})
+
+    def _handle_retrieve(self, body: Dict):
+        query = str(body.get("query", "")).strip()
+        if not query:
+            self._send_json(400, {"error": "query is required"})
+            return
+        places = self.service.retrieve(query[:MAX_MESSAGE_CHARS], location=str(body.get("location", "")),
+                                       search_more=bool(body.get("search_more", False)),
+                                       include_text=bool(body.get("include_text", False)))
+        self._send_json(200, {"places": places})
+
+    def _handle_chat(self, body: Dict):
+        message = str(body.get("message", "")).strip()
+        if not message:
+            self._send_json(400, {"error": "message is required"})
+            return
+        if len(message) > MAX_MESSAGE_CHARS:
+            self._send_json(400, {"error": f"message is longer than {MAX_MESSAGE_CHARS} characters"})
+            return
+        client_id = self._client_id()
+        can_query, rate_limit_message = self.service.rate_limiter.try_acquire(client_id)
+        if not can_query:
+            self._send_json(429, {"error": rate_limit_message})
+            return
+
+        session = self.service.get_session(body.get("session_id"))
+        if not session.lock.acquire(blocking=False):
+            self.service.rate_limiter.refund(client_id)  # Not answered, so not counted against the limit
+            self._send_json(409, {"error": "Session is answering another message"})
+            return
+        try:
+            if body.get("stream", True):
+                self._stream_chat(session, message)
+            else:
+                answer, sources = "", ""
+                for response in self.service.chat(session, message):
+                    if isinstance(response, str):
+                        answer += response
+                    else:
+                        sources += response.get("sources", "")
+                self._send_json(200, {"session_id": session.session_id, "answer": answer, "sources": sources})
+        finally:
+            session.lock.release()
+
+    def _send_event(self, event: str, data: Dict):
+        self.wfile.write(f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8"))
+        self.wfile.flush()
+
+    def _stream_chat(self, session: ChatSession, message: str):
+        """Send answer tokens as Server-Sent Events as they are generated"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.send_header("X-Accel-Buffering", "no")  # Stop proxies from buffering the stream
+        self.end_headers()
+        self.close_connection = True
+        responses = self.service.chat(session, message)
+        try:
+            self._send_event("session", {"session_id": session.session_id})
+            for response in responses:
+                if isinstance(response, str):
+                    self._send_event("token", {"text": response})
+                else:
+                    self._send_event("sources", {"text": response.get("sources", "")})
+            self._send_event("done", {"session_id": session.session_id})
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # Client went away, stop generating
+        except Exception as e:
+            if isinstance(e, SchedulerRejected):
+                error_message = "Service is busy, please retry shortly"
+            else:
+                print(f"Error answering session {session.session_id}: {e}")
+                error_message = "Failed to generate answer"
+            try:
+                self._send_event("error", {"error": error_message})
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+        finally:
+            responses.close()
+
+
+def make_server(host: str, port: int, service: ChatService) -> ThreadingHTTPServer:
+    handler = type("Handler", (ApiHandler,), {"service": service})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+
+    service = ChatService()
+    # Serve health checks while the indexes load
+    threading.Thread(target=service.load, daemon=True).start()
+    server = make_server(args.host, args.port, service)
+    print(f"Serving on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.log_writer.close()
+
+
+if __name__ == "__main__":
+    main()
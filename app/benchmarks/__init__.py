@@ -0,0 +1,3 @@
+"""
+Offline benchmarks of the chatbot pipeline. Run from the app folder, e.g. python -m benchmarks.bench_pipeline
+"""
@@ -0,0 +1,97 @@
+"""
+Query embedding under concurrent callers, with and without BatchedEmbeddingClient, against a stub provider with a
+per-call latency and a concurrency limit. Reports throughput, latency percentiles, provider calls, rate-limited
+calls and average batch size for each number of concurrent callers.
+
+Usage (from the app folder):
+    python -m benchmarks.bench_embedding_batch --concurrency 1 8 32 --queries-per-caller 20 --window-ms 5
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
+
+from embedding_batcher import BatchedEmbeddingClient, EMBEDDING_BATCH_SIZE
+from retrieve_chunk_chroma import RetrieveChunkChroma
+from benchmarks.bench_pipeline import CONVERSATIONS
+from benchmarks.stats import percentiles, print_table, save_results
+from benchmarks.stub_client import StubClient
+
+EMBED_MODEL = "BAAI/bge-large-en-v1.5"
+QUESTIONS = [question for conversation in CONVERSATIONS for question in conversation]
+
+
+def run_level(client, concurrency: int, queries_per_caller: int) -> Dict:
+    retriever = RetrieveChunkChroma(None, client, EMBED_MODEL)
+    latencies = []
+    num_errors = 0
+
+    def run_caller(caller: int):
+        caller_latencies, caller_errors = [], 0
+        for i in range(queries_per_caller):
+            # Distinct texts, so batches are not shrunk by deduplication
+            text = f"{QUESTIONS[(caller + i) % len(QUESTIONS)]} #{caller}-{i}"
+            start_time = time.perf_counter()
+            try:
+                retriever._get_embeddings(text)
+            except Exception:
+                caller_errors += 1
+                continue
+            caller_latencies.append((time.perf_counter() - start_time) * 1000)
+        return caller_latencies, caller_errors
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for caller_latencies, caller_errors in executor.map(run_caller, range(concurrency)):
+            latencies.extend(caller_latencies)
+            num_errors += caller_errors
+    elapsed = time.perf_counter() - start_time
+    return {
+        "queries_per_sec": round(len(latencies) / elapsed, 1),
+        "errors": num_errors,
+        "latency_ms": percentiles(latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32], help="Concurrent callers")
+    parser.add_argument("--queries-per-caller", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--window-ms", type=float, default=5)
+    parser.add_argument("--embedding-latency", type=float, default=0.05, help="Seconds per provider call")
+    parser.add_argument("--latency-per-input", type=float, default=0.001, help="Extra seconds per text in a call")
+    parser.add_argument("--provider-limit", type=int, default=8, help="Concurrent calls the stub provider accepts")
+    parser.add_argument("--embedding-dim", type=int, default=1024)
+    parser.add_argument("--output", default=None, help="JSON file to save results")
+    args = parser.parse_args()
+
+    results = {"config": vars(args)}
+    for concurrency in args.concurrency:
+        for name in ["unbatched", "batched"]:
+            stub = StubClient(embedding_dim=args.embedding_dim, embedding_latency=args.embedding_latency,
+                              embedding_latency_per_input=args.latency_per_input,
+                              max_concurrent_requests=args.provider_limit)
+            client = stub
+            if name == "batched":
+                client = BatchedEmbeddingClient(stub, max_batch_size=args.batch_size, max_wait_ms=args.window_ms)
+            start_batches = EMBEDDING_BATCH_SIZE.count()
+            start_batched_texts = EMBEDDING_BATCH_SIZE.mean() * start_batches
+            result = run_level(client, concurrency, args.queries_per_caller)
+            if name == "batched":
+                client.close()
+                num_batches = EMBEDDING_BATCH_SIZE.count() - start_batches
+                num_texts = EMBEDDING_BATCH_SIZE.mean() * EMBEDDING_BATCH_SIZE.count() - start_batched_texts
+                result["mean_batch_size"] = round(num_texts / num_batches, 2) if num_batches else 0
+            result["provider_calls"] = stub.num_embedding_calls
+            result["rate_limited"] = stub.num_rate_limited
+            results[f"{name}_c{concurrency}"] = result
+            print(f"\n{name}, {concurrency} callers: " + ", ".join(
+                f"{key} {value}" for key, value in result.items() if not isinstance(value, dict)))
+            print_table({"embedding": result["latency_ms"]})
+    if args.output:
+        save_results(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""
+Load test that drives many concurrent chat sessions through FoodRecommendationBot against the stub client.
+Each simulated session creates its own bot over shared indexes, as a Streamlit session does, and runs a multi-turn
+conversation.
+Sessions are asyncio tasks and each turn runs in a thread pool, so up to concurrency turns run at once.
+Reports throughput, latency percentiles, peak memory and errors for each concurrency level.
+
+Usage (from the app folder):
+    python -m benchmarks.bench_load --concurrency 1 4 16 --sessions-per-level 32 --output bench_load.json
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+from llm_gmap import FoodRecommendationBot, load_shared_indexes
+from metrics import LLM_ERRORS
+from retrieve_chunk_chroma import CHROMA_ERRORS
+from tracing import Tracer, InMemoryExporter
+from benchmarks.bench_pipeline import CONVERSATIONS, summarize
+from benchmarks.stats import percentiles, print_table, rss_mb, save_results
+from benchmarks.stub_client import StubClient
+from benchmarks.synthetic_corpus import build_corpus
+
+
+class RssSampler:
+    def __init__(self, interval: float = 0.1):
+        """Sample resident memory in a background thread and keep the peak"""
+        self.interval = interval
+        self.peak_mb = rss_mb()
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            self.peak_mb = max(self.peak_mb, rss_mb())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stop_event.set()
+        self._thread.join()
+        self.peak_mb = max(self.peak_mb, rss_mb())
+        return False
+
+
+class LoadRunner:
+    def __init__(self, corpus: Dict, client: StubClient, tracer: Tracer, think_time: float = 0):
+        self.corpus = corpus
+        self.client = client
+        self.tracer = tracer
+        self.think_time = think_time
+        self.shared_indexes = load_shared_indexes(corpus["bm25_file"], vector_store=corpus["collection"],
+                                                  chroma_path=corpus["chroma_path"])
+        self.request_latencies: List[float] = []
+        self.ttfts: List[float] = []
+        self.session_start_latencies: List[float] = []
+        self.errors: List[str] = []
+        self._lock = threading.Lock()
+
+    def _create_bot(self) -> FoodRecommendationBot:
+        start_time = time.perf_counter()
+        bot = FoodRecommendationBot(bm25_file=self.corpus["bm25_file"], vector_store=self.corpus["collection"],
+                                    client_endpoint=self.client, tracer=self.tracer,
+                                    shared_indexes=self.shared_indexes)
+        with self._lock:
+            self.session_start_latencies.append((time.perf_counter() - start_time) * 1000)
+        return bot
+
+    def _run_turn(self, bot: FoodRecommendationBot, question: str, messages: List[dict]) -> str:
+        start_time = time.perf_counter()
+        ttft = None
+        full_response = ""
+        for response in bot.get_response(question, messages):
+            if ttft is None:
+                ttft = (time.perf_counter() - start_time) * 1000
+            full_response += response if isinstance(response, str) else response.get("sources", "")
+        with self._lock:
+            self.request_latencies.append((time.perf_counter() - start_time) * 1000)
+            if ttft is not None:
+                self.ttfts.append(ttft)
+        return full_response
+
+    async def run_session(self, conversation: List[str], executor: ThreadPoolExecutor):
+        loop = asyncio.get_running_loop()
+        try:
+            bot = await loop.run_in_executor(executor, self._create_bot)
+            place_name = bot.doc_infos[0]["place_name"]
+            messages = []
+            for question in conversation:
+                question = question.format(place_name=place_name)
+                messages.append({"role": "user", "content": question})
+                full_response = await loop.run_in_executor(executor, self._run_turn, bot, question, list(messages))
+                messages.append({"role": "assistant", "content": full_response})
+                if self.think_time:
+                    await asyncio.sleep(self.think_time)
+        except Exception as e:
+            with self._lock:
+                self.errors.append(f"{type(e).__name__}: {e}")
+            traceback.print_exc()
+
+    async def run_level(self, concurrency: int, num_sessions: int):
+        semaphore = asyncio.Semaphore(concurrency)
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            async def limited_session(index: int):
+                async with semaphore:
+                    await self.run_session(CONVERSATIONS[index % len(CONVERSATIONS)], executor)
+
+            await asyncio.gather(*(limited_session(index) for index in range(num_sessions)))
+
+
+def run_level(corpus: Dict, client: StubClient, concurrency: int, num_sessions: int, think_time: float) -> Dict:
+    exporter = InMemoryExporter(max_traces=100000)
+    runner = LoadRunner(corpus, client, Tracer(exporter=exporter), think_time=think_time)
+    # Chroma and LLM errors are handled inside the bot, so they are counted from the metrics
+    start_chroma_errors, start_llm_errors = CHROMA_ERRORS.total(), LLM_ERRORS.total()
+    with RssSampler() as rss_sampler:
+        start_time = time.perf_counter()
+        asyncio.run(runner.run_level(concurrency, num_sessions))
+        elapsed = time.perf_counter() - start_time
+    return {
+        "concurrency": concurrency,
+        "sessions": num_sessions,
+        "requests": len(runner.request_latencies),
+        "errors": len(runner.errors),
+        "error_samples": runner.errors[:5],
+        "chroma_errors": int(CHROMA_ERRORS.total() - start_chroma_errors),
+        "llm_errors": int(LLM_ERRORS.total() - start_llm_errors),
+        "elapsed_s": round(elapsed, 2),
+        "requests_per_sec": round(len(runner.request_latencies) / elapsed, 2),
+        "peak_rss_mb": round(rss_sampler.peak_mb, 1),
+        "latency_ms": {
+            "session_start": percentiles(runner.session_start_latencies),
+            "request": percentiles(runner.request_latencies),
+            "ttft": percentiles(runner.ttfts),
+        },
+        "stage_latency_ms": summarize(exporter.traces),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16],
+                        help="Numbers of sessions running at once")
+    parser.add_argument("--sessions-per-level", type=int, default=32, help="Sessions started per concurrency level")
+    parser.add_argument("--think-time", type=float, default=0, help="Seconds a user waits between turns")
+    parser.add_argument("--num-places", type=int, default=2000, help="Number of synthetic places")
+    parser.add_argument("--corpus-dir", default=None, help="Folder to build or reuse the corpus, temporary if unset")
+    parser.add_argument("--embedding-dim", type=int, default=1024)
+    parser.add_argument("--embedding-latency", type=float, default=0.05, help="Seconds per embedding call")
+    parser.add_argument("--tool-latency", type=float, default=0.3, help="Seconds per query rewrite or reformat")
+    parser.add_argument("--ttft", type=float, default=0.2, help="Seconds to first generated token")
+    parser.add_argument("--tokens-per-sec", type=float, default=50, help="Generation speed of the stub")
+    parser.add_argument("--answer-tokens", type=int, default=100)
+    parser.add_argument("--output", default=None, help="JSON file to save results")
+    args = parser.parse_args()
+
+    client = StubClient(embedding_dim=args.embedding_dim, embedding_latency=args.embedding_latency,
+                        tool_latency=args.tool_latency, time_to_first_token=args.ttft,
+                        tokens_per_sec=args.tokens_per_sec, answer_tokens=args.answer_tokens)
+    results = {"config": vars(args), "levels": []}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        corpus = build_corpus(args.corpus_dir or os.path.join(temp_dir, "corpus"), args.num_places, client.embed)
+        results["start_rss_mb"] = round(rss_mb(), 1)
+        for concurrency in args.concurrency:
+            level = run_level(corpus, client, concurrency, args.sessions_per_level, args.think_time)
+            results["levels"].append(level)
+            print(f"\nConcurrency {concurrency}: {level['requests']} requests in {level['elapsed_s']}s, "
+                  f"{level['requests_per_sec']} requests/s, {level['errors']} errors "
+                  f"({level['chroma_errors']} Chroma, {level['llm_errors']} LLM handled), "
+                  f"peak RSS {level['peak_rss_mb']} MB")
+            print_table({**level["latency_ms"], **{f"stage:{name}": row
+                                                   for name, row in level["stage_latency_ms"].items()}})
+
+    print(f"\n{'concurrency':>12}{'requests/s':>12}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}"
+          f"{'peak MB':>10}")
+    for level in results["levels"]:
+        request = level["latency_ms"]["request"]
+        print(f"{level['concurrency']:>12}{level['requests_per_sec']:>12}{request.get('p50', '-'):>10}"
+              f"{request.get('p95', '-'):>10}{request.get('p99', '-'):>10}{level['errors']:>8}"
+              f"{level['peak_rss_mb']:>10}")
+    if args.output:
+        save_results(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
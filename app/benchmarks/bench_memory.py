@@ -0,0 +1,87 @@
+"""
+Prompt size over a long conversation. Runs one session of many turns against the stub client and reports, per
+turn, the history words sent to the query rewrite and to the generation, the full prompt words, and the words of
+the whole transcript so far for comparison.
+
+Usage (from the app folder):
+    python -m benchmarks.bench_memory --turns 40 --max-history-turns 3 --max-history-tokens 400
+"""
+import argparse
+import os
+import tempfile
+from typing import Dict, List
+
+from llm_gmap import FoodRecommendationBot
+from tracing import Tracer, InMemoryExporter
+from benchmarks.bench_pipeline import CONVERSATIONS
+from benchmarks.stats import save_results
+from benchmarks.stub_client import StubClient
+from benchmarks.synthetic_corpus import build_corpus
+
+
+def span_attributes(trace, name: str) -> Dict:
+    for child in trace.root.children:
+        if child.name == name:
+            return child.attributes
+    return {}
+
+
+def run_session(bot: FoodRecommendationBot, exporter: InMemoryExporter, num_turns: int) -> List[Dict]:
+    questions = [question for conversation in CONVERSATIONS for question in conversation]
+    place_name = bot.doc_infos[0]["place_name"]
+    messages = []
+    rows = []
+    for turn in range(num_turns):
+        question = questions[turn % len(questions)].format(place_name=place_name)
+        messages.append({"role": "user", "content": question})
+        full_response = ""
+        for response in bot.get_response(question, messages):
+            full_response += response if isinstance(response, str) else response.get("sources", "")
+        messages.append({"role": "assistant", "content": full_response})
+        trace = exporter.traces[-1]
+        generation = span_attributes(trace, "generation")
+        rows.append({
+            "turn": turn + 1,
+            "rewrite_history_words": span_attributes(trace, "rewrite_query").get("history_words", 0),
+            "generation_history_words": generation.get("history_words", 0),
+            "prompt_words": generation.get("prompt_words", 0),
+            "transcript_words": sum(len(message["content"].split()) for message in messages[:-1]),
+        })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=40)
+    parser.add_argument("--max-history-turns", type=int, default=3)
+    parser.add_argument("--max-history-tokens", type=int, default=400)
+    parser.add_argument("--max-summary-tokens", type=int, default=150)
+    parser.add_argument("--summarize-history", action="store_true", help="Summarize older turns with the tool model")
+    parser.add_argument("--num-places", type=int, default=1000)
+    parser.add_argument("--embedding-dim", type=int, default=256)
+    parser.add_argument("--output", default=None, help="JSON file to save results")
+    args = parser.parse_args()
+
+    client = StubClient(embedding_dim=args.embedding_dim, embedding_latency=0, tool_latency=0,
+                        time_to_first_token=0, tokens_per_sec=0)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        corpus = build_corpus(os.path.join(temp_dir, "corpus"), args.num_places, client.embed)
+        exporter = InMemoryExporter()
+        bot = FoodRecommendationBot(bm25_file=corpus["bm25_file"], vector_store=corpus["collection"],
+                                    client_endpoint=client, tracer=Tracer(exporter=exporter),
+                                    max_history_turns=args.max_history_turns,
+                                    max_history_tokens=args.max_history_tokens,
+                                    max_summary_tokens=args.max_summary_tokens,
+                                    summarize_history=args.summarize_history)
+        rows = run_session(bot, exporter, args.turns)
+
+    columns = ["turn", "rewrite_history_words", "generation_history_words", "prompt_words", "transcript_words"]
+    print("".join(f"{column:>26}" for column in columns))
+    for row in rows:
+        print("".join(f"{row[column]:>26}" for column in columns))
+    if args.output:
+        save_results({"config": vars(args), "turns": rows}, args.output)
+
+
+if __name__ == "__main__":
+    main()
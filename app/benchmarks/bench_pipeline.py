@@ -0,0 +1,125 @@
+"""
+End-to-end benchmark of FoodRecommendationBot.get_response against the stub client and a synthetic corpus.
+Reports p50/p95/p99 latency of each stage and overall, without network calls.
+
+Usage (from the app folder):
+    python -m benchmarks.bench_pipeline --num-places 2000 --repeats 5 --output bench_pipeline.json
+"""
+import argparse
+import os
+import tempfile
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+from llm_gmap import FoodRecommendationBot
+from tracing import Tracer, InMemoryExporter
+from benchmarks.stub_client import StubClient
+from benchmarks.synthetic_corpus import build_corpus
+from benchmarks.stats import percentiles, print_table, save_results
+
+# Conversations built from the examples shown in the UI. {place_name} is filled with a place from the corpus
+CONVERSATIONS = [
+    ["Cafes in Bugis", "Tell me more about {place_name}"],
+    ["Italian restaurants in city hall"],
+    ["What are the best steak restaurants in Singapore?"],
+    ["Suggest Japanese restaurants in Bedok", "Any cheaper ones?"],
+    ["Halal food near Tampines"],
+    ["Cheap chicken rice around Toa Payoh", "What about dessert?"],
+    ["Korean BBQ near Orchard"],
+    ["Best laksa"],
+]
+
+
+def collect_stage_times(span, stage_times: Dict[str, float]):
+    """Sum durations of spans with the same name within one trace, e.g. repeated Chroma queries"""
+    for child in span.children:
+        stage_times[child.name] += child.duration_ms
+        collect_stage_times(child, stage_times)
+
+
+def run_conversations(bot: FoodRecommendationBot, conversations: List[List[str]], repeats: int) -> int:
+    place_name = bot.doc_infos[0]["place_name"]
+    num_requests = 0
+    for _ in range(repeats):
+        for conversation in conversations:
+            bot.reset_history()
+            messages = []
+            for question in conversation:
+                question = question.format(place_name=place_name)
+                messages.append({"role": "user", "content": question})
+                full_response = ""
+                for response in bot.get_response(question, messages):
+                    full_response += response if isinstance(response, str) else response.get("sources", "")
+                messages.append({"role": "assistant", "content": full_response})
+                num_requests += 1
+    return num_requests
+
+
+def summarize(traces) -> Dict:
+    stage_values = defaultdict(list)
+    for trace in traces:
+        stage_times = defaultdict(float)
+        collect_stage_times(trace.root, stage_times)
+        for name, duration_ms in stage_times.items():
+            stage_values[name].append(duration_ms)
+        for child in trace.root.children:
+            if "ttft_ms" in child.attributes:
+                stage_values["ttft"].append(child.attributes["ttft_ms"])
+        stage_values["total"].append(trace.root.duration_ms)
+    return {name: percentiles(values) for name, values in stage_values.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--num-places", type=int, default=2000, help="Number of synthetic places")
+    parser.add_argument("--corpus-dir", default=None, help="Folder to build or reuse the corpus, temporary if unset")
+    parser.add_argument("--repeats", type=int, default=5, help="Number of passes over the conversations")
+    parser.add_argument("--warmup", type=int, default=1, help="Passes before measuring")
+    parser.add_argument("--embedding-dim", type=int, default=1024)
+    parser.add_argument("--embedding-latency", type=float, default=0.05, help="Seconds per embedding call")
+    parser.add_argument("--tool-latency", type=float, default=0.3, help="Seconds per query rewrite or reformat")
+    parser.add_argument("--ttft", type=float, default=0.2, help="Seconds to first generated token")
+    parser.add_argument("--tokens-per-sec", type=float, default=50, help="Generation speed of the stub")
+    parser.add_argument("--answer-tokens", type=int, default=200)
+    parser.add_argument("--no-latency", action="store_true", help="Set all stub latencies to 0 to time our own code")
+    parser.add_argument("--output", default=None, help="JSON file to save results")
+    args = parser.parse_args()
+
+    if args.no_latency:
+        args.embedding_latency = args.tool_latency = args.ttft = 0
+        args.tokens_per_sec = 0
+    client = StubClient(embedding_dim=args.embedding_dim, embedding_latency=args.embedding_latency,
+                        tool_latency=args.tool_latency, time_to_first_token=args.ttft,
+                        tokens_per_sec=args.tokens_per_sec, answer_tokens=args.answer_tokens)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        corpus_dir = args.corpus_dir or os.path.join(temp_dir, "corpus")
+        start_time = time.perf_counter()
+        corpus = build_corpus(corpus_dir, args.num_places, client.embed)
+        print(f"Corpus of {args.num_places} places ready in {time.perf_counter() - start_time:.1f}s "
+              f"({corpus['collection'].count()} chunks)")
+
+        exporter = InMemoryExporter(max_traces=100000)
+        bot = FoodRecommendationBot(bm25_file=corpus["bm25_file"], vector_store=corpus["collection"],
+                                    client_endpoint=client, tracer=Tracer(exporter=exporter))
+        run_conversations(bot, CONVERSATIONS, args.warmup)
+        exporter.traces.clear()
+
+        start_time = time.perf_counter()
+        num_requests = run_conversations(bot, CONVERSATIONS, args.repeats)
+        elapsed = time.perf_counter() - start_time
+
+    results = {
+        "config": vars(args),
+        "num_requests": num_requests,
+        "requests_per_sec": round(num_requests / elapsed, 2),
+        "latency_ms": summarize(exporter.traces),
+    }
+    print_table(results["latency_ms"], title=f"{num_requests} requests, {results['requests_per_sec']} requests/s")
+    if args.output:
+        save_results(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Tail latency of FoodRecommendationBot against a stub provider where a fraction of calls are slow or fail.
+Runs the same first-turn requests without a resilience policy and with one (latency budget, stage timeouts,
+hedged rewrites, reformats and embeddings, and a fallback model), and reports request and first token latency
+percentiles, failed requests, hedged calls, timeouts and degraded stages.
+
+Usage (from the app folder):
+    python -m benchmarks.bench_resilience --requests 200 --slow-probability 0.05 --slow-latency 3
+"""
+import argparse
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
+
+from llm_gmap import FoodRecommendationBot, load_shared_indexes
+from resilience import ResiliencePolicy, HEDGED_CALLS, STAGE_TIMEOUTS, DEGRADED
+from tracing import Tracer
+from benchmarks.bench_pipeline import CONVERSATIONS
+from benchmarks.stats import percentiles, print_table, save_results
+from benchmarks.stub_client import StubClient
+from benchmarks.synthetic_corpus import build_corpus
+
+# Default models of FoodRecommendationBot, and a fallback model the stub serves without slow calls
+LLM_MODEL = "meta-llama/Meta-Llama-3.1-8B-Instruct-Turbo-128K"
+EMBED_MODEL = "BAAI/bge-large-en-v1.5"
+FALLBACK_MODEL = "meta-llama/Llama-3.2-3B-Instruct-Turbo"
+
+
+def counter_snapshot() -> Dict[str, float]:
+    """Current value of hedge, timeout and degradation counters by metric name and labels"""
+    return {name: value for counter in [HEDGED_CALLS, STAGE_TIMEOUTS, DEGRADED] for name, value in counter.samples()}
+
+
+def run_requests(corpus: Dict, shared_indexes: Dict, client: StubClient, policy: ResiliencePolicy | None,
+                 num_requests: int, concurrency: int) -> Dict:
+    latencies, ttfts = [], []
+    num_failed = 0
+    start_counts = counter_snapshot()
+
+    def run_request(index: int):
+        bot = FoodRecommendationBot(bm25_file=corpus["bm25_file"], vector_store=corpus["collection"],
+                                    client_endpoint=client, tracer=Tracer(enabled=False),
+                                    shared_indexes=shared_indexes, resilience=policy)
+        question = CONVERSATIONS[index % len(CONVERSATIONS)][0]
+        start_time = time.perf_counter()
+        ttft = None
+        try:
+            for _ in bot.get_response(question, [{"role": "user", "content": question}]):
+                if ttft is None:
+                    ttft = (time.perf_counter() - start_time) * 1000
+        except Exception as e:
+            print(f"Request {index} failed: {e!r}")
+            return None, None
+        return (time.perf_counter() - start_time) * 1000, ttft
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for latency, ttft in executor.map(run_request, range(num_requests)):
+            if latency is None:
+                num_failed += 1
+            else:
+                latencies.append(latency)
+                ttfts.append(ttft)
+
+    end_counts = counter_snapshot()
+    counts = {name: int(value - start_counts.get(name, 0)) for name, value in end_counts.items()}
+    return {
+        "failed": num_failed,
+        "elapsed_s": round(time.perf_counter() - start_time, 2),
+        "counts": {name: value for name, value in sorted(counts.items()) if value},
+        "latency_ms": {"request": percentiles(latencies), "ttft": percentiles(ttfts)},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--slow-probability", type=float, default=0.05, help="Fraction of provider calls that are slow")
+    parser.add_argument("--slow-latency", type=float, default=3.0, help="Extra seconds of a slow call")
+    parser.add_argument("--error-probability", type=float, default=0.01, help="Fraction of provider calls that fail")
+    parser.add_argument("--budget", type=float, default=6.0, help="Request latency budget in seconds")
+    parser.add_argument("--tool-timeout", type=float, default=1.0, help="Rewrite and reformat timeout in seconds")
+    parser.add_argument("--embedding-timeout", type=float, default=0.5)
+    parser.add_argument("--generation-timeout", type=float, default=1.5, help="Seconds until the first token")
+    parser.add_argument("--hedge-percentile", type=float, default=95)
+    parser.add_argument("--num-places", type=int, default=1000)
+    parser.add_argument("--embedding-dim", type=int, default=256)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="JSON file to save results")
+    args = parser.parse_args()
+
+    def make_stub():
+        # Only the configured models are slow or fail, the fallback model is served normally
+        return StubClient(embedding_dim=args.embedding_dim, embedding_latency=0.05, tool_latency=0.2,
+                          time_to_first_token=0.2, tokens_per_sec=200, answer_tokens=100,
+                          slow_call_probability=args.slow_probability, slow_call_latency=args.slow_latency,
+                          error_probability=args.error_probability, slow_models=(LLM_MODEL, EMBED_MODEL),
+                          seed=args.seed)
+
+    def make_policy():
+        # Hedge delays start from the stub latencies until enough calls are seen
+        return ResiliencePolicy(budget_seconds=args.budget,
+                                stage_timeouts={"rewrite": args.tool_timeout, "reformat": args.tool_timeout,
+                                                "embedding": args.embedding_timeout,
+                                                "generation": args.generation_timeout},
+                                hedge_percentile=args.hedge_percentile, default_hedge_delay=0.4,
+                                fallback_model=FALLBACK_MODEL, min_generation_timeout=args.generation_timeout)
+
+    results = {"config": vars(args)}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        corpus = build_corpus(os.path.join(temp_dir, "corpus"), args.num_places, make_stub().embed)
+        shared_indexes = load_shared_indexes(corpus["bm25_file"], vector_store=corpus["collection"],
+                                             chroma_path=corpus["chroma_path"])
+        for name, policy in [("no_policy", None), ("resilience_policy", make_policy())]:
+            stub = make_stub()  # Same seed, so both runs see the same sequence of slow and failed calls
+            results[name] = run_requests(corpus, shared_indexes, stub, policy, args.requests, args.concurrency)
+            results[name]["stub_slow_calls"] = stub.num_slow_calls
+            results[name]["stub_errors"] = stub.num_errors
+            print(f"\n{name}: " + ", ".join(f"{key} {value}" for key, value in results[name].items()
+                                            if not isinstance(value, dict)))
+            for counter_name, value in results[name]["counts"].items():
+                print(f"  {counter_name} {value}")
+            print_table(results[name]["latency_ms"])
+    if args.output:
+        save_results(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""
+Corpus-scaling microbenchmarks of the retrieval components: BM25 get_scores, filtered Chroma queries,
+chunk fetches per place and subzone lookup. Each corpus size is built and measured in a fresh process,
+reporting build time, load time, memory and latency percentiles.
+
+Usage (from the app folder):
+    python -m benchmarks.bench_scaling --sizes 1000 10000 100000 --output bench_scaling.json
+"""
+import argparse
+import multiprocessing
+import os
+import platform
+import random
+import re
+import resource
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List
+
+from bm25_index import load_bm25
+from benchmarks.stats import percentiles, print_table, save_results, rss_mb
+from benchmarks.stub_client import StubClient
+from benchmarks.synthetic_corpus import build_bm25, build_chroma, generate_places, load_zones
+
+QUERIES = ["cafes", "italian restaurants", "best steak restaurants", "japanese restaurants", "halal food",
+           "cheap chicken rice", "korean bbq", "laksa", "vegetarian food", "dessert shop with matcha latte"]
+LOCATIONS = ["Bugis", "city hall", "Bedok", "Tampines", "Toa Payoh", "Orchard", "jurong east", "Marina Bay",
+             "ang mo kio", "Somewhere unknown"]
+COMPONENTS = ["bm25", "chroma", "chunks"]
+
+
+def simple_tokenize(text: str) -> List[str]:
+    """Word and punctuation tokens, close to nltk word_tokenize but fast enough for millions of summaries"""
+    return re.findall(r"\w+|[^\w\s]", text)
+
+
+def disk_mb(path: str) -> float:
+    if os.path.isfile(path):
+        return os.path.getsize(path) / 2 ** 20
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, _, names in os.walk(path) for name in names) / 2 ** 20
+
+
+def time_calls(fn: Callable, args_list: List, repeats: int) -> List[float]:
+    """Milliseconds per call of fn over args_list, repeated"""
+    durations = []
+    for _ in range(repeats):
+        for args in args_list:
+            start_time = time.perf_counter()
+            fn(*args)
+            durations.append((time.perf_counter() - start_time) * 1000)
+    return durations
+
+
+def bench_bm25(num_places: int, work_dir: str, seed: int, repeats: int) -> Dict:
+    bm25_file = os.path.join(work_dir, "rank_bm25result")
+    start_time = time.perf_counter()
+    build_bm25(generate_places(num_places, seed=seed), bm25_file, tokenize=simple_tokenize)
+    build_time = time.perf_counter() - start_time
+
+    rss_before = rss_mb()
+    start_time = time.perf_counter()
+    bm25, _ = load_bm25(bm25_file)
+    load_time = time.perf_counter() - start_time
+    load_rss = rss_mb() - rss_before
+
+    tokenized_queries = [(simple_tokenize(f"{query} {location}".lower()),)
+                         for query in QUERIES for location in LOCATIONS]
+    return {
+        "build_s": round(build_time, 3),
+        "file_mb": round(disk_mb(bm25_file), 2),
+        "load_s": round(load_time, 3),
+        "load_rss_mb": round(load_rss, 1),
+        "get_scores_ms": percentiles(time_calls(bm25.get_scores, tokenized_queries, repeats)),
+    }
+
+
+def _zone_filter(zones: List[str]) -> Dict:
+    """Same subzone filter as RetrieveChunkChroma.retrieve_and_join_chunks"""
+    if len(zones) == 1:
+        return {"place_zone": zones[0]}
+    return {"$or": [{"place_zone": zone} for zone in zones]}
+
+
+def bench_chroma(num_places: int, work_dir: str, seed: int, repeats: int, embedding_dim: int,
+                 components: List[str]) -> Dict:
+    import chromadb
+    from chromadb.config import Settings
+    from retrieve_chunk_chroma import RetrieveChunkChroma
+
+    chroma_path = os.path.join(work_dir, "chroma")
+    client = StubClient(embedding_dim=embedding_dim, embedding_latency=0)
+    start_time = time.perf_counter()
+    build_chroma(generate_places(num_places, seed=seed), chroma_path, client.embed)
+    build_time = time.perf_counter() - start_time
+
+    rss_before = rss_mb()
+    start_time = time.perf_counter()
+    collection = chromadb.PersistentClient(path=chroma_path, settings=Settings(anonymized_telemetry=False)
+                                           ).get_collection("gmap_food")
+    num_chunks = collection.count()
+    load_time = time.perf_counter() - start_time
+    results = {
+        "build_s": round(build_time, 3),
+        "disk_mb": round(disk_mb(chroma_path), 2),
+        "num_chunks": num_chunks,
+        "open_s": round(load_time, 3),
+    }
+
+    rng = random.Random(seed)
+    zones = [zone["place_zone"] for zone in load_zones()]
+    query_embeddings = [client.embed(query) for query in QUERIES]
+
+    def query(embedding, where):
+        collection.query(query_embeddings=[embedding], n_results=40, where=where)
+
+    if "chroma" in components:
+        # The HNSW index is loaded into memory by the first query
+        start_time = time.perf_counter()
+        query(query_embeddings[0], None)
+        results["first_query_s"] = round(time.perf_counter() - start_time, 3)
+        results["query_ms"] = percentiles(time_calls(query, [(embedding, None) for embedding in query_embeddings],
+                                                     repeats))
+        single_zone = [(embedding, _zone_filter([rng.choice(zones)])) for embedding in query_embeddings]
+        results["query_one_subzone_ms"] = percentiles(time_calls(query, single_zone, repeats))
+        nearby_zones = [(embedding, _zone_filter(rng.sample(zones, 10))) for embedding in query_embeddings]
+        results["query_ten_subzones_ms"] = percentiles(time_calls(query, nearby_zones, repeats))
+        results["query_rss_mb"] = round(rss_mb() - rss_before, 1)
+
+    if "chunks" in components:
+        retrieve_class = RetrieveChunkChroma(collection, client, "stub")
+        place_ids = [(f"synthetic_{rng.randrange(num_places):07d}",) for _ in range(50)]
+        results["get_all_chunks_for_place_ms"] = percentiles(
+            time_calls(retrieve_class._get_all_chunks_for_place, place_ids, repeats))
+    return results
+
+
+def run_size(num_places: int, components: List[str], seed: int, repeats: int, embedding_dim: int,
+             base_dir: str) -> Dict:
+    """Build and measure one corpus size. Runs in its own process so memory is measured from a clean start"""
+    work_dir = tempfile.mkdtemp(prefix=f"scaling_{num_places}_", dir=base_dir)
+    results = {"start_rss_mb": round(rss_mb(), 1)}
+    try:
+        if "bm25" in components:
+            results["bm25"] = bench_bm25(num_places, work_dir, seed, repeats)
+        if "chroma" in components or "chunks" in components:
+            results["chroma"] = bench_chroma(num_places, work_dir, seed, repeats, embedding_dim, components)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    results["peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    return results
+
+
+def bench_location(repeats: int) -> Dict:
+    """find_subzones depends on the area and subzone files, not the corpus, so it is measured once"""
+    from get_location_queries import GetLocationSubzone
+
+    start_time = time.perf_counter()
+    subzone_finder = GetLocationSubzone(area_file="area_to_subzone.json", subzone_file="sub_zone_nearby.json",
+                                        match_cutoff=0.75)
+    load_time = time.perf_counter() - start_time
+    results = {"load_s": round(load_time, 3), "num_areas": len(subzone_finder.area_to_subzone),
+               "num_subzones": len(subzone_finder.subzone_nearby)}
+    for max_dist in [1.5, 3]:
+        results[f"find_subzones_{max_dist}km_ms"] = percentiles(
+            time_calls(subzone_finder.find_subzones, [(location, max_dist) for location in LOCATIONS], repeats))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000],
+                        help="Corpus sizes in places, e.g. 1000 10000 100000 1000000")
+    parser.add_argument("--components", nargs="+", default=COMPONENTS, choices=COMPONENTS)
+    parser.add_argument("--repeats", type=int, default=3, help="Passes over the query set per measurement")
+    parser.add_argument("--embedding-dim", type=int, default=1024,
+                        help="Use fewer dimensions to build large sizes faster")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--work-dir", default=None, help="Folder for corpus files, temporary folder if unset")
+    parser.add_argument("--output", default="bench_scaling.json", help="JSON file to save results")
+    args = parser.parse_args()
+
+    results = {
+        "config": vars(args),
+        "system": {"python": platform.python_version(), "platform": platform.platform(),
+                   "cpu_count": os.cpu_count()},
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "location": bench_location(args.repeats),
+        "sizes": {},
+    }
+    print_table({name: row for name, row in results["location"].items() if isinstance(row, dict)},
+                title="Subzone lookup")
+
+    context = multiprocessing.get_context("spawn")
+    for num_places in args.sizes:
+        print(f"\nBuilding and measuring {num_places} places...")
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            size_results = executor.submit(run_size, num_places, args.components, args.seed, args.repeats,
+                                           args.embedding_dim, args.work_dir).result()
+        results["sizes"][str(num_places)] = size_results
+        for component in ["bm25", "chroma"]:
+            if component in size_results:
+                component_results = size_results[component]
+                print({name: value for name, value in component_results.items() if not isinstance(value, dict)})
+                print_table({name: row for name, row in component_results.items() if isinstance(row, dict)},
+                            title=f"{component} @ {num_places} places")
+        save_results(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Burst test of the LLM call scheduler against a stub provider that rejects calls beyond a concurrency limit.
+Sends a burst of first-turn requests at once, with and without ScheduledClient, and reports completed, rejected
+and rate-limited requests, latency and queue wait.
+
+Usage (from the app folder):
+    python -m benchmarks.bench_scheduler --burst 32 --provider-limit 8 --scheduler-limit 6
+"""
+import argparse
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
+
+from llm_gmap import FoodRecommendationBot, load_shared_indexes
+from llm_scheduler import ScheduledClient, SchedulerRejected, QUEUE_WAIT
+from metrics import LLM_ERRORS
+from tracing import Tracer
+from benchmarks.bench_pipeline import CONVERSATIONS
+from benchmarks.stats import percentiles, print_table, save_results
+from benchmarks.stub_client import StubClient, StubRateLimitError
+from benchmarks.synthetic_corpus import build_corpus
+
+# Default models of FoodRecommendationBot
+LLM_MODEL = "meta-llama/Meta-Llama-3.1-8B-Instruct-Turbo-128K"
+EMBED_MODEL = "BAAI/bge-large-en-v1.5"
+
+
+def run_burst(corpus: Dict, shared_indexes: Dict, client, burst: int) -> Dict:
+    latencies, ttfts = [], []
+    outcomes = {"completed": 0, "rejected": 0, "rate_limited": 0, "other_errors": 0}
+    start_llm_errors = LLM_ERRORS.total()
+
+    def run_request(index: int):
+        bot = FoodRecommendationBot(bm25_file=corpus["bm25_file"], vector_store=corpus["collection"],
+                                    client_endpoint=client, tracer=Tracer(enabled=False),
+                                    shared_indexes=shared_indexes)
+        question = CONVERSATIONS[index % len(CONVERSATIONS)][0]
+        start_time = time.perf_counter()
+        ttft = None
+        try:
+            for _ in bot.get_response(question, [{"role": "user", "content": question}]):
+                if ttft is None:
+                    ttft = (time.perf_counter() - start_time) * 1000
+        except SchedulerRejected:
+            return "rejected", None, None
+        except StubRateLimitError:
+            return "rate_limited", None, None
+        except Exception:
+            return "other_errors", None, None
+        return "completed", (time.perf_counter() - start_time) * 1000, ttft
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=burst) as executor:
+        for outcome, latency, ttft in executor.map(run_request, range(burst)):
+            outcomes[outcome] += 1
+            if latency is not None:
+                latencies.append(latency)
+                ttfts.append(ttft)
+    return {
+        **outcomes,
+        # Embedding errors are handled inside the bot and only show up as empty retrievals
+        "llm_errors_handled": int(LLM_ERRORS.total() - start_llm_errors),
+        "elapsed_s": round(time.perf_counter() - start_time, 2),
+        "latency_ms": {"request": percentiles(latencies), "ttft": percentiles(ttfts)},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--burst", type=int, default=32, help="Requests sent at once")
+    parser.add_argument("--provider-limit", type=int, default=8, help="Concurrent calls the stub provider accepts")
+    parser.add_argument("--scheduler-limit", type=int, default=6, help="Concurrent chat calls allowed")
+    parser.add_argument("--embedding-limit", type=int, default=2, help="Concurrent embedding calls allowed")
+    parser.add_argument("--queue-size", type=int, default=64)
+    parser.add_argument("--queue-timeout", type=float, default=30)
+    parser.add_argument("--num-places", type=int, default=1000)
+    parser.add_argument("--embedding-dim", type=int, default=256)
+    parser.add_argument("--output", default=None, help="JSON file to save results")
+    args = parser.parse_args()
+
+    stub = StubClient(embedding_dim=args.embedding_dim, embedding_latency=0.05, tool_latency=0.2,
+                      time_to_first_token=0.2, tokens_per_sec=100, answer_tokens=100,
+                      max_concurrent_requests=args.provider_limit)
+    results = {"config": vars(args)}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        corpus = build_corpus(os.path.join(temp_dir, "corpus"), args.num_places, stub.embed)
+        shared_indexes = load_shared_indexes(corpus["bm25_file"], vector_store=corpus["collection"],
+                                             chroma_path=corpus["chroma_path"])
+        # Limits of both models add up to at most the provider limit
+        scheduled = ScheduledClient(stub, model_limits={LLM_MODEL: args.scheduler_limit,
+                                                        EMBED_MODEL: args.embedding_limit},
+                                    max_queue_size=args.queue_size, queue_timeout=args.queue_timeout)
+        for name, client in [("unscheduled", stub), ("scheduled", scheduled)]:
+            results[name] = run_burst(corpus, shared_indexes, client, args.burst)
+            print(f"\n{name}: " + ", ".join(f"{key} {value}" for key, value in results[name].items()
+                                            if not isinstance(value, dict)))
+            print_table(results[name]["latency_ms"])
+    results["scheduled"]["queue_wait_mean_ms"] = {
+        kind: round(QUEUE_WAIT.mean(model=model, kind=kind) * 1000, 2)
+        for model, kind in [(LLM_MODEL, "tool"), (LLM_MODEL, "generation"), (EMBED_MODEL, "embedding")]
+    }
+    print(f"\nMean queue wait (ms): {results['scheduled']['queue_wait_mean_ms']}")
+    if args.output:
+        save_results(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""
+Latency percentiles and result tables shared by the benchmarks
+"""
+import json
+import os
+import resource
+from typing import Dict, List
+
+import numpy as np
+
+
+def percentiles(values: List[float]) -> Dict:
+    """Count, mean and p50/p95/p99 of values"""
+    if not values:
+        return {"count": 0}
+    array = np.asarray(values, dtype=float)
+    p50, p95, p99 = np.percentile(array, [50, 95, 99])
+    return {"count": len(values), "mean": round(float(array.mean()), 3), "p50": round(float(p50), 3),
+            "p95": round(float(p95), 3), "p99": round(float(p99), 3), "max": round(float(array.max()), 3)}
+
+
+def print_table(rows: Dict[str, Dict], title: str = "", unit: str = "ms"):
+    """Print a row of percentiles per name"""
+    if title:
+        print(f"\n{title}")
+    print(f"{'':<28}{'count':>8}{'mean':>11}{'p50':>11}{'p95':>11}{'p99':>11}{'max':>11}  ({unit})")
+    for name, row in rows.items():
+        if not row.get("count"):
+            continue
+        print(f"{name:<28}{row['count']:>8}{row['mean']:>11}{row['p50']:>11}{row['p95']:>11}{row['p99']:>11}"
+              f"{row['max']:>11}")
+
+
+def rss_mb() -> float:
+    """Current resident memory of this process, or peak if current is not available"""
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def save_results(results: Dict, output_file: str):
+    with open(output_file, "w", encoding="utf-8") as file:
+        json.dump(results, file, indent=2)
+    print(f"\nSaved results to {output_file}")
@@ -0,0 +1,124 @@
+"""
+Stand-in for the Together client with the deterministic outputs of FakeClient and configurable latency and failures
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import List
+
+import numpy as np
+
+from llm_backends import FakeClient
+
+
+class StubRateLimitError(Exception):
+    """Raised like a 429 response when more than max_concurrent_requests calls are in flight"""
+
+
+class StubProviderError(Exception):
+    """Raised like a 5xx response for a fraction of calls"""
+
+
+class StubClient(FakeClient):
+    def __init__(self, embedding_dim: int = 1024, embedding_latency: float = 0.05, tool_latency: float = 0.3,
+                 time_to_first_token: float = 0.2, tokens_per_sec: float = 50, answer_tokens: int = 200,
+                 max_concurrent_requests: int = None, slow_call_probability: float = 0, slow_call_latency: float = 3.0,
+                 error_probability: float = 0, slow_models: tuple = None, seed: int = 0,
+                 embedding_latency_per_input: float = 0):
+        """
+        FakeClient with provider latencies. Answers are streamed at tokens_per_sec after time_to_first_token.
+        Latencies are in seconds.
+        If max_concurrent_requests is set, calls beyond that many in flight fail with StubRateLimitError.
+        To simulate a slow tail, a slow_call_probability fraction of calls wait slow_call_latency seconds more
+        (only calls to slow_models if given), and an error_probability fraction fail with StubProviderError.
+        A list-input embedding call takes embedding_latency plus embedding_latency_per_input for each text.
+        """
+        super().__init__(embedding_dim=embedding_dim, answer_tokens=answer_tokens)
+        self.embedding_latency = embedding_latency
+        self.embedding_latency_per_input = embedding_latency_per_input
+        self.tool_latency = tool_latency
+        self.time_to_first_token = time_to_first_token
+        self.tokens_per_sec = tokens_per_sec
+        self.max_concurrent_requests = max_concurrent_requests
+        self.slow_call_probability = slow_call_probability
+        self.slow_call_latency = slow_call_latency
+        self.error_probability = error_probability
+        self.slow_models = set(slow_models) if slow_models else None
+        self.num_slow_calls = 0
+        self.num_errors = 0
+        self._rng = np.random.default_rng(seed)
+        self.in_flight = 0
+        self.num_rate_limited = 0
+        self.num_embedding_calls = 0
+        self._lock = threading.Lock()
+
+    def _start_request(self):
+        """Count a call in flight, rejecting it if the simulated provider limit is reached"""
+        with self._lock:
+            if self.max_concurrent_requests is not None and self.in_flight >= self.max_concurrent_requests:
+                self.num_rate_limited += 1
+                raise StubRateLimitError(f"Rate limit of {self.max_concurrent_requests} concurrent requests")
+            self.in_flight += 1
+
+    def _end_request(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def _call_delay(self, latency: float, model: str = None) -> float:
+        """Latency of a call, with the chance of a slow tail call or an error"""
+        with self._lock:
+            is_slow = self._rng.random() < self.slow_call_probability
+            is_error = self._rng.random() < self.error_probability
+            if self.slow_models is not None and model not in self.slow_models:
+                is_slow = is_error = False
+            self.num_slow_calls += is_slow
+            self.num_errors += is_error
+        if is_error:
+            raise StubProviderError("Simulated provider error")
+        return latency + (self.slow_call_latency if is_slow else 0)
+
+    @contextmanager
+    def _request(self):
+        self._start_request()
+        try:
+            yield
+        finally:
+            self._end_request()
+
+    def _embed(self, input: str | list, model: str = None):
+        texts = input if isinstance(input, list) else [input]
+        with self._request():
+            with self._lock:
+                self.num_embedding_calls += 1
+            latency = self._call_delay(self.embedding_latency + self.embedding_latency_per_input * len(texts), model)
+            if latency:
+                time.sleep(latency)
+        return super()._embed(input, model)
+
+    def _chat(self, messages: List[dict], stream: bool, max_tokens: int = None, model: str = None,
+              temperature: float = None):
+        if not stream:
+            with self._request():
+                latency = self._call_delay(self.tool_latency, model)
+                if latency:
+                    time.sleep(latency)
+            return super()._chat(messages, stream, max_tokens, model)
+        self._start_request()  # Rejected when the call is made, like an HTTP error, not when iterated
+        try:
+            time_to_first_token = self._call_delay(self.time_to_first_token, model)
+        except StubProviderError:
+            self._end_request()
+            raise
+        return self._stream(super()._chat(messages, stream, max_tokens, model), time_to_first_token)
+
+    def _stream(self, chunks, time_to_first_token: float):
+        try:
+            if time_to_first_token:
+                time.sleep(time_to_first_token)
+            token_interval = 1 / self.tokens_per_sec if self.tokens_per_sec else 0
+            for i, chunk in enumerate(chunks):
+                if i and token_interval:
+                    time.sleep(token_interval)
+                yield chunk
+        finally:
+            self._end_request()
@@ -0,0 +1,167 @@
+"""
+Generate synthetic places with summaries in the scraped format, and build the Chroma collection and BM25 file from them
+"""
+import json
+import os
+import pickle
+import random
+import re
+from typing import Callable, Dict, Iterable, Iterator, List
+
+import chromadb
+from chromadb.config import Settings
+from rank_bm25 import BM25Okapi
+
+MAX_WORDS = int(440 / 1.5)  # Words per chunk, same as create_embed_chroma
+N_FIRST_LINES = 3
+
+CUISINES = ["Japanese", "Korean", "Chinese", "Cantonese", "Thai", "Vietnamese", "Indian", "Malay", "Indonesian",
+            "Italian", "French", "Spanish", "Mexican", "American", "Western", "Middle Eastern", "Peranakan",
+            "Vegetarian", "Fusion", "Seafood"]
+PLACE_TYPES = ["Restaurant", "Cafe", "Hawker Stall", "Bakery", "Bar", "Bistro", "Food Court", "Dessert Shop"]
+DISHES = ["chicken rice", "laksa", "ramen", "sushi", "dim sum", "char kway teow", "nasi lemak", "prata", "steak",
+          "pasta", "pizza", "burger", "fish and chips", "tacos", "pho", "green curry", "biryani", "satay",
+          "bak kut teh", "chilli crab", "croissant", "kaya toast", "cheesecake", "matcha latte", "bingsu"]
+ADJECTIVES = ["rich", "fragrant", "crispy", "tender", "smoky", "tangy", "spicy", "savoury", "creamy", "juicy",
+              "light", "hearty", "balanced", "generous", "authentic", "refreshing"]
+ASPECTS = ["service", "ambience", "portion size", "value for money", "queue", "seating", "staff", "music"]
+SENTIMENTS = ["friendly and attentive", "slow during peak hours", "cozy and intimate", "vibrant and bustling",
+              "minimalist and modern", "cramped but lively", "efficient and quick", "warm and welcoming"]
+
+
+def load_zones(subzone_file: str = "sub_zone_nearby.json") -> List[Dict]:
+    """Subzones with their planning areas, named as in the Chroma metadata"""
+    with open(subzone_file, "r", encoding="utf-8") as file:
+        subzone_nearby = json.load(file)
+    return [{"place_zone": name.title(), "place_area": data["planning_area"].title()}
+            for name, data in subzone_nearby.items()]
+
+
+def _sentence(rng: random.Random) -> str:
+    dish = rng.choice(DISHES)
+    return (f"The {dish} is {rng.choice(ADJECTIVES)} and {rng.choice(ADJECTIVES)}, and reviewers praise the "
+            f"{rng.choice(ASPECTS)} as {rng.choice(SENTIMENTS)}. \"Best {dish} I have had in a while.\"")
+
+
+def generate_summary(rng: random.Random, place: Dict, min_sentences: int = 15, max_sentences: int = 60) -> str:
+    """Summary following the output format of the summary prompt, with a random body length"""
+    low_price = rng.choice([5, 8, 10, 15, 20, 30, 40, 60, 80])
+    lines = [
+        f"Name: {place['place_name']}",
+        f"Location: {place['place_zone']}, {place['place_area']}",
+        f"Nearest MRT: {place['place_area']} MRT",
+        f"Nearby: {place['place_zone']} Mall",
+        f"Type: {place['cuisine']} {place['place_type']}",
+        f"Price Range: ${low_price}-{low_price * 2} per person",
+        f"Address: {place['address']}",
+        f"Overall Rating: {place['rating']}/5",
+        f"Summary of Restaurant: {place['place_name']} serves {place['cuisine'].lower()} food in "
+        f"{place['place_zone']}.",
+        "Popular Dishes or Drinks: " + " ".join(_sentence(rng) for _ in range(rng.randint(min_sentences,
+                                                                                          max_sentences))),
+        f"Criticized Dishes or Drinks: The {rng.choice(DISHES)} can be {rng.choice(['bland', 'oily', 'salty'])}.",
+        f"Service Quality: {rng.choice(SENTIMENTS).capitalize()}.",
+        f"Ambience: {rng.choice(SENTIMENTS).capitalize()}.",
+        f"Payment Methods: {rng.choice(['Cash only', 'Credit cards, mobile payments', 'PayNow and cards'])}",
+    ]
+    return "\n".join(lines)
+
+
+def generate_places(num_places: int, seed: int = 0, zones: List[Dict] = None) -> Iterator[Dict]:
+    """Yield num_places synthetic places with summaries, spread over Singapore subzones"""
+    rng = random.Random(seed)
+    zones = zones or load_zones()
+    for i in range(num_places):
+        zone = rng.choice(zones)
+        cuisine = rng.choice(CUISINES)
+        place = {
+            "place_id": f"synthetic_{i:07d}",
+            "place_name": f"{rng.choice(ADJECTIVES).capitalize()} {cuisine} {rng.choice(PLACE_TYPES)} {i}",
+            "address": f"{rng.randint(1, 999)} {zone['place_zone']} Road, Singapore {rng.randint(100000, 999999)}",
+            "place_area": zone["place_area"],
+            "place_zone": zone["place_zone"],
+            "place_type": rng.choice(PLACE_TYPES).lower(),
+            "cuisine": cuisine,
+            "rating": round(rng.uniform(3.0, 5.0), 1),
+        }
+        place["summary"] = generate_summary(rng, place)
+        yield place
+
+
+def chunk_summary(text: str, max_words: int = MAX_WORDS, n_first_lines: int = N_FIRST_LINES) -> List[str]:
+    """Split summary into chunks of max_words words, each starting with the first lines, as create_embed_chroma"""
+    lines = text.split("\n")
+    first_lines = "\n".join(lines[:n_first_lines])
+    words = re.findall(r"\S+|\s+", "\n".join(lines[n_first_lines:]))
+    chunks = []
+    num_words = 0
+    current_chunk = []
+    for word in words:
+        if num_words >= max_words and current_chunk:
+            chunks.append(first_lines + "\n" + "".join(current_chunk))
+            current_chunk = []
+            num_words = 0
+        current_chunk.append(word)
+        num_words += 1
+    if current_chunk:
+        chunks.append(first_lines + "\n" + "".join(current_chunk))
+    return chunks
+
+
+def build_chroma(places: Iterable[Dict], chroma_path: str, embed_fn: Callable[[str], List[float]],
+                 collection_name: str = "gmap_food", batch_size: int = 1000):
+    """Add chunks of places with the same metadata as create_embed_chroma to a persistent Chroma collection"""
+    client = chromadb.PersistentClient(path=chroma_path, settings=Settings(anonymized_telemetry=False))
+    collection = client.get_or_create_collection(collection_name)
+    ids, documents, embeddings, metadatas = [], [], [], []
+    for place in places:
+        chunks = chunk_summary(place["summary"])
+        for chunk_index, chunk in enumerate(chunks):
+            ids.append(f"{place['place_id']}_{chunk_index}")
+            documents.append(chunk)
+            embeddings.append(embed_fn(chunk))
+            metadatas.append({
+                "place_id": place["place_id"],
+                "place_name": place["place_name"],
+                "address": place["address"],
+                "place_area": place["place_area"],
+                "place_zone": place["place_zone"],
+                "place_type": place["place_type"],
+                "rating": place["rating"],
+                "chunk_index": chunk_index,
+                "total_chunks": len(chunks),
+            })
+        if len(ids) >= batch_size:
+            collection.add(ids=ids, documents=documents, embeddings=embeddings, metadatas=metadatas)
+            ids, documents, embeddings, metadatas = [], [], [], []
+    if ids:
+        collection.add(ids=ids, documents=documents, embeddings=embeddings, metadatas=metadatas)
+    return collection
+
+
+def build_bm25(places: Iterable[Dict], bm25_file: str, tokenize: Callable[[str], List[str]] = None):
+    """Write BM25 file in the older pickle format of rankBM25_generation, still read by bm25_index.load_bm25"""
+    if tokenize is None:
+        from nltk.tokenize import word_tokenize
+        tokenize = word_tokenize
+    doc_list = []
+    doc_infos = []
+    for place in places:
+        doc_list.append(tokenize(place["summary"].lower()))
+        doc_infos.append({"place_id": place["place_id"], "place_name": place["place_name"]})
+    with open(bm25_file, "wb") as file:
+        pickle.dump({"bm25": BM25Okapi(doc_list), "doc_infos": doc_infos}, file)
+
+
+def build_corpus(output_dir: str, num_places: int, embed_fn: Callable[[str], List[float]], seed: int = 0) -> Dict:
+    """Build Chroma collection and BM25 file of num_places synthetic places in output_dir, reusing them if present"""
+    chroma_path = os.path.join(output_dir, "chroma")
+    bm25_file = os.path.join(output_dir, "rank_bm25result")
+    if not os.path.exists(bm25_file) or not os.path.exists(chroma_path):
+        os.makedirs(output_dir, exist_ok=True)
+        places = list(generate_places(num_places, seed=seed))
+        build_chroma(places, chroma_path, embed_fn)
+        build_bm25(places, bm25_file)
+    collection = chromadb.PersistentClient(path=chroma_path, settings=Settings(anonymized_telemetry=False)
+                                           ).get_collection("gmap_food")
+    return {"chroma_path": chroma_path, "bm25_file": bm25_file, "collection": collection}
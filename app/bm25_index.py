@@ -0,0 +1,63 @@
+"""
+Load the BM25 file generated by gmap_scrap/rankBM25_generation.py. The file is a numpy .npz of postings, idf and
+document lengths, scored the same as rank_bm25.BM25Okapi. Older files with a pickled BM25Okapi are still read.
+"""
+import pickle
+import zipfile
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+
+class BM25Index:
+    def __init__(self, index: Dict[str, np.ndarray]):
+        """
+        Index arrays as written by rankBM25_generation.build_index. The weight of each posting is computed once
+        here, so get_scores only adds the weights of the query terms.
+        """
+        terms = bytes(index["terms"]).decode("utf-8").split("\n") if len(index["terms"]) else []
+        self.term_ids = {term: i for i, term in enumerate(terms)}
+        self.idf = index["idf"]
+        self.term_offsets = index["term_offsets"]
+        self.posting_docs = index["posting_docs"]
+        self.doc_len = index["doc_len"]
+        self.corpus_size = len(self.doc_len)
+        self.avgdl = float(index["avgdl"])
+        self.k1 = float(index["k1"])
+        self.b = float(index["b"])
+
+        # Same expression as BM25Okapi.get_scores, so scores match it exactly
+        q_freq = index["posting_counts"]
+        doc_len = self.doc_len[self.posting_docs]
+        posting_idf = np.repeat(self.idf, np.diff(self.term_offsets))
+        self.weights = posting_idf * (q_freq * (self.k1 + 1) /
+                                      (q_freq + self.k1 * (1 - self.b + self.b * doc_len / self.avgdl)))
+
+    @classmethod
+    def load(cls, bm25_file: str) -> Tuple["BM25Index", List[Dict]]:
+        """Index and the place_id and place_name of each document"""
+        with np.load(bm25_file, allow_pickle=False) as data:
+            index = dict(data)
+        doc_infos = [{"place_id": place_id, "place_name": place_name}
+                     for place_id, place_name in zip(index["place_ids"].tolist(), index["place_names"].tolist())]
+        return cls(index), doc_infos
+
+    def get_scores(self, query: List[str]) -> np.ndarray:
+        """BM25 score of each document for a tokenized query"""
+        score = np.zeros(self.corpus_size)
+        for q in query:
+            term = self.term_ids.get(q)
+            if term is None:
+                continue
+            start, end = self.term_offsets[term], self.term_offsets[term + 1]
+            score[self.posting_docs[start:end]] += self.weights[start:end]
+        return score
+
+
+def load_bm25(bm25_file: str) -> Tuple[object, List[Dict]]:
+    """BM25 scorer with get_scores and the doc_infos of a BM25 file, in the .npz or the older pickle format"""
+    if zipfile.is_zipfile(bm25_file):
+        return BM25Index.load(bm25_file)
+    with open(bm25_file, 'rb') as bm25result_file:
+        bm25_data = pickle.load(bm25result_file)
+    return bm25_data["bm25"], bm25_data["doc_infos"]
@@ -0,0 +1,149 @@
+"""
+Bounded conversation memory: the last turns verbatim within a token budget, older turns in a rolling summary
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+TOKEN_RATIO = 1.5  # 1 word ≈ 1.5 tokens
+# Rolling summaries of all sessions are computed here, after the answer has been streamed
+_SUMMARY_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="history_summary")
+
+
+def estimate_tokens(text: str) -> int:
+    return int(len(text.split()) * TOKEN_RATIO)
+
+
+def truncate_tokens(text: str, max_tokens: int, keep_end: bool = False) -> str:
+    """Cut text to about max_tokens, keeping its first lines, or its last lines if keep_end"""
+    max_words = int(max_tokens / TOKEN_RATIO)
+    lines = text.splitlines(keepends=True)
+    if keep_end:
+        lines = lines[::-1]
+    kept_lines = []
+    num_words = 0
+    for line in lines:
+        words = line.split()
+        if num_words + len(words) > max_words:
+            # Keep the part of the line that fits
+            num_remaining = max_words - num_words
+            if num_remaining > 0:
+                part = " ".join(words[-num_remaining:] if keep_end else words[:num_remaining])
+                kept_lines.append(part + "\n" if line.endswith("\n") else part)
+            break
+        kept_lines.append(line)
+        num_words += len(words)
+    if keep_end:
+        kept_lines = kept_lines[::-1]
+    return "".join(kept_lines)
+
+
+class ConversationMemory:
+    def __init__(self, max_turns: int = 3, max_tokens: int = 400, max_summary_tokens: int = 150,
+                 summarizer: Callable[[str, List[Dict]], str] = None):
+        """
+        Keep up to max_turns recent turns, dropping the oldest while they are over max_tokens. An assistant turn
+        is kept only as the names of the places it recommended.
+        Dropped turns are folded into a summary of at most max_summary_tokens. With summarizer(summary, turns),
+        e.g. an LLM call, the summary is rewritten in the background. Until it finishes, and without a
+        summarizer, dropped turns are summarized as their query and places.
+        """
+        self.max_turns = max_turns
+        self.max_tokens = max_tokens
+        self.max_summary_tokens = max_summary_tokens
+        self.summarizer = summarizer
+        self.turns: List[Dict] = []
+        self.summary = ""
+        self._unsummarized: List[Dict] = []  # Dropped turns not yet in summary
+        self._summary_job = None
+        self._generation = 0  # Incremented by clear, so summaries of a cleared conversation are dropped
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def format_turn(turn: Dict) -> str:
+        text = f"user: {turn['question']}\n"
+        if turn["places"]:
+            text += f"assistant: recommended {', '.join(turn['places'])}\n"
+        return text
+
+    def add_turn(self, question: str, places: List[str]):
+        """Record a finished turn: the user question and the names of places recommended in the answer"""
+        with self._lock:
+            self.turns.append({"question": question, "places": places})
+            while len(self.turns) > 1 and (len(self.turns) > self.max_turns or self._turn_tokens() > self.max_tokens):
+                self._unsummarized.append(self.turns.pop(0))
+            if self._unsummarized:
+                self._update_summary()
+
+    def _turn_tokens(self) -> int:
+        return sum(estimate_tokens(self.format_turn(turn)) for turn in self.turns)
+
+    def _update_summary(self):
+        """Fold dropped turns into the summary, in the background if there is a summarizer. Lock must be held"""
+        if self.summarizer is None:
+            self.summary = self._extractive_summary(self.summary, self._unsummarized)
+            self._unsummarized = []
+            return
+        if self._summary_job is not None:
+            return  # Turns dropped meanwhile are picked up when the running job is done
+        turns = list(self._unsummarized)
+        self._summary_job = _SUMMARY_EXECUTOR.submit(self._run_summarizer, self.summary, turns, self._generation)
+
+    def _run_summarizer(self, summary: str, turns: List[Dict], generation: int):
+        try:
+            new_summary = truncate_tokens(self.summarizer(summary, turns).strip(), self.max_summary_tokens)
+        except Exception as e:
+            print(f"Error summarizing history: {e}")
+            new_summary = ""
+        if not new_summary:
+            new_summary = self._extractive_summary(summary, turns)
+        with self._lock:
+            if generation != self._generation:
+                return
+            self.summary = new_summary
+            self._unsummarized = self._unsummarized[len(turns):]
+            self._summary_job = None
+            if self._unsummarized:
+                self._update_summary()
+
+    def _extractive_summary(self, summary: str, turns: List[Dict]) -> str:
+        """Summary followed by each turn's query and places, keeping the most recent max_summary_tokens"""
+        parts = [summary] if summary else []
+        for turn in turns:
+            part = turn["question"].strip()
+            if turn["places"]:
+                part += f" -> {', '.join(turn['places'])}"
+            parts.append(part)
+        return truncate_tokens("; ".join(parts), self.max_summary_tokens, keep_end=True)
+
+    def _current_summary(self) -> str:
+        """Summary including dropped turns still being summarized in the background. Lock must be held"""
+        if self._unsummarized:
+            return self._extractive_summary(self.summary, self._unsummarized)
+        return self.summary
+
+    def query_history(self) -> str:
+        """Earlier user queries for the query rewrite"""
+        with self._lock:
+            summary = self._current_summary()
+            history = "".join(f"user: {turn['question']}\n" for turn in self.turns)
+        if summary:
+            history = f"summary of earlier conversation: {summary}\n" + history
+        return truncate_tokens(history, self.max_tokens + self.max_summary_tokens, keep_end=True)
+
+    def chat_history(self) -> str:
+        """Earlier turns for the generation prompt"""
+        with self._lock:
+            summary = self._current_summary()
+            history = "".join(self.format_turn(turn) for turn in self.turns)
+        if summary:
+            history = f"summary of earlier conversation: {summary}\n" + history
+        return truncate_tokens(history, self.max_tokens + self.max_summary_tokens, keep_end=True)
+
+    def clear(self):
+        with self._lock:
+            self.turns = []
+            self.summary = ""
+            self._unsummarized = []
+            self._summary_job = None
+            self._generation += 1
@@ -0,0 +1,108 @@
+"""
+Micro-batching of embedding calls: texts from concurrent callers are sent together as one list-input call
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from types import SimpleNamespace
+from typing import List
+
+from metrics import REGISTRY
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+EMBEDDING_BATCH_SIZE = REGISTRY.histogram("food_bot_embedding_batch_size", "Texts per batched embedding call",
+                                          buckets=BATCH_SIZE_BUCKETS)
+EMBEDDING_BATCH_WAIT = REGISTRY.histogram("food_bot_embedding_batch_wait_seconds",
+                                          "Time texts waited for their batch to be sent")
+
+
+class _PendingText:
+    def __init__(self, text: str, model: str):
+        self.text = text
+        self.model = model
+        self.future = Future()
+        self.queued_time = time.monotonic()
+
+
+class _BatchedEmbeddings:
+    def __init__(self, batcher: "BatchedEmbeddingClient"):
+        self.batcher = batcher
+
+    def create(self, input: str | list, model: str, **kwargs):
+        texts = input if isinstance(input, list) else [input]
+        pending = [self.batcher.submit(text, model) for text in texts]
+        return SimpleNamespace(data=[SimpleNamespace(embedding=item.future.result()) for item in pending])
+
+
+class BatchedEmbeddingClient:
+    def __init__(self, client, max_batch_size: int = 32, max_wait_ms: float = 5, max_in_flight: int = 4):
+        """
+        Wrap a client with the Together interface so embedding calls from concurrent callers are collected for up
+        to max_wait_ms, or until max_batch_size texts are waiting, and sent as one call with a list input.
+        Up to max_in_flight batches are sent at once. Chat calls go straight to the client.
+        Share one instance between all sessions.
+        """
+        self.client = client
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.chat = client.chat
+        self.embeddings = _BatchedEmbeddings(self)
+        self._queue = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="embedding_batch")
+        self._thread = threading.Thread(target=self._run, name="embedding_batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, text: str, model: str) -> _PendingText:
+        item = _PendingText(text, model)
+        self._queue.put(item)
+        return item
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            # Wait for more texts until the window of the first one closes or the batch is full
+            batch = [item]
+            deadline = item.queued_time + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._queue.put(None)  # Stop after this batch
+                    break
+                batch.append(item)
+            by_model = {}
+            for item in batch:
+                by_model.setdefault(item.model, []).append(item)
+            for model, items in by_model.items():
+                self._executor.submit(self._send, model, items)
+
+    def _send(self, model: str, items: List[_PendingText]):
+        """Embed the texts of one batch, deduplicated, and hand each result back to its caller"""
+        texts = list(dict.fromkeys(item.text for item in items))
+        send_time = time.monotonic()
+        for item in items:
+            EMBEDDING_BATCH_WAIT.observe(send_time - item.queued_time)
+        EMBEDDING_BATCH_SIZE.observe(len(texts))
+        try:
+            response = self.client.embeddings.create(input=texts, model=model)
+            embeddings = {text: data.embedding for text, data in zip(texts, response.data)}
+        except Exception as e:
+            for item in items:
+                item.future.set_exception(e)
+            return
+        for item in items:
+            item.future.set_result(embeddings[item.text])
+
+    def close(self):
+        """Send the texts already waiting and stop the batcher"""
+        self._queue.put(None)
+        self._thread.join()
+        self._executor.shutdown(wait=True)
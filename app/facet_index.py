@@ -0,0 +1,105 @@
+"""
+Load facet table generated by gmap_scrap/facet_generation.py and map query phrases to facet filters
+"""
+import pickle
+import re
+from typing import Dict, List
+
+import numpy as np
+
+# Query phrases for price bands saved in the facet file
+PRICE_PHRASES = {
+    "cheap": ["budget"],
+    "cheapest": ["budget"],
+    "budget": ["budget", "moderate"],
+    "affordable": ["budget", "moderate"],
+    "inexpensive": ["budget", "moderate"],
+    "value for money": ["budget", "moderate"],
+    "mid-range": ["moderate"],
+    "mid range": ["moderate"],
+    "pricey": ["upscale", "fine dining"],
+    "expensive": ["upscale", "fine dining"],
+    "upscale": ["upscale", "fine dining"],
+    "fancy": ["upscale", "fine dining"],
+    "luxury": ["fine dining"],
+    "fine dining": ["fine dining"],
+}
+
+RATING_PATTERNS = [
+    r"(?:rated|rating|ratings|stars?)\s*(?:of\s*)?(?:above|over|more than|at least|higher than|>=?)\s*(\d(?:\.\d+)?)",
+    r"(\d(?:\.\d+)?)\s*(?:stars?|/5)",
+    r"(\d\.\d+)\s*(?:and above|or above|or higher|and higher|\+)",
+]
+
+
+class FacetIndex:
+    def __init__(self, facet_file: str, doc_place_ids: List[str]):
+        """
+        Load facet bitmaps and align them to the order of documents in the BM25 file, so a filter mask can be
+        applied directly to BM25 scores. Places missing from the facet file never match a filter.
+        """
+        with open(facet_file, "rb") as file:
+            facet_data = pickle.load(file)
+        num_places = facet_data["num_places"]
+        row_of_place = {place_id: row for row, place_id in enumerate(facet_data["place_ids"])}
+        rows = np.array([row_of_place.get(place_id, -1) for place_id in doc_place_ids], dtype=np.int64)
+        in_table = rows >= 0
+
+        self.num_docs = len(doc_place_ids)
+        self.keywords = facet_data["keywords"]
+        self.bitmaps = {}
+        for facet, value_bitmaps in facet_data["bitmaps"].items():
+            self.bitmaps[facet] = {}
+            for value, packed in value_bitmaps.items():
+                bitmap = np.unpackbits(packed, count=num_places).astype(bool)
+                self.bitmaps[facet][value] = np.where(in_table, bitmap[rows], False)
+        self.rating = np.where(in_table, facet_data["rating"][rows], np.nan)
+
+        # Pre-compile keyword patterns, longest phrases first
+        self.keyword_patterns = {}
+        for facet, value_keywords in self.keywords.items():
+            self.keyword_patterns[facet] = [
+                (re.compile(rf"\b{re.escape(word)}\b"), value)
+                for value, words in value_keywords.items()
+                for word in sorted(words, key=len, reverse=True)
+            ]
+
+    def parse_filters(self, text: str) -> Dict:
+        """Map phrases in a query to facet filters. Values within a facet are OR-ed, facets are AND-ed"""
+        text = text.lower()
+        filters = {}
+        for facet, patterns in self.keyword_patterns.items():
+            values = {value for pattern, value in patterns if pattern.search(text)}
+            if values:
+                filters[facet] = values
+
+        price_values = set()
+        for phrase, bands in PRICE_PHRASES.items():
+            if re.search(rf"\b{re.escape(phrase)}\b", text):
+                price_values.update(bands)
+        price_values &= set(self.bitmaps.get("price_band", {}))
+        if price_values:
+            filters["price_band"] = price_values
+
+        for pattern in RATING_PATTERNS:
+            match = re.search(pattern, text)
+            if match and float(match.group(1)) <= 5:
+                filters["min_rating"] = float(match.group(1))
+                break
+
+        return filters
+
+    def filter_mask(self, filters: Dict) -> np.ndarray | None:
+        """Boolean mask over BM25 documents matching all filters. None if there is nothing to filter"""
+        if not filters:
+            return None
+        mask = np.ones(self.num_docs, dtype=bool)
+        for facet, values in filters.items():
+            if facet == "min_rating":
+                mask &= np.nan_to_num(self.rating, nan=0) >= values
+                continue
+            facet_mask = np.zeros(self.num_docs, dtype=bool)
+            for value in values:
+                facet_mask |= self.bitmaps[facet][value]
+            mask &= facet_mask
+        return mask
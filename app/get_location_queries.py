@@ -1,6 +1,9 @@
 import difflib
 import json
 from typing import Dict
+from metrics import REGISTRY
+
+LOCATION_MATCHES = REGISTRY.counter("food_bot_location_matches_total", "Location queries by how they were matched")
 
 class GetLocationSubzone:
     def __init__(self, area_file="area_to_subzone.json", subzone_file="sub_zone_nearby.json", match_cutoff=0.6):
@@ -45,8 +48,10 @@ class GetLocationSubzone:
         area_place_match = self._find_closest_match(location_query, areas_places_list)
         if area_place_match:
             subzone = self.area_to_subzone[area_place_match]
+            LOCATION_MATCHES.inc(match="area")
         else:  # If no match, find direct from list of sub-zones
             subzone = self._find_closest_match(location_query, subzone_list)
+            LOCATION_MATCHES.inc(match="subzone" if subzone else "none")
 
         result = {}
         if subzone:
@@ -0,0 +1,192 @@
+"""
+Chat and embedding backends. Every backend is a client with the Together interface:
+    client.chat.completions.create(model, messages, stream, max_tokens, temperature)
+    client.embeddings.create(input, model)
+so it can be wrapped by ScheduledClient and BatchedEmbeddingClient and passed to FoodRecommendationBot.
+"""
+import hashlib
+import json
+import os
+import re
+from types import SimpleNamespace
+from typing import List
+
+import numpy as np
+import requests
+from together import Together
+
+BACKENDS = ("together", "ollama", "llamacpp", "openai", "fake")
+# OpenAI-compatible endpoints of local servers, overridden by base_url or LOCAL_LLM_BASE_URL
+DEFAULT_BASE_URLS = {
+    "ollama": "http://localhost:11434/v1",
+    "llamacpp": "http://localhost:8080/v1",
+    "openai": "https://api.openai.com/v1",
+}
+
+LOCATION_PATTERN = re.compile(r"\b(in|at|near|around)\s+([a-z][a-z\s]*?)\s*[\]?.!]*$", re.IGNORECASE)
+NEARBY_WORDS = {"near", "around"}
+
+
+def make_client(backend: str = "together", base_url: str = None, api_key: str = None):
+    """Client for backend, one of BACKENDS"""
+    if backend == "together":
+        return Together()
+    if backend in DEFAULT_BASE_URLS:
+        base_url = base_url or os.getenv("LOCAL_LLM_BASE_URL") or DEFAULT_BASE_URLS[backend]
+        api_key = api_key or os.getenv("LOCAL_LLM_API_KEY") or os.getenv("OPENAI_API_KEY")
+        return OpenAICompatibleClient(base_url, api_key=api_key)
+    if backend == "fake":
+        return FakeClient()
+    raise ValueError(f"Unknown backend {backend}, expected one of {BACKENDS}")
+
+
+def _chat_response(content: str):
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+def _stream_chunk(content: str):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content))])
+
+
+def _embedding_response(embeddings: List[List[float]]):
+    return SimpleNamespace(data=[SimpleNamespace(embedding=embedding) for embedding in embeddings])
+
+
+class _Completions:
+    def __init__(self, client):
+        self.client = client
+
+    def create(self, model: str, messages: List[dict], stream: bool = False, max_tokens: int = None,
+               temperature: float = None, **kwargs):
+        return self.client._chat(messages, stream, max_tokens, model, temperature)
+
+
+class _Embeddings:
+    def __init__(self, client):
+        self.client = client
+
+    def create(self, input: str | list, model: str, **kwargs):
+        return self.client._embed(input, model)
+
+
+class OpenAICompatibleClient:
+    def __init__(self, base_url: str, api_key: str = None, timeout: float = 120):
+        """
+        Client for a server with the OpenAI chat completions and embeddings API, e.g. Ollama, llama.cpp server
+        or vLLM. HTTP errors are raised when the call is made, also for streamed responses.
+        """
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()
+        if api_key:
+            self.session.headers["Authorization"] = f"Bearer {api_key}"
+        self.chat = SimpleNamespace(completions=_Completions(self))
+        self.embeddings = _Embeddings(self)
+
+    def _post(self, path: str, payload: dict, stream: bool = False) -> requests.Response:
+        response = self.session.post(f"{self.base_url}{path}", json=payload, stream=stream, timeout=self.timeout)
+        try:
+            response.raise_for_status()
+        except requests.HTTPError:
+            response.close()
+            raise
+        return response
+
+    def _chat(self, messages: List[dict], stream: bool, max_tokens: int = None, model: str = None,
+              temperature: float = None):
+        payload = {"model": model, "messages": messages, "stream": stream}
+        if max_tokens is not None:
+            payload["max_tokens"] = max_tokens
+        if temperature is not None:
+            payload["temperature"] = temperature
+        response = self._post("/chat/completions", payload, stream=stream)
+        if not stream:
+            return _chat_response(response.json()["choices"][0]["message"]["content"])
+        return self._stream(response)
+
+    @staticmethod
+    def _stream(response: requests.Response):
+        """Tokens of a Server-Sent Events response"""
+        try:
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                choices = json.loads(data).get("choices")
+                if choices:
+                    yield _stream_chunk(choices[0].get("delta", {}).get("content"))
+        finally:
+            response.close()
+
+    def _embed(self, input: str | list, model: str = None):
+        response = self._post("/embeddings", {"model": model, "input": input})
+        data = sorted(response.json()["data"], key=lambda item: item.get("index", 0))
+        return _embedding_response([item["embedding"] for item in data])
+
+
+class FakeClient:
+    def __init__(self, embedding_dim: int = 1024, answer_tokens: int = 200):
+        """
+        Deterministic in-process client for development without a provider.
+        Query rewrites and reformats are derived from the query text, history summaries are the last words of the
+        history, embeddings are unit vectors seeded from a hash of the text, and answers are answer_tokens
+        placeholder tokens.
+        """
+        self.embedding_dim = embedding_dim
+        self.answer_tokens = answer_tokens
+        self.chat = SimpleNamespace(completions=_Completions(self))
+        self.embeddings = _Embeddings(self)
+
+    def embed(self, text: str) -> List[float]:
+        """Deterministic unit vector for text"""
+        seed = int.from_bytes(hashlib.sha1(text.encode("utf-8")).digest()[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(self.embedding_dim)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def _embed(self, input: str | list, model: str = None):
+        texts = input if isinstance(input, list) else [input]
+        return _embedding_response([self.embed(text) for text in texts])
+
+    @staticmethod
+    def _field(content: str, name: str) -> str:
+        match = re.search(rf"{name}:\s*(.*)", content)
+        return match.group(1).strip() if match else ""
+
+    def _rewrite(self, content: str) -> str:
+        """Keep the query, taking the location from query history if the query has none"""
+        query = self._field(content, "Current query")
+        if not LOCATION_PATTERN.search(query):
+            history_start = content.find("Query History:")
+            for line in reversed(content[history_start:].splitlines()):
+                match = LOCATION_PATTERN.search(line.strip())
+                if match:
+                    query = f"{query.rstrip('?.! ')} {match.group(1)} {match.group(2)}"
+                    break
+        return query
+
+    def _reformat(self, content: str) -> str:
+        query = self._field(content, "Current query")
+        match = LOCATION_PATTERN.search(query)
+        if not match:
+            return f"search: {query.rstrip('?.! ')}, location: , search_more: False"
+        search = query[:match.start()].strip()
+        search_more = match.group(1).lower() in NEARBY_WORDS
+        return f"search: {search}, location: {match.group(2).strip()}, search_more: {search_more}"
+
+    def _tool_answer(self, messages: List[dict]) -> str:
+        if "summarize a conversation" in messages[0]["content"]:
+            return " ".join(messages[-1]["content"].split()[-60:])
+        if "reformatting assistant" in messages[0]["content"]:
+            return self._reformat(messages[-1]["content"])
+        return self._rewrite(messages[-1]["content"])
+
+    def _num_tokens(self, max_tokens: int = None) -> int:
+        return min(self.answer_tokens, max_tokens) if max_tokens else self.answer_tokens
+
+    def _chat(self, messages: List[dict], stream: bool, max_tokens: int = None, model: str = None,
+              temperature: float = None):
+        if not stream:
+            return _chat_response(self._tool_answer(messages))
+        return (_stream_chunk(f"token{i % 100} ") for i in range(self._num_tokens(max_tokens)))
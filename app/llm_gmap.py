@@ -1,18 +1,102 @@
 from typing import Dict
-from typing_extensions import List, TypedDict, Tuple
+from typing_extensions import List, Tuple
 
-from together import Together
 import os
 
 from food_asst_prompt import food_assistant_prompt
 from retrieve_chunk_chroma import RetrieveChunkChroma
 import re
 from get_location_queries import GetLocationSubzone
-import pickle
+from facet_index import FacetIndex
+from query_cache import ResponseCache, RetrievalCache, DocumentStore
+import hashlib
+from tracing import Tracer, NULL_TRACE
+from metrics import REGISTRY, TOKEN_BUCKETS, COUNT_BUCKETS, STAGE_LATENCY, LLM_CALLS, LLM_ERRORS
+from resilience import ResiliencePolicy, DEGRADED
+from llm_backends import make_client
+from conversation_memory import ConversationMemory, TOKEN_RATIO
+from contextlib import contextmanager
+import time
+import threading
+import logging
 import numpy as np
 from nltk.tokenize import word_tokenize
+from bm25_index import load_bm25
+
+logger = logging.getLogger(__name__)
+
+# Process-wide metrics of the bot
+REQUESTS = REGISTRY.counter("food_bot_requests_total", "Chat requests handled")
+REQUEST_LATENCY = REGISTRY.histogram("food_bot_request_latency_seconds", "Total time to answer a chat request")
+TTFT = REGISTRY.histogram("food_bot_time_to_first_token_seconds", "Time from request start to first streamed token")
+PROMPT_TOKENS = REGISTRY.histogram("food_bot_prompt_tokens", "Estimated prompt tokens per generation (1 word ~ 1.5 tokens)",
+                                   buckets=TOKEN_BUCKETS)
+OUTPUT_TOKENS = REGISTRY.histogram("food_bot_output_tokens", "Streamed output tokens per generation", buckets=TOKEN_BUCKETS)
+RETRIEVAL_CANDIDATES = REGISTRY.histogram("food_bot_retrieval_candidates", "Size of retrieval candidate sets",
+                                          buckets=COUNT_BUCKETS)
+EMPTY_RETRIEVALS = REGISTRY.counter("food_bot_empty_retrieval_total", "Requests where no place was retrieved")
+
+def _chroma_files(chroma_path: str) -> List[str]:
+    """Files of a Chroma persist directory that are written when chunks are added, updated or deleted. The sqlite
+    shared-memory file also changes on reads, so it is left out"""
+    files = []
+    for root, _, names in os.walk(chroma_path):
+        files.extend(os.path.join(root, name) for name in names if not name.endswith("-shm"))
+    return sorted(files)
+
+def get_index_version(bm25_file: str, facet_file: str = None, vector_store=None, chroma_path: str = None) -> str:
+    """Version string of BM25 file, facet file and Chroma collection. Changes when any index is rebuilt, including
+    a Chroma collection re-embedded with the same number of chunks, when chroma_path is given"""
+    version = ""
+    for index_file in [bm25_file, facet_file]:
+        if index_file:
+            file_stat = os.stat(index_file)
+            version += f"{index_file}:{file_stat.st_mtime_ns}:{file_stat.st_size};"
+    if vector_store is not None:
+        version += f"chroma:{vector_store.id}:{vector_store.count()}"
+    if chroma_path:
+        chroma_hash = hashlib.sha1()
+        for chroma_file in _chroma_files(chroma_path):
+            file_stat = os.stat(chroma_file)
+            chroma_hash.update(f"{chroma_file}:{file_stat.st_mtime_ns}:{file_stat.st_size};".encode("utf-8"))
+        version += f":{chroma_hash.hexdigest()[:16]}"
+    return version
+
+def load_shared_indexes(bm25_file: str, facet_file: str = None, vector_store=None, chroma_path: str = None) -> Dict:
+    """Load BM25 index, facet index and subzone lookup, which do not change between requests, with the version
+    of the indexes as loaded. Caches are tagged with this version, so it is not read again from disk per bot"""
+    index_version = get_index_version(bm25_file, facet_file, vector_store, chroma_path)
+    bm25, doc_infos = load_bm25(bm25_file)
+    facet_index = None
+    if facet_file:
+        facet_index = FacetIndex(facet_file, [doc_info["place_id"] for doc_info in doc_infos])
+    subzone_finder = GetLocationSubzone(area_file="area_to_subzone.json", subzone_file="sub_zone_nearby.json",
+                                        match_cutoff=0.75)
+    return {"bm25": bm25, "doc_infos": doc_infos, "facet_index": facet_index,
+            "subzone_finder": subzone_finder, "index_version": index_version}
+
+
+class _RequestState(threading.local):
+    """Trace, latency budget and retrieval stats of the request in progress, kept per thread so that one bot
+    can serve concurrent retrieval requests"""
+    def __init__(self):
+        self.trace = NULL_TRACE
+        self.budget = None
+        self.degraded = []  # Stages answered in degraded mode in the current request
+        self.last_retrieval_stats = {}
+
+
+def _request_attribute(name: str) -> property:
+    return property(lambda self: getattr(self._request, name),
+                    lambda self, value: setattr(self._request, name, value))
+
 
 class FoodRecommendationBot:
+    trace = _request_attribute("trace")
+    budget = _request_attribute("budget")
+    degraded = _request_attribute("degraded")
+    last_retrieval_stats = _request_attribute("last_retrieval_stats")
+
     def __init__(self, embded_model_name="BAAI/bge-large-en-v1.5",
                  llm_model="meta-llama/Meta-Llama-3.1-8B-Instruct-Turbo-128K",
                  tool_model="meta-llama/Meta-Llama-3.1-8B-Instruct-Turbo-128K",
@@ -24,7 +108,20 @@ class FoodRecommendationBot:
                  save_output=False,
                  n_first_lines=3,
                  vector_store=None,
-                 max_num_full_history=5):
+                 max_history_turns=3,
+                 max_history_tokens=400,
+                 max_summary_tokens=150,
+                 summarize_history=False,
+                 facet_file=None,
+                 response_cache: ResponseCache = None,
+                 retrieval_cache: RetrievalCache = None,
+                 document_store: DocumentStore = None,
+                 tracer: Tracer = None,
+                 client_endpoint=None,
+                 shared_indexes: Dict = None,
+                 resilience: ResiliencePolicy = None,
+                 tool_client=None,
+                 tool_client_endpoint=None):
         self.embded_model_name = embded_model_name
         self.TOGETHER_API_KEY = os.getenv("TOGETHER_API_KEY")
         self.temperature = temperature
@@ -34,44 +131,147 @@ class FoodRecommendationBot:
         self.print_source = print_source
         self.max_tokens = max_tokens
         self.save_output = save_output
+        # Per-request trace of stage timings, candidate counts and prompt size
+        self.tracer = tracer if tracer is not None else Tracer()
+        # Optional latency budget, stage timeouts, hedging and fallbacks, shared across sessions
+        self.resilience = resilience
+        self._request = _RequestState()
 
         # Extract model name for file naming
-        if self.llm_model == 'llama3.2':
-            self.model_name = 'llama3.2'
+        self.model_name = self._get_model_name(llm_model)
+
+        # Initialize clients. client and tool_client are backend names of llm_backends.make_client, e.g. "together",
+        # "ollama" or "fake". Any client with the Together chat and embeddings interface can be passed in instead,
+        # e.g. a stub for benchmarks. Query rewrite and reformat run on the tool client, which can be a small local
+        # model, and default to the main client
+        self.client_endpoint = client_endpoint if client_endpoint is not None else make_client(client)
+        if tool_client_endpoint is not None:
+            self.tool_client_endpoint = tool_client_endpoint
+        elif tool_client is not None:
+            self.tool_client_endpoint = make_client(tool_client)
         else:
-            pattern = r'(gemma-\d+|Qwen\d+\.\d+-\d+B|Meta-Llama)'
-            match = re.search(pattern, llm_model)
-            self.model_name = match.group()
-
-        # Initialize LLM and client
-        self.llm = None
-        self.client_endpoint = None
-        if client == "ollama":
-            self.llm = None
-        elif client == "together":
-            self.client_endpoint = Together()
+            self.tool_client_endpoint = self.client_endpoint
 
         # Initialize embeddings and vector store
         self.vector_store = vector_store
         self.retrieve_class = RetrieveChunkChroma(self.vector_store, self.client_endpoint, self.embded_model_name,
-                                                  n_first_lines=n_first_lines)
-
-        self.query_history = []
-        self.full_history = []
-        self.max_num_full_history = max_num_full_history
-
-        self.subzone_finder = GetLocationSubzone(area_file="area_to_subzone.json", subzone_file="sub_zone_nearby.json",
-                                                 match_cutoff=0.75)
-
-        with open(bm25_file, 'rb') as bm25result_file:
-            bm25_data = pickle.load(bm25result_file)
-        self.bm25 = bm25_data["bm25"]
-        self.doc_infos = bm25_data["doc_infos"]
+                                                  n_first_lines=n_first_lines, document_store=document_store)
+
+        # Last turns within a token budget, with assistant turns kept as the places they recommended. Older turns
+        # are folded into a summary, rewritten by the tool model in the background if summarize_history
+        self.memory = ConversationMemory(max_turns=max_history_turns, max_tokens=max_history_tokens,
+                                         max_summary_tokens=max_summary_tokens,
+                                         summarizer=self._summarize_history if summarize_history else None)
+
+        # Read-only indexes can be loaded once with load_shared_indexes and shared by bots of all sessions
+        if shared_indexes is None:
+            shared_indexes = load_shared_indexes(bm25_file, facet_file, vector_store)
+        self.subzone_finder = shared_indexes["subzone_finder"]
+        self.bm25 = shared_indexes["bm25"]
+        self.doc_infos = shared_indexes["doc_infos"]
         self.bm25_weight = 0.5
         self.bm_search_multiplier = 2
+        self.fusion_score_threshold = 0.5  # Stop widening retrieval once enough places score above this
+        self.bm25_fallback_scan = 5  # BM25-only fallback looks at up to this many times num_results places
+
+        # Optional facet table for pre-filtering on cuisine, price band, rating, place type and dietary needs
+        self.facet_index = shared_indexes["facet_index"]
+
+        # Answer, retrieval and document caches shared across sessions, invalidated when the indexes change
+        self.index_version = shared_indexes["index_version"]
+        self.response_cache = response_cache
+        self.retrieval_cache = retrieval_cache
+        for cache in [response_cache, retrieval_cache, document_store]:
+            if cache is not None:
+                cache.set_index_version(self.index_version)
+
+    @staticmethod
+    def _get_model_name(model: str) -> str:
+        """Short model name for output files, e.g. Meta-Llama, Qwen2.5-7B or llama3.2"""
+        match = re.search(r'(gemma-\d+|Qwen\d+\.\d+-\d+B|Meta-Llama)', model)
+        if match:
+            return match.group()
+        return re.sub(r'[^\w.-]', '_', model.split("/")[-1])
+
+    @contextmanager
+    def _stage(self, name: str, **attributes):
+        """Time a stage of the request in both the trace and the stage latency metric"""
+        start_time = time.perf_counter()
+        try:
+            with self.trace.span(name, **attributes):
+                yield
+        finally:
+            STAGE_LATENCY.observe(time.perf_counter() - start_time, stage=name)
+
+    @contextmanager
+    def _llm_call(self, call: str):
+        """Count calls and errors of LLM provider requests"""
+        LLM_CALLS.inc(call=call)
+        try:
+            yield
+        except Exception:
+            LLM_ERRORS.inc(call=call)
+            raise
+
+    def _call_stage(self, stage: str, fn, min_timeout: float = 0):
+        """Call fn within the stage timeout and request budget if a resilience policy is set"""
+        if self.resilience is None or self.budget is None:
+            return fn()
+        return self.resilience.call(stage, fn, self.budget, min_timeout)
+
+    def _call_with_fallback(self, stage: str, fn, model: str, min_timeout: float = 0):
+        """Call fn(model), trying fn(fallback_model) if the call fails or times out"""
+        try:
+            return self._call_stage(stage, lambda: fn(model), min_timeout)
+        except Exception as e:
+            fallback_model = self.resilience.fallback_model if self.resilience is not None else None
+            if not fallback_model or fallback_model == model:
+                raise
+            result = self._call_stage(stage, lambda: fn(fallback_model), min_timeout)
+            self._degrade(stage, "fallback_model", e)
+            return result
+
+    def _degrade(self, stage: str, mode: str, error: Exception):
+        """Record that a stage was answered in degraded mode"""
+        logger.warning("%s degraded to %s: %r", stage, mode, error)
+        DEGRADED.inc(stage=stage, mode=mode)
+        self.degraded.append(f"{stage}:{mode}")
+        self.trace.set(degraded=",".join(self.degraded))
+
+    def _tool_completion(self, messages: List[dict], model: str = None) -> str:
+        """Completion for the query tools. tool_model runs on the tool client, other models such as the fallback
+        model on the main client"""
+        client_endpoint = self.tool_client_endpoint if model in (None, self.tool_model) else self.client_endpoint
+        response = client_endpoint.chat.completions.create(
+            model=model or self.tool_model,
+            messages=messages,
+            stream=False,
+            max_tokens=200,
+            temperature=0.3  # Lower temperature for more focused rewrites
+        )
+        return response.choices[0].message.content.strip()
+
+    def _summarize_history(self, summary: str, turns: List[Dict]) -> str:
+        """Fold turns that left the memory window into the rolling summary"""
+        turns_str = "".join(ConversationMemory.format_turn(turn) for turn in turns)
+        max_words = int(self.memory.max_summary_tokens / TOKEN_RATIO)
+        system_message = {
+            "role": "system",
+            "content": f"""You summarize a conversation between a user and a food recommendation assistant.
+            Update the summary with the new messages. Keep what the user is looking for (cuisine, type of place, location, budget, dietary needs) and the places already recommended.
+            Output ONLY the summary, in at most {max_words} words."""
+        }
+        user_message = {
+            "role": "user",
+            "content": f"""Summary: {summary}
+            New messages:
+            {turns_str}"""
+        }
+        with self._llm_call("summarize"):
+            return self._tool_completion([system_message, user_message])
 
-    def _rewrite_query(self, query: str, query_history: str) -> str:
-        """Rewrite the query to better utilize the retrieval tool."""
+    def _rewrite_query(self, query: str, query_history: str, model: str = None) -> str:
+        """Rewrite the query to better utilize the retrieval tool. model defaults to tool_model"""
         # Define the retrieval tool's capabilities
         tool_description = {
             "name": "retrieve",
@@ -123,27 +323,17 @@ class FoodRecommendationBot:
             Output only the rewritten query, nothing else."""
         }
 
-        if self.client == "together":
-            response = self.client_endpoint.chat.completions.create(
-                model=self.tool_model,
-                messages=[system_message, user_message],
-                stream=False,
-                max_tokens=200,
-                temperature=0.3  # Lower temperature for more focused rewrites
-            )
-            rewritten_query = response.choices[0].message.content.strip()
-        else:
-            response = self.llm.invoke([system_message, user_message])
-            rewritten_query = response.content.strip()
+        with self._llm_call("rewrite"):
+            rewritten_query = self._tool_completion([system_message, user_message], model)
 
         return rewritten_query
 
-    def _reformat_query(self, query):
-        """Reformat the query for parsing"""
+    def _reformat_query(self, query, model: str = None):
+        """Reformat the query for parsing. model defaults to tool_model"""
         # Define the retrieval tool's capabilities
         system_message = {
             "role": "system",
-            "content": f"""You are a query reformatting assistant that helps optimize queries for semantic search in a vector database.
+            "content": """You are a query reformatting assistant that helps optimize queries for semantic search in a vector database.
 
         Given an input query, re-format it in the format shown below:
         search: [cuisine][type of place][any other relevant context], location: [location], search_more: [True / False]
@@ -165,18 +355,8 @@ class FoodRecommendationBot:
                     Output only the rewritten query, nothing else."""
         }
 
-        if self.client == "together":
-            response = self.client_endpoint.chat.completions.create(
-                model=self.tool_model,
-                messages=[system_message, user_message],
-                stream=False,
-                max_tokens=200,
-                temperature=0.3  # Lower temperature for more focused rewrites
-            )
-            reformat_query = response.choices[0].message.content.strip()
-        else:
-            response = self.llm.invoke([system_message, user_message])
-            reformat_query = response.content.strip()
+        with self._llm_call("reformat"):
+            reformat_query = self._tool_completion([system_message, user_message], model)
 
         return reformat_query
 
@@ -205,13 +385,12 @@ class FoodRecommendationBot:
                          f"Previous Messages:"
                          f"{chat_history}")
         num_words = len(system_prompt.split())
-        # print(f"Num words system prompt: {num_words}")
+        self.trace.set(num_docs=len(docs), prompt_words=num_words, history_words=len(chat_history.split()))
         if self.save_output:
             with open('system_prompt.txt', "w") as f:
                 f.write(system_prompt)
 
-        if (self.llm_model == "meta-llama/Meta-Llama-3.1-8B-Instruct-Turbo-128K" or
-                self.llm_model == "Qwen/Qwen2.5-7B-Instruct-Turbo" or self.llm_model == "llama3.2"):
+        if "gemma" not in self.llm_model.lower():
             format_message = [
                 {
                     "role": "system",
@@ -234,22 +413,12 @@ class FoodRecommendationBot:
                     "content": full_prompt
                 }
             ]
-        if self.client == "together":
-            stream = self.client_endpoint.chat.completions.create(
-                model=self.llm_model,
-                messages=format_message,
-                stream=True,
-                max_tokens=self.max_tokens,
-                temperature=self.temperature
-            )
-            for token in stream:
+        PROMPT_TOKENS.observe(int((num_words + len(question.split())) * TOKEN_RATIO))
+        with self._llm_call("generate"):
+            for token in self._stream_generation(format_message):
                 if hasattr(token, 'choices') and token.choices[0].delta.content:
                     partial_answer = token.choices[0].delta.content
                     yield partial_answer
-        else:
-            response = self.llm.invoke(format_message)
-            answer = response.content
-            yield answer
 
         # Add source list at the end
         source_dict = {
@@ -258,76 +427,285 @@ class FoodRecommendationBot:
         if self.print_source:
             yield source_dict
 
-    def chroma_bm25_combine(self, query: str, subzone_list: list, chroma_n_results: int) -> List:
-        """Retrieve from Chroma and BM25 and then combine scores"""
-        # Chroma processing
-        chroma_results = self.retrieve_class.retrieve_and_join_chunks(query, subzone=subzone_list,
-                                                                      n_results=chroma_n_results)
-        chroma_place_id = []
-        chroma_scores = np.zeros(len(chroma_results))
-        for i, result in enumerate(chroma_results):
-            chroma_place_id.append(result["place_id"])
-            chroma_scores[i] = result['score']
-        chroma_scores = (chroma_scores - np.min(chroma_scores)) / np.max(chroma_scores)  # Normalize from 0 to 1
+    def _stream_generation(self, messages: List[dict]):
+        """Stream generated tokens. With a resilience policy the first token must arrive within the generation
+        timeout, otherwise the fallback model is tried"""
+        def start_stream(model: str):
+            stream = iter(self.client_endpoint.chat.completions.create(
+                model=model,
+                messages=messages,
+                stream=True,
+                max_tokens=self.max_tokens,
+                temperature=self.temperature
+            ))
+            return next(stream, None), stream
+
+        min_timeout = self.resilience.min_generation_timeout if self.resilience is not None else 0
+        first_token, stream = self._call_with_fallback("generation", start_stream, self.llm_model, min_timeout)
+        if first_token is not None:
+            yield first_token
+        yield from stream
+
+    def _fuse_scores(self, chroma_results: List[Dict], bm25_scores: np.ndarray, bm25_top_n: np.ndarray) -> List:
+        """Combine normalized Chroma and BM25 scores of places found by both. Returns (doc, score) sorted by score"""
+        if not chroma_results:
+            return []
+        chroma_scores = np.array([result['score'] for result in chroma_results])
+        chroma_scores = (chroma_scores - np.min(chroma_scores)) / (np.max(chroma_scores) + 1e-5)  # Normalize from 0 to 1
         chroma_scores = 1 - chroma_scores  # Reverse order since smaller score means smaller distance
+        chroma_index = {result["place_id"]: i for i, result in enumerate(chroma_results)}
+
+        combined_results = []
+        for i in bm25_top_n:
+            index = chroma_index.get(self.doc_infos[i]["place_id"])
+            if index is not None:
+                combined_score = self.bm25_weight * bm25_scores[i] + (1 - self.bm25_weight) * chroma_scores[index]
+                combined_results.append((chroma_results[index], combined_score))
 
-        # BM25 processing
+        # Sort using combined_score in descending order
+        return sorted(combined_results, key=lambda x: x[1], reverse=True)
+
+    def chroma_bm25_combine(self, query: str, subzone_list: list, num_results: int, max_chroma_results: int,
+                            facet_mask: np.ndarray = None) -> List:
+        """Retrieve from Chroma and BM25 and then combine scores.
+        The candidate pool starts at num_results places and doubles until num_results combined places clear
+        fusion_score_threshold or max_chroma_results is reached.
+        facet_mask is a boolean mask over BM25 documents, only places in the mask are scored"""
+        # Same query and subzones give the same ranking, so reuse it and fetch documents from the store
+        cache_key = None
+        if self.retrieval_cache is not None:
+            facet_key = None
+            if facet_mask is not None:
+                facet_key = hashlib.sha1(np.packbits(facet_mask).tobytes()).hexdigest()
+            cache_key = self.retrieval_cache.make_key(query, subzone_list, num_results, max_chroma_results, facet_key)
+            ranked_places = self.retrieval_cache.get(cache_key)
+            if ranked_places is not None:
+                combined_doc = []
+                for place_id, chroma_score, _ in ranked_places:
+                    joined_place = self.retrieve_class.get_joined_place(place_id)
+                    if joined_place is not None:
+                        combined_doc.append({**joined_place, 'score': chroma_score})
+                self.last_retrieval_stats = {"cache_hit": True, "combined": len(combined_doc)}
+                self.trace.set(**self.last_retrieval_stats)
+                return combined_doc
+
+        allowed_place_ids = None
+        if facet_mask is not None:
+            allowed_place_ids = [self.doc_infos[i]["place_id"] for i in np.flatnonzero(facet_mask)]
+
+        # BM25 processing. Scores are computed once, widening only takes more of the ranking
         if subzone_list:
             bm25_location = " ".join(loc for loc in subzone_list)
         else:
             bm25_location = ""
         bm25_query = query + " " + bm25_location
-        tokenized_query = word_tokenize(bm25_query.lower())
-        scores = self.bm25.get_scores(tokenized_query)
-        scores = (scores - np.min(scores)) / (np.max(scores) + 1e-5)  # Normalize to 1
-        top_n = np.argsort(scores)[::-1][:chroma_n_results * self.bm_search_multiplier]
-        bm25_results = []
-        for i in top_n:
-            bm25_results.append({
-                "place_id": self.doc_infos[i]["place_id"],
-                "place_name": self.doc_infos[i]["place_name"],
-                "bm25_score": scores[i],
-            })
-        # Combining
-        combined_results = []
-        for bm25_result in bm25_results:
-            place_id = bm25_result['place_id']
-            if place_id in chroma_place_id:
-                index = chroma_place_id.index(place_id)
-                chroma_score = chroma_scores[index]
-                chroma_doc = chroma_results[index]
-
-                bm25_score = bm25_result['bm25_score']
-                combined_score = self.bm25_weight * bm25_score + (1 - self.bm25_weight) * chroma_score
-                combined_results.append((chroma_doc, combined_score))
-
-        # Sort using combined_score in descending order
-        combined_results = sorted(combined_results, key=lambda x: x[1], reverse=True)
-        combined_doc = [result[0] for result in combined_results]
-        return combined_doc
+        with self._stage("bm25"):
+            tokenized_query = word_tokenize(bm25_query.lower())
+            scores = self.bm25.get_scores(tokenized_query)
+            scores = (scores - np.min(scores)) / (np.max(scores) + 1e-5)  # Normalize to 1
+            if facet_mask is not None:
+                candidates = np.flatnonzero(facet_mask)
+            else:
+                candidates = np.arange(len(scores))
+            bm25_ranking = candidates[np.argsort(scores[candidates])[::-1]]
+
+        # Chroma processing. Query embedding and joined chunks are reused when widening
+        try:
+            with self._stage("embedding"):
+                query_embedding = self._call_stage("embedding", lambda: self.retrieve_class._get_embeddings(query))
+        except Exception as e:
+            self._degrade("embedding", "bm25_only", e)
+            return self._bm25_only(bm25_ranking, scores, subzone_list, num_results)
+        joined_places = {}
+        chroma_n_results = min(num_results, max_chroma_results)
+        num_rounds = 0
+        while True:
+            num_rounds += 1
+            try:
+                chroma_results = self.retrieve_class.retrieve_and_join_chunks(query, subzone=subzone_list,
+                                                                              n_results=chroma_n_results,
+                                                                              place_ids=allowed_place_ids,
+                                                                              query_embedding=query_embedding,
+                                                                              joined_places=joined_places,
+                                                                              trace=self.trace, raise_errors=True)
+            except Exception as e:
+                self._degrade("chroma_query", "bm25_only", e)
+                return self._bm25_only(bm25_ranking, scores, subzone_list, num_results)
+            bm25_n_results = chroma_n_results * self.bm_search_multiplier
+            combined_results = self._fuse_scores(chroma_results, scores, bm25_ranking[:bm25_n_results])
+            num_confident = sum(1 for _, score in combined_results if score >= self.fusion_score_threshold)
+            if num_confident >= num_results or chroma_n_results >= max_chroma_results:
+                break
+            # Too few places found by both or above threshold, widen candidate pool
+            chroma_n_results = min(chroma_n_results * 2, max_chroma_results)
+
+        self.last_retrieval_stats = {
+            "rounds": num_rounds,
+            "chroma_candidates": len(chroma_results),
+            "bm25_candidates": min(bm25_n_results, len(bm25_ranking)),
+            "combined": len(combined_results),
+            "above_threshold": num_confident,
+        }
+        self.trace.set(**self.last_retrieval_stats)
+        for source in ["chroma_candidates", "bm25_candidates", "combined"]:
+            RETRIEVAL_CANDIDATES.observe(self.last_retrieval_stats[source], source=source)
+
+        if cache_key is not None:
+            self.retrieval_cache.put(cache_key, [(doc['place_id'], doc['score'], combined_score)
+                                                 for doc, combined_score in combined_results])
+        return [result[0] for result in combined_results]
+
+    def _bm25_only(self, bm25_ranking: np.ndarray, scores: np.ndarray, subzone_list: list,
+                   num_results: int) -> List[Dict]:
+        """Places in the subzones ranked by BM25 alone, used when the query embedding or Chroma search failed.
+        Not cached, so the next request tries the full retrieval again"""
+        zones = set(subzone_list) if subzone_list else None
+        results = []
+        with self._stage("bm25_fallback"):
+            for i in bm25_ranking[:num_results * self.bm25_fallback_scan]:
+                joined_place = self.retrieve_class.get_joined_place(self.doc_infos[i]["place_id"])
+                if joined_place is not None and (zones is None or joined_place["place_zone"] in zones):
+                    # Score is a distance like Chroma scores, smaller is better
+                    results.append({**joined_place, 'score': 1 - float(scores[i])})
+                    if len(results) >= num_results:
+                        break
+        self.last_retrieval_stats = {"bm25_only": True, "combined": len(results)}
+        self.trace.set(**self.last_retrieval_stats)
+        return results
+
+    def _get_facet_filters(self, text: str) -> Tuple[Dict, np.ndarray | None]:
+        """Facet filters parsed from text and the mask of places matching all of them"""
+        facet_filters = {}
+        facet_mask = None
+        if self.facet_index:
+            with self._stage("facet_filter"):
+                facet_filters = self.facet_index.parse_filters(text)
+                facet_mask = self.facet_index.filter_mask(facet_filters)
+                if facet_mask is not None and not facet_mask.any():
+                    facet_filters, facet_mask = {}, None  # No place matches all filters, so do not filter
+                self.trace.set(num_filters=len(facet_filters),
+                               num_matching=int(facet_mask.sum()) if facet_mask is not None else None)
+        return facet_filters, facet_mask
+
+    def _find_subzones(self, location: str, get_nearby: bool) -> list | None:
+        """Subzone of location followed by nearby subzones, None if location is not found"""
+        subzone_search = {}
+        # If location is successfully parsed, get subzone and nearby subzones from location
+        if location:
+            with self._stage("subzone_lookup"):
+                if get_nearby:
+                    subzone_search = self.subzone_finder.find_subzones(location, max_dist=3)
+                else:
+                    subzone_search = self.subzone_finder.find_subzones(location, max_dist=1.5)
+                self.trace.set(num_subzones=len(subzone_search.get("nearby_subzones", [])))
+        return subzone_search.get("nearby_subzones", None)
+
+    def _search(self, full_query: str, check_subzone: list | None, num_results: int,
+                facet_mask: np.ndarray = None) -> List[Dict]:
+        """Places for the query within the subzones, with their distance from the first subzone"""
+        if not check_subzone:
+            # If location or subzone not known, just directly query
+            return self.chroma_bm25_combine(full_query, [], num_results, 20, facet_mask=facet_mask)
+        # If subzone known, can use filter to narrow down search and estimate distances
+        base_zone = check_subzone[0]
+        max_chroma_results = 10 * len(check_subzone)
+        combined_docs = self.chroma_bm25_combine(full_query, check_subzone, num_results, max_chroma_results,
+                                                 facet_mask=facet_mask)
+        # For each doc, get distance away from base_zone
+        for doc in combined_docs:
+            doc['distance'] = self.subzone_finder.subzone_distance(base_zone, doc['place_zone'])
+        return combined_docs
+
+    def _retrieve_places(self, full_query: str, check_subzone: list | None, num_results: int, get_nearby: bool,
+                         facet_mask: np.ndarray = None) -> List[Dict]:
+        """Retrieve places for the query within the subzones, sorted by distance.
+        Filters can match places elsewhere in the city but too few in the subzones, so places matching the facet
+        mask come first and the rest are filled up with unfiltered places"""
+        def by_distance(docs):
+            return sorted(docs, key=lambda doc: doc.get("distance", float("inf")))
+
+        with self._stage("retrieval", get_nearby=get_nearby):
+            all_docs = by_distance(self._search(full_query, check_subzone, num_results, facet_mask))
+            if facet_mask is not None and len(all_docs) < num_results:
+                self.trace.set(facet_matches=len(all_docs))
+                found = {doc['place_id'] for doc in all_docs}
+                unfiltered_docs = self._search(full_query, check_subzone, num_results)
+                all_docs += by_distance(doc for doc in unfiltered_docs if doc['place_id'] not in found)
+
+        if not all_docs:
+            EMPTY_RETRIEVALS.inc()
+        return all_docs[:num_results]
+
+    def retrieve(self, query: str, location: str = "", get_nearby: bool = False) -> List[Dict]:
+        """Retrieve places for a search query and location without calling the LLM"""
+        self.trace = self.tracer.start_trace("retrieve")
+        self._start_budget()
+        try:
+            _, facet_mask = self._get_facet_filters(query)
+            check_subzone = self._find_subzones(location, get_nearby)
+            num_results = 20 if get_nearby else 10
+            return self._retrieve_places(query, check_subzone, num_results, get_nearby, facet_mask)
+        finally:
+            self.trace.finish()
+            self.trace = NULL_TRACE
+
+    def _start_budget(self):
+        """Start the latency budget of a new request"""
+        self.budget = self.resilience.start_budget() if self.resilience is not None else None
+        self.degraded = []
+
+    def reset_history(self):
+        """Forget the conversation, e.g. when the user clears the chat"""
+        self.memory.clear()
+
+    @staticmethod
+    def _recommended_places(answer: str, docs: List[Dict]) -> List[str]:
+        """Names of retrieved places mentioned in the answer, or the top places if none are"""
+        answer = answer.lower()
+        places = [doc['place_name'] for doc in docs if doc['place_name'].lower() in answer]
+        return places or [doc['place_name'] for doc in docs[:3]]
 
     def get_response(self, question: str, chat_history: List[dict]):
         """Get response for a given question"""
-        # Update internal state history
-        self.query_history.append(chat_history[-1])  # Get latest query only
-        if len(chat_history) >= 2:
-            for msg in chat_history[-2:]:
-                self.full_history.append(msg)  # Get latest query and previous assistant reply
-        # Remove first entry in history to maintain length
-        if len(self.full_history) == self.max_num_full_history:
-            self.full_history.pop(0)
-
-        # Form strings containing user historical context
-        query_history_str = "".join(f"{msg['role']}: {msg['content']}\n" for msg in self.query_history)
-        full_history_str = "".join(f"{msg['role']}: {msg['content']}\n" for msg in self.full_history)
-
-        # Rewrite the query
-        rewritten_query = self._rewrite_query(question, query_history_str)
-        # print(f"\nRewritten query: {rewritten_query}")
-
-        # Reformat query for parsing
-        reformat_query = self._reformat_query(rewritten_query)
-        # print(f"\nReformat query: {reformat_query}")
+        self.trace = self.tracer.start_trace("get_response", turn=len(chat_history))
+        self._start_budget()
+        REQUESTS.inc()
+        start_time = time.perf_counter()
+        try:
+            full_answer = yield from self._get_response(question, chat_history)
+        finally:
+            REQUEST_LATENCY.observe(time.perf_counter() - start_time)
+            self.trace.finish()
+            self.trace = NULL_TRACE
+        return full_answer
+
+    def _get_response(self, question: str, chat_history: List[dict]):
+        request_start_time = time.perf_counter()
+        # Earlier turns of the conversation, bounded in size however long the session is
+        query_history_str = self.memory.query_history()
+        full_history_str = self.memory.chat_history()
+
+        # Rewrite the query. With a resilience policy, a failed or slow rewrite falls back to the raw question
+        with self._stage("rewrite_query", history_words=len(query_history_str.split())):
+            try:
+                rewritten_query = self._call_with_fallback(
+                    "rewrite", lambda model: self._rewrite_query(question, query_history_str, model), self.tool_model)
+            except Exception as e:
+                if self.resilience is None:
+                    raise
+                self._degrade("rewrite", "raw_query", e)
+                rewritten_query = question
+
+        # Reformat query for parsing. Without it the whole query is searched, with no location
+        with self._stage("reformat_query"):
+            try:
+                reformat_query = self._call_with_fallback(
+                    "reformat", lambda model: self._reformat_query(rewritten_query, model), self.tool_model)
+            except Exception as e:
+                if self.resilience is None:
+                    raise
+                self._degrade("reformat", "raw_query", e)
+                reformat_query = rewritten_query
 
         # Parse reformatted query
         text_dict = {}
@@ -347,55 +725,54 @@ class FoodRecommendationBot:
         get_nearby = text_dict.get('search_more') in ['True']
         location = text_dict.get('location', "")
 
-        all_docs = []
-        subzone_search = {}
-        # If location is successfully parsed, get subzone and nearby subzones from location
-        if location:
-            if get_nearby:
-                subzone_search = self.subzone_finder.find_subzones(location, max_dist=3)
-            else:
-                subzone_search = self.subzone_finder.find_subzones(location, max_dist=1.5)
-        check_subzone = subzone_search.get("nearby_subzones", None)
-        if check_subzone:
-            # If subzone known, can use filter to narrow down search and estimate distances
-            base_zone = subzone_search["nearby_subzones"][0]
-            nearby_subzone_list = subzone_search["nearby_subzones"]
-            chroma_n_results = 10 * len(nearby_subzone_list)
-            # print(f"Subzones found! Query: {full_query}, Subzones: {nearby_subzone_list}")
-            combined_docs = self.chroma_bm25_combine(full_query, nearby_subzone_list, chroma_n_results)
-            # print("Retrieved the following: ")
-            # For each doc, get distance away from base_zone
-            for doc in combined_docs:
-                doc_subzone = doc['place_zone']
-                distance = self.subzone_finder.subzone_distance(base_zone, doc_subzone)
-                doc['distance'] = distance
-                all_docs.append(doc)
-        else:
-            # If location or subzone not known, just directly query
-            # print(f"Location or subzone not found. Query: {full_query}")
-            chroma_n_results = 20
-            all_docs = self.chroma_bm25_combine(full_query, [], chroma_n_results)
-
-        # Sort by distance
-        all_docs = sorted(all_docs, key=lambda doc: doc.get("distance", float("inf")))
-        if get_nearby:
-            all_docs = all_docs[:20]
-        else:
-            all_docs = all_docs[:10]
+        # Map constraints like "cheap", "rated above 4.5" or "halal cafe" to facet filters
+        facet_filters, facet_mask = self._get_facet_filters(f"{question} {rewritten_query}")
+
+        num_results = 20 if get_nearby else 10
+        check_subzone = self._find_subzones(location, get_nearby)
+
+        # History-free queries with the same parsed intent get the same answer, so replay it from cache
+        cache_key = None
+        if self.response_cache is not None and len(chat_history) <= 1 and not self.save_output:
+            cache_key = self.response_cache.make_key(full_query, check_subzone or [], get_nearby, facet_filters)
+            cached = self.response_cache.get(cache_key)
+            self.trace.set(response_cache_hit=cached is not None)
+            if cached is not None:
+                cached_responses, cached_places = cached
+                full_answer = ""
+                for response in self.response_cache.replay(cached_responses):
+                    full_answer += response if isinstance(response, str) else response.get("sources", "")
+                    yield response
+                self.memory.add_turn(question, cached_places)
+                return full_answer
+
+        all_docs = self._retrieve_places(full_query, check_subzone, num_results, get_nearby, facet_mask)
 
         # Stream the generation
-        num_docs = len(all_docs)
-        # print(f"Total number of docs: {num_docs}")
         full_answer = ""
-        for response in self._generate(question, all_docs, full_history_str):
-            if isinstance(response, str):
-                full_answer += response
-                if not self.save_output:
-                    yield response
-            else:
-                full_answer += response.get("sources", "")
-                if not self.save_output:
-                    yield response
+        streamed_responses = []
+        num_tokens = 0
+        with self._stage("generation"):
+            for response in self._generate(question, all_docs, full_history_str):
+                streamed_responses.append(response)
+                if isinstance(response, str):
+                    if num_tokens == 0:
+                        TTFT.observe(time.perf_counter() - request_start_time)
+                        self.trace.set(ttft_ms=round(self.trace.elapsed_ms(), 2))
+                    num_tokens += 1
+                    full_answer += response
+                    if not self.save_output:
+                        yield response
+                else:
+                    full_answer += response.get("sources", "")
+                    if not self.save_output:
+                        yield response
+            self.trace.set(output_chunks=num_tokens, output_chars=len(full_answer))
+            OUTPUT_TOKENS.observe(num_tokens)
+        recommended_places = self._recommended_places(full_answer, all_docs)
+        self.memory.add_turn(question, recommended_places)
+        if cache_key is not None and not self.degraded:
+            self.response_cache.put(cache_key, (streamed_responses, recommended_places))
 
         if self.save_output:
             if not self.temperature:
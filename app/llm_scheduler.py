@@ -0,0 +1,190 @@
+"""
+Admission control for LLM provider calls: per-model concurrency limits with a bounded priority wait queue
+"""
+import heapq
+import itertools
+import threading
+import time
+from types import SimpleNamespace
+from typing import Dict
+
+from metrics import REGISTRY
+
+QUEUE_DEPTH = REGISTRY.gauge("food_bot_llm_queue_depth", "Provider calls waiting for a concurrency slot")
+ACTIVE_CALLS = REGISTRY.gauge("food_bot_llm_active_calls", "Provider calls in progress")
+QUEUE_WAIT = REGISTRY.histogram("food_bot_llm_queue_wait_seconds", "Time provider calls waited for a slot")
+REJECTED_CALLS = REGISTRY.counter("food_bot_llm_rejected_total", "Provider calls rejected by the scheduler")
+
+# Lower value is served first. Short rewrite, reformat and embedding calls go ahead of long generations
+PRIORITIES = {"tool": 0, "embedding": 0, "generation": 1}
+
+
+class SchedulerRejected(Exception):
+    """Call was not admitted, the provider is saturated"""
+
+
+class QueueFullError(SchedulerRejected):
+    pass
+
+
+class QueueTimeoutError(SchedulerRejected):
+    pass
+
+
+class _Waiter:
+    def __init__(self):
+        self.event = threading.Event()
+        self.granted = False
+
+
+class ConcurrencyLimiter:
+    def __init__(self, name: str, max_concurrency: int, max_queue_size: int):
+        """
+        Allow max_concurrency calls at once. Further calls wait in a priority queue of at most max_queue_size,
+        and are rejected immediately when it is full. A released slot is handed to the highest priority waiter.
+        """
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue_size = max_queue_size
+        self._active = 0
+        self._waiters = []  # Heap of (priority, sequence, waiter)
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+
+    def acquire(self, kind: str, timeout: float):
+        """Wait up to timeout seconds for a slot for a call of kind (tool, embedding or generation)"""
+        start_time = time.monotonic()
+        with self._lock:
+            if self._active < self.max_concurrency and not self._waiters:
+                self._active += 1
+                ACTIVE_CALLS.set(self._active, model=self.name)
+                QUEUE_WAIT.observe(0, model=self.name, kind=kind)
+                return
+            if len(self._waiters) >= self.max_queue_size:
+                REJECTED_CALLS.inc(model=self.name, reason="queue_full")
+                raise QueueFullError(f"{len(self._waiters)} calls already waiting for {self.name}")
+            waiter = _Waiter()
+            entry = (PRIORITIES.get(kind, 1), next(self._sequence), waiter)
+            heapq.heappush(self._waiters, entry)
+            QUEUE_DEPTH.set(len(self._waiters), model=self.name)
+
+        waiter.event.wait(timeout)
+        with self._lock:
+            if not waiter.granted:
+                # Timed out, leave the queue
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+                QUEUE_DEPTH.set(len(self._waiters), model=self.name)
+                REJECTED_CALLS.inc(model=self.name, reason="timeout")
+                raise QueueTimeoutError(f"Waited {timeout}s for {self.name}")
+        QUEUE_WAIT.observe(time.monotonic() - start_time, model=self.name, kind=kind)
+
+    def release(self):
+        with self._lock:
+            if self._waiters:
+                # Hand the slot over to the next waiter, the number of active calls stays the same
+                _, _, waiter = heapq.heappop(self._waiters)
+                waiter.granted = True
+                waiter.event.set()
+                QUEUE_DEPTH.set(len(self._waiters), model=self.name)
+            else:
+                self._active -= 1
+                ACTIVE_CALLS.set(self._active, model=self.name)
+
+    def stats(self) -> Dict:
+        return {"active": self._active, "waiting": len(self._waiters)}
+
+
+class _HeldStream:
+    def __init__(self, stream, limiter: ConcurrencyLimiter):
+        """Iterate over a streamed response, releasing the concurrency slot when it ends, is closed or dropped"""
+        self._stream = stream
+        self._iterator = iter(stream)
+        self._limiter = limiter
+        self._released = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._iterator)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        if not self._released:
+            self._released = True
+            self._limiter.release()
+            if hasattr(self._stream, "close"):
+                self._stream.close()
+
+    def __del__(self):
+        self.close()
+
+
+class _ScheduledCompletions:
+    def __init__(self, scheduler: "ScheduledClient"):
+        self.scheduler = scheduler
+
+    def create(self, model: str, stream: bool = False, **kwargs):
+        scheduler = self.scheduler
+        limiter = scheduler.get_limiter(model)
+        kind = "generation" if stream else "tool"
+        limiter.acquire(kind, scheduler.queue_timeout)
+        try:
+            response = scheduler.client.chat.completions.create(model=model, stream=stream, **kwargs)
+        except BaseException:
+            limiter.release()
+            raise
+        if not stream:
+            limiter.release()
+            return response
+        return _HeldStream(response, limiter)
+
+
+class _ScheduledEmbeddings:
+    def __init__(self, scheduler: "ScheduledClient"):
+        self.scheduler = scheduler
+
+    def create(self, model: str, **kwargs):
+        limiter = self.scheduler.get_limiter(model)
+        limiter.acquire("embedding", self.scheduler.queue_timeout)
+        try:
+            return self.scheduler.client.embeddings.create(model=model, **kwargs)
+        finally:
+            limiter.release()
+
+
+class ScheduledClient:
+    def __init__(self, client, model_limits: Dict[str, int] = None, default_limit: int = 8,
+                 max_queue_size: int = 32, queue_timeout: float = 10):
+        """
+        Wrap a client with the Together interface so calls to each model are limited to model_limits[model]
+        (default_limit if not listed) at once. A streaming generation holds its slot until the stream ends.
+        Calls raise SchedulerRejected if max_queue_size calls are already waiting or no slot frees up
+        within queue_timeout seconds. Share one instance between all sessions.
+        """
+        self.client = client
+        self.model_limits = model_limits or {}
+        self.default_limit = default_limit
+        self.max_queue_size = max_queue_size
+        self.queue_timeout = queue_timeout
+        self._limiters: Dict[str, ConcurrencyLimiter] = {}
+        self._lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=_ScheduledCompletions(self))
+        self.embeddings = _ScheduledEmbeddings(self)
+
+    def get_limiter(self, model: str) -> ConcurrencyLimiter:
+        with self._lock:
+            limiter = self._limiters.get(model)
+            if limiter is None:
+                limiter = ConcurrencyLimiter(model, self.model_limits.get(model, self.default_limit),
+                                             self.max_queue_size)
+                self._limiters[model] = limiter
+            return limiter
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {model: limiter.stats() for model, limiter in self._limiters.items()}
@@ -0,0 +1,170 @@
+"""
+Background writer that batches query logs to a pluggable sink (Firestore, JSONL file, SQLite or no-op)
+"""
+import atexit
+import json
+import queue
+import sqlite3
+import threading
+import time
+from typing import Dict, List
+
+
+class NullSink:
+    """Discard all records"""
+
+    def write_batch(self, records: List[Dict]):
+        pass
+
+    def close(self):
+        pass
+
+
+class JsonlSink:
+    def __init__(self, path: str):
+        """Append records as JSON lines to a local file"""
+        self.path = path
+
+    def write_batch(self, records: List[Dict]):
+        with open(self.path, "a", encoding="utf-8") as file:
+            for record in records:
+                file.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+
+    def close(self):
+        pass
+
+
+class SQLiteSink:
+    def __init__(self, path: str):
+        """Insert records into a query_logs table of a local SQLite database"""
+        self.path = path
+        self.conn = None
+
+    def write_batch(self, records: List[Dict]):
+        # Connection is created in the writer thread that uses it
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.path)
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS query_logs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    session_id TEXT,
+                    timestamp TEXT,
+                    query TEXT,
+                    response TEXT
+                )
+            """)
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO query_logs (session_id, timestamp, query, response) VALUES (?, ?, ?, ?)",
+                [(record.get("session_id"), str(record.get("timestamp")), record.get("query"), record.get("response"))
+                 for record in records])
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+class FirestoreSink:
+    def __init__(self, db, collection: str = "queries_new"):
+        """Write each query as its own document under {collection}/{session_id}/queries using batched writes,
+        so session documents do not grow with every turn"""
+        self.db = db
+        self.collection = collection
+        self.max_batch_writes = 500  # Firestore limit of writes per batch
+
+    def write_batch(self, records: List[Dict]):
+        for start in range(0, len(records), self.max_batch_writes):
+            batch = self.db.batch()
+            for record in records[start:start + self.max_batch_writes]:
+                doc_ref = (self.db.collection(self.collection).document(record["session_id"])
+                           .collection("queries").document())
+                batch.set(doc_ref, {key: value for key, value in record.items() if key != "session_id"})
+            batch.commit()
+
+    def close(self):
+        pass
+
+
+class BackgroundLogWriter:
+    def __init__(self, sink, max_queue_size: int = 1000, batch_size: int = 50, flush_interval: float = 2.0):
+        """
+        Queue records in memory and write them to sink in batches from a background thread.
+        Records are dropped (and counted) when the queue is full, so submitting never blocks a request.
+        A batch is written when batch_size records are queued or flush_interval seconds have passed.
+        """
+        self.sink = sink
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.num_submitted = 0
+        self.num_written = 0
+        self.num_dropped = 0
+        self.num_failed = 0
+        self._stats_lock = threading.Lock()
+
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, record: Dict, timeout: float = None) -> bool:
+        """Queue a record. Waits up to timeout seconds for space if given, otherwise drops it if queue is full"""
+        try:
+            if timeout:
+                self._queue.put(record, timeout=timeout)
+            else:
+                self._queue.put_nowait(record)
+        except queue.Full:
+            with self._stats_lock:
+                self.num_dropped += 1
+            return False
+        with self._stats_lock:
+            self.num_submitted += 1
+        return True
+
+    def _write(self, records: List[Dict]):
+        try:
+            self.sink.write_batch(records)
+            self.num_written += len(records)
+        except Exception as e:
+            self.num_failed += len(records)
+            print(f"Error writing {len(records)} log records: {e}")
+        finally:
+            for _ in records:
+                self._queue.task_done()
+
+    def _run(self):
+        while not (self._stop_event.is_set() and self._queue.empty()):
+            records = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(records) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or (self._stop_event.is_set() and self._queue.empty()):
+                    break
+                try:
+                    records.append(self._queue.get(timeout=min(remaining, 0.1)))
+                except queue.Empty:
+                    continue
+            if records:
+                self._write(records)
+        self.sink.close()
+
+    def flush(self):
+        """Wait until all queued records are written"""
+        self._queue.join()
+
+    def close(self):
+        """Write remaining records and stop the background thread"""
+        if self._thread.is_alive():
+            self._stop_event.set()
+            self._thread.join()
+
+    def stats(self) -> Dict:
+        return {
+            "submitted": self.num_submitted,
+            "written": self.num_written,
+            "dropped": self.num_dropped,
+            "failed": self.num_failed,
+            "queued": self._queue.qsize(),
+        }
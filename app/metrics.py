@@ -0,0 +1,173 @@
+"""
+In-process metrics registry (counters, gauges, histograms) exported in Prometheus text format
+"""
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Tuple
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384)
+COUNT_BUCKETS = (0, 5, 10, 20, 40, 80, 160, 320, 640)
+
+
+def _format_labels(labels: Tuple, extra: str = "") -> str:
+    parts = [f'{key}="{value}"' for key, value in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self.type = "counter"
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(sorted(labels.items())), 0)
+
+    def total(self) -> float:
+        """Sum over all label values"""
+        with self._lock:
+            return sum(self._values.values())
+
+    def samples(self):
+        with self._lock:
+            return [(f"{self.name}{_format_labels(key)}", value) for key, value in self._values.items()]
+
+
+class Gauge(Counter):
+    def __init__(self, name: str, documentation: str):
+        super().__init__(name, documentation)
+        self.type = "gauge"
+
+    def set(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = value
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, buckets: Tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.type = "histogram"
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[Tuple, list] = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            values = self._values.get(key)
+            if values is None:
+                values = self._values[key] = [0] * (len(self.buckets) + 2)
+            for i, upper in enumerate(self.buckets):
+                if value <= upper:
+                    values[i] += 1
+            values[-2] += value
+            values[-1] += 1
+
+    def count(self, **labels) -> int:
+        values = self._values.get(tuple(sorted(labels.items())))
+        return values[-1] if values else 0
+
+    def mean(self, **labels) -> float:
+        values = self._values.get(tuple(sorted(labels.items())))
+        return values[-2] / values[-1] if values and values[-1] else 0.0
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, values in self._values.items():
+                for upper, bucket_count in zip(self.buckets, values):
+                    bucket_label = f'le="{upper}"'
+                    samples.append((f"{self.name}_bucket{_format_labels(key, bucket_label)}", bucket_count))
+                inf_label = 'le="+Inf"'
+                samples.append((f"{self.name}_bucket{_format_labels(key, inf_label)}", values[-1]))
+                samples.append((f"{self.name}_sum{_format_labels(key)}", values[-2]))
+                samples.append((f"{self.name}_count{_format_labels(key)}", values[-1]))
+        return samples
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, metric_class, name: str, documentation: str, **kwargs):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = metric_class(name, documentation, **kwargs)
+            return self._metrics[name]
+
+    def counter(self, name: str, documentation: str) -> Counter:
+        return self._get_or_create(Counter, name, documentation)
+
+    def gauge(self, name: str, documentation: str) -> Gauge:
+        return self._get_or_create(Gauge, name, documentation)
+
+    def histogram(self, name: str, documentation: str, buckets: Tuple = LATENCY_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, documentation, buckets=buckets)
+
+    def render_prometheus(self) -> str:
+        """All metrics in Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for sample_name, value in metric.samples():
+                lines.append(f"{sample_name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write_to_file(self, path: str):
+        """Write metrics to a file, e.g. for the node exporter textfile collector"""
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w") as file:
+            file.write(self.render_prometheus())
+        os.replace(temp_path, path)
+
+    def start_http_server(self, port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+        """Serve metrics at /metrics from a background thread"""
+        registry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.render_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+# Registry shared by the whole process
+REGISTRY = MetricsRegistry()
+
+# Metrics recorded by more than one module
+STAGE_LATENCY = REGISTRY.histogram("food_bot_stage_latency_seconds", "Time spent in each stage of a chat request")
+LLM_CALLS = REGISTRY.counter("food_bot_llm_calls_total", "Calls to the LLM provider")
+LLM_ERRORS = REGISTRY.counter("food_bot_llm_errors_total", "Failed calls to the LLM provider")
@@ -0,0 +1,101 @@
+"""
+Bounded caches shared across chat sessions. Entries are tagged with the index version (BM25 file and Chroma
+collection), so rebuilding the indexes invalidates them
+"""
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, List
+from metrics import REGISTRY
+
+CACHE_REQUESTS = REGISTRY.counter("food_bot_cache_requests_total", "Cache lookups by cache and result")
+
+
+class TTLCache:
+    cache_name = "cache"  # Label of the cache in metrics
+
+    def __init__(self, max_size: int = 1000, ttl_seconds: float = 3600):
+        """Least recently used cache with a time-to-live per entry. Safe to share between threads"""
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.index_version = None
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (expiry time, value)
+        self._lock = threading.Lock()
+
+    def set_index_version(self, index_version: str):
+        """Clear all entries if they were cached against a different index version"""
+        with self._lock:
+            if index_version != self.index_version:
+                self._entries.clear()
+                self.index_version = index_version
+
+    def get(self, key: Hashable):
+        """Get cached value, None if missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                CACHE_REQUESTS.inc(cache=self.cache_name, result="miss")
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            CACHE_REQUESTS.inc(cache=self.cache_name, result="hit")
+            return entry[1]
+
+    def put(self, key: Hashable, value):
+        """Add value to cache, evicting least recently used entries beyond max_size"""
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class ResponseCache(TTLCache):
+    """Cache of streamed answers for history-free queries, keyed on the parsed intent of the query.
+    Values are (streamed responses, names of recommended places)"""
+    cache_name = "response"
+
+    @staticmethod
+    def make_key(search_text: str, subzone_list: List[str], search_more: bool, filters: Dict = None) -> tuple:
+        normalized_text = " ".join(re.findall(r"\w+", search_text.lower()))
+        subzones = tuple(sorted(zone.lower() for zone in subzone_list))
+        filter_items = tuple(sorted((facet, str(sorted(values)) if isinstance(values, set) else str(values))
+                                    for facet, values in (filters or {}).items()))
+        return normalized_text, subzones, bool(search_more), filter_items
+
+    @staticmethod
+    def replay(responses: List):
+        """Replay a cached answer as a stream of tokens (and source dict, if any)"""
+        for response in responses:
+            yield response
+
+
+class RetrievalCache(TTLCache):
+    """Cache of ranked retrieval results (place_id, Chroma score, combined score) without document copies.
+    Documents are fetched from a shared DocumentStore"""
+    cache_name = "retrieval"
+
+    @staticmethod
+    def make_key(search_text: str, subzone_list: List[str], num_results: int, max_chroma_results: int,
+                 facet_key: str = None) -> tuple:
+        normalized_text = " ".join(re.findall(r"\w+", search_text.lower()))
+        subzones = tuple(sorted(zone.lower() for zone in subzone_list))
+        return normalized_text, subzones, num_results, max_chroma_results, facet_key
+
+
+class DocumentStore(TTLCache):
+    """Joined chunks of each place keyed by place_id, shared by all sessions"""
+    cache_name = "document"
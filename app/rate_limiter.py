@@ -0,0 +1,200 @@
+"""
+In-memory sliding window rate limiter with optional write-behind persistence
+"""
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Dict, List, Tuple
+
+
+def client_address(forwarded_for: str, trusted_proxy_hops: int, peer_address: str = None) -> str | None:
+    """
+    Client address for rate limiting. Each proxy appends the address it received the request from to
+    X-Forwarded-For, and entries left of those are written by the client, so the entry trusted_proxy_hops from the
+    right is the one added by the outermost trusted proxy. Falls back to the socket peer address if there are no
+    trusted proxies or the header has fewer entries.
+    """
+    entries = [entry.strip() for entry in (forwarded_for or "").split(",") if entry.strip()]
+    if trusted_proxy_hops > 0 and len(entries) >= trusted_proxy_hops:
+        return entries[-trusted_proxy_hops]
+    return peer_address
+
+
+class FirestoreRateLimitStore:
+    def __init__(self, db, collection: str = "ip_tracking"):
+        """Persist query timestamps per client in Firestore, using the same document format as before"""
+        self.db = db
+        self.collection = collection
+
+    def load(self, client_id: str) -> List[float]:
+        doc = self.db.collection(self.collection).document(client_id).get()
+        if not doc.exists:
+            return []
+        timestamps = []
+        for timestamp_str in doc.to_dict().get("query_history", []):
+            try:
+                dt = datetime.fromisoformat(timestamp_str)
+            except (TypeError, ValueError):
+                continue
+            if dt.tzinfo is None:
+                dt = dt.replace(tzinfo=timezone.utc)
+            timestamps.append(dt.timestamp())
+        return timestamps
+
+    def save(self, client_id: str, timestamps: List[float]):
+        query_history = [datetime.fromtimestamp(timestamp, timezone.utc).isoformat() for timestamp in timestamps]
+        self.db.collection(self.collection).document(client_id).set({
+            "last_query_time": query_history[-1] if query_history else None,
+            "query_history": query_history
+        })
+
+
+class SlidingWindowRateLimiter:
+    def __init__(self, cooldown_seconds: float, max_requests: int, window_seconds: float, store=None,
+                 persist_interval: float = 30, evict_interval: float = 60):
+        """
+        Limit each client to max_requests per window_seconds, with at least cooldown_seconds between requests.
+        Timestamps are kept in memory per client. If a store is given (with load and save methods), a client's
+        history is loaded on first use and changed histories are written back every persist_interval seconds
+        by a background thread, so checks never wait on the network after the first request. Every evict_interval
+        seconds, clients whose last request left the window and whose history is saved are dropped from memory.
+        """
+        self.cooldown_seconds = cooldown_seconds
+        self.max_requests = max_requests
+        self.window_seconds = window_seconds
+        self.store = store
+        self.persist_interval = persist_interval
+        self.evict_interval = evict_interval
+        self._last_evict = time.time()
+
+        self._windows: Dict[str, deque] = {}
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._persist_thread = None
+        if self.store is not None:
+            self._persist_thread = threading.Thread(target=self._persist_loop, daemon=True)
+            self._persist_thread.start()
+
+    def _load(self, client_id: str):
+        """Load history of a client not in memory from the store, without holding the lock during the read"""
+        if self.store is None:
+            return
+        with self._lock:
+            if client_id in self._windows:
+                return
+        try:
+            timestamps = sorted(self.store.load(client_id))
+        except Exception as e:
+            print(f"Error loading rate limit history for {client_id}: {e}")
+            timestamps = []
+        with self._lock:
+            # Another thread may have loaded or recorded the client meanwhile
+            self._windows.setdefault(client_id, deque(timestamps))
+
+    def _get_window(self, client_id: str, now: float) -> deque:
+        """Get timestamps of client within the window. Must be called with lock held"""
+        if now - self._last_evict >= self.evict_interval:
+            self._evict(now)
+        window = self._windows.setdefault(client_id, deque())
+        cutoff = now - self.window_seconds
+        while window and window[0] <= cutoff:
+            window.popleft()
+        return window
+
+    def _evict(self, now: float):
+        """Drop clients with no request in the window and no unsaved history. Must be called with lock held"""
+        cutoff = now - self.window_seconds
+        stale = [client_id for client_id, window in self._windows.items()
+                 if (not window or window[-1] <= cutoff) and client_id not in self._dirty]
+        for client_id in stale:
+            del self._windows[client_id]
+        self._last_evict = now
+
+    def _rejection(self, window: deque, now: float) -> str:
+        """Message if a request with the given window is over the limits, empty if allowed"""
+        if window and now - window[-1] < self.cooldown_seconds:
+            wait_seconds = self.cooldown_seconds - int(now - window[-1])
+            return f"Please wait {wait_seconds} seconds before making another query."
+        if len(window) >= self.max_requests:
+            minutes = int((window[0] + self.window_seconds - now) / 60)
+            return f"Query limit reached. Please wait {minutes} minutes before making another query."
+        return ""
+
+    def check(self, client_id: str) -> Tuple[bool, str]:
+        """Check if client can make a request without recording it. Returns (allowed, message)"""
+        self._load(client_id)
+        now = time.time()
+        with self._lock:
+            message = self._rejection(self._get_window(client_id, now), now)
+        return not message, message
+
+    def try_acquire(self, client_id: str) -> Tuple[bool, str]:
+        """
+        Check and record a request of client in one step, so concurrent requests of a client cannot all pass the
+        check before any of them is recorded. Returns (allowed, message)
+        """
+        self._load(client_id)
+        now = time.time()
+        with self._lock:
+            window = self._get_window(client_id, now)
+            message = self._rejection(window, now)
+            if not message:
+                window.append(now)
+                if self.store is not None:
+                    self._dirty.add(client_id)
+        return not message, message
+
+    def record(self, client_id: str):
+        """Record a request made by client"""
+        self._load(client_id)
+        now = time.time()
+        with self._lock:
+            self._get_window(client_id, now).append(now)
+            if self.store is not None:
+                self._dirty.add(client_id)
+
+    def refund(self, client_id: str):
+        """Forget the latest request of client, for a request allowed by try_acquire that was not served"""
+        with self._lock:
+            window = self._windows.get(client_id)
+            if window:
+                window.pop()
+                if self.store is not None:
+                    self._dirty.add(client_id)
+
+    def remaining(self, client_id: str) -> int:
+        """Number of requests client can still make in the current window"""
+        self._load(client_id)
+        with self._lock:
+            return max(0, self.max_requests - len(self._get_window(client_id, time.time())))
+
+    def reset_time(self, client_id: str) -> float | None:
+        """Epoch time when the oldest request of client leaves the window, None if no requests"""
+        self._load(client_id)
+        with self._lock:
+            window = self._get_window(client_id, time.time())
+            return window[0] + self.window_seconds if window else None
+
+    def flush(self):
+        """Write changed client histories to the store"""
+        with self._lock:
+            dirty_windows = {client_id: list(self._windows[client_id]) for client_id in self._dirty}
+            self._dirty.clear()
+        for client_id, timestamps in dirty_windows.items():
+            try:
+                self.store.save(client_id, timestamps)
+            except Exception as e:
+                print(f"Error saving rate limit history for {client_id}: {e}")
+
+    def _persist_loop(self):
+        while not self._stop_event.wait(self.persist_interval):
+            self.flush()
+
+    def close(self):
+        """Stop background persistence after a final flush"""
+        if self._persist_thread is not None:
+            self._stop_event.set()
+            self._persist_thread.join()
+            self.flush()
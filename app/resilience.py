@@ -0,0 +1,136 @@
+"""
+Per-request latency budget, stage timeouts and hedged provider calls
+"""
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Dict
+
+import numpy as np
+
+from metrics import REGISTRY
+
+STAGE_TIMEOUTS = REGISTRY.counter("food_bot_stage_timeouts_total", "Provider calls that ran out of time")
+HEDGED_CALLS = REGISTRY.counter("food_bot_hedged_calls_total", "Backup calls sent, and how many of them won")
+DEGRADED = REGISTRY.counter("food_bot_degraded_total", "Stages answered in degraded mode, by stage and mode")
+
+
+class StageTimeout(TimeoutError):
+    pass
+
+
+class LatencyBudget:
+    def __init__(self, total_seconds: float):
+        """Time left for a request, shared by its stages"""
+        self.total_seconds = total_seconds
+        self.deadline = time.monotonic() + total_seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.deadline - time.monotonic())
+
+
+class LatencyTracker:
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        """Recent latencies of successful calls per stage"""
+        self.min_samples = min_samples
+        self._latencies = defaultdict(lambda: deque(maxlen=window))
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float):
+        with self._lock:
+            self._latencies[stage].append(seconds)
+
+    def percentile(self, stage: str, q: float) -> float | None:
+        """q-th percentile of recent latencies, None until min_samples calls were recorded"""
+        with self._lock:
+            latencies = list(self._latencies[stage])
+        if len(latencies) < self.min_samples:
+            return None
+        return float(np.percentile(latencies, q))
+
+
+class ResiliencePolicy:
+    def __init__(self, budget_seconds: float = 20, stage_timeouts: Dict[str, float] = None,
+                 hedge_stages=("rewrite", "reformat", "embedding"), hedge_percentile: float = 95,
+                 default_hedge_delay: float = 2.0, min_hedge_delay: float = 0.1, fallback_model: str = None,
+                 min_generation_timeout: float = 5, max_workers: int = 32):
+        """
+        Each request gets budget_seconds in total. A stage may use at most stage_timeouts[stage] seconds and
+        never more than what is left of the budget.
+        Idempotent stages in hedge_stages send a backup call when the first has not answered after the
+        hedge_percentile latency of recent calls (default_hedge_delay until enough calls are seen), and use
+        whichever answers first.
+        fallback_model is tried for the query tools and generation when the configured model fails or times out.
+        Generation always gets at least min_generation_timeout seconds, so an answer is attempted even if
+        earlier stages used up the budget. Share one instance between all sessions.
+        """
+        self.budget_seconds = budget_seconds
+        self.stage_timeouts = stage_timeouts or {}
+        self.hedge_stages = set(hedge_stages)
+        self.hedge_percentile = hedge_percentile
+        self.default_hedge_delay = default_hedge_delay
+        self.min_hedge_delay = min_hedge_delay
+        self.fallback_model = fallback_model
+        self.min_generation_timeout = min_generation_timeout
+        self.latency_tracker = LatencyTracker()
+        # Calls run in these threads so they can be abandoned on timeout. An abandoned call keeps its thread
+        # until the provider answers, so max_workers bounds calls in flight
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="provider_call")
+
+    def start_budget(self) -> LatencyBudget:
+        return LatencyBudget(self.budget_seconds)
+
+    def hedge_delay(self, stage: str) -> float:
+        delay = self.latency_tracker.percentile(stage, self.hedge_percentile)
+        if delay is None:
+            return self.default_hedge_delay
+        return max(delay, self.min_hedge_delay)
+
+    def stage_timeout(self, stage: str, budget: LatencyBudget, min_timeout: float = 0) -> float:
+        return max(min(self.stage_timeouts.get(stage, float("inf")), budget.remaining()), min_timeout)
+
+    def call(self, stage: str, fn: Callable, budget: LatencyBudget, min_timeout: float = 0):
+        """
+        Run fn within the stage timeout, hedging it if stage is idempotent. Raises StageTimeout if no call
+        answered in time, or the error of the last call if all calls failed
+        """
+        timeout = self.stage_timeout(stage, budget, min_timeout)
+        if timeout <= 0:
+            STAGE_TIMEOUTS.inc(stage=stage)
+            raise StageTimeout(f"No time left in budget for {stage}")
+
+        def attempt():
+            start_time = time.monotonic()
+            result = fn()
+            self.latency_tracker.record(stage, time.monotonic() - start_time)
+            return result
+
+        start_time = time.monotonic()
+        deadline = start_time + timeout
+        can_hedge = stage in self.hedge_stages
+        hedge_time = start_time + self.hedge_delay(stage)
+        pending = {self._executor.submit(attempt)}
+        hedge_future = None
+        error = None
+        while pending:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            wait_until = min(deadline, hedge_time) if can_hedge and hedge_future is None else deadline
+            done, pending = wait(pending, timeout=max(0.0, wait_until - now), return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge_future:
+                        HEDGED_CALLS.inc(stage=stage, result="won")
+                    return future.result()
+                error = future.exception()
+            # Send backup call when the first is slow, or straight away if it failed
+            if can_hedge and hedge_future is None and (not pending or time.monotonic() >= hedge_time):
+                hedge_future = self._executor.submit(attempt)
+                pending.add(hedge_future)
+                HEDGED_CALLS.inc(stage=stage, result="sent")
+        if not pending and error is not None:
+            raise error
+        STAGE_TIMEOUTS.inc(stage=stage)
+        raise StageTimeout(f"{stage} did not answer within {timeout:.1f}s")
@@ -3,14 +3,20 @@ Retrieve and join chunks from Chroma database
 """
 from typing import List, Dict
 from collections import defaultdict
+from tracing import NULL_TRACE
+from metrics import REGISTRY, STAGE_LATENCY, LLM_CALLS, LLM_ERRORS
+import time
+
+CHROMA_ERRORS = REGISTRY.counter("food_bot_chroma_errors_total", "Failed Chroma queries or chunk fetches")
 
 
 class RetrieveChunkChroma:
-    def __init__(self, vector_store, client, model_name, n_first_lines: int = 3):
+    def __init__(self, vector_store, client, model_name, n_first_lines: int = 3, document_store=None):
         self.n_first_lines = n_first_lines
         self.vector_store = vector_store
         self.client = client
         self.model_name = model_name
+        self.document_store = document_store  # Optional cache of joined places shared across sessions
 
     def _extract_first_lines(self, text: str, num_lines: int = 3) -> tuple[str, str]:
         """Extract first n lines from text and return them along with the remaining text."""
@@ -21,10 +27,15 @@ class RetrieveChunkChroma:
 
     def _get_embeddings(self, text: str) -> list[float]:
         """Get embeddings for a text using Together API."""
-        response = self.client.embeddings.create(
-            input=text,
-            model=self.model_name
-        )
+        LLM_CALLS.inc(call="embedding")
+        try:
+            response = self.client.embeddings.create(
+                input=text,
+                model=self.model_name
+            )
+        except Exception:
+            LLM_ERRORS.inc(call="embedding")
+            raise
         return response.data[0].embedding
 
     def _get_all_chunks_for_place(self, place_id: str) -> List[Dict]:
@@ -47,17 +58,64 @@ class RetrieveChunkChroma:
 
             return sorted_chunks
         except Exception as e:
+            CHROMA_ERRORS.inc(operation="get_chunks")
             print(f"Error getting chunks for place {place_id}: {e}")
             return []
 
-    def retrieve_and_join_chunks(self, query: str, subzone: str | list = None, planning_area: str = None, n_results: int = 5) -> List[Dict]:
+    def _join_place_chunks(self, place_id: str) -> Dict | None:
+        """Get all chunks of a place and join them into a single text"""
+        all_chunks = self._get_all_chunks_for_place(place_id)
+        if not all_chunks:
+            return None
+
+        # Join all chunks for this place
+        joined_text = ""
+        for chunk in all_chunks:
+            first_lines, remaining_text = self._extract_first_lines(chunk['text'], self.n_first_lines)
+            if chunk['metadata']['chunk_index'] == 0:
+                joined_text += first_lines + "\n"
+            joined_text += remaining_text
+
+        # Get place info from first chunk
+        place_info = all_chunks[0]['metadata']
+        return {
+            'place_id': place_id,
+            'place_name': place_info['place_name'],
+            'rating': place_info['rating'],
+            'place_zone': place_info['place_zone'],
+            'place_area': place_info['place_area'],
+            'text': joined_text,
+            'num_chunks': len(all_chunks),
+            'metadata': place_info
+        }
+
+    def get_joined_place(self, place_id: str) -> Dict | None:
+        """Get joined chunks of a place from the document store, or from Chroma if not stored"""
+        if self.document_store is not None:
+            joined_place = self.document_store.get(place_id)
+            if joined_place is not None:
+                return joined_place
+        joined_place = self._join_place_chunks(place_id)
+        if joined_place is not None and self.document_store is not None:
+            self.document_store.put(place_id, joined_place)
+        return joined_place
+
+    def retrieve_and_join_chunks(self, query: str, subzone: str | list = None, planning_area: str = None, n_results: int = 5,
+                                 place_ids: list = None, query_embedding: list[float] = None,
+                                 joined_places: Dict = None, trace=NULL_TRACE,
+                                 raise_errors: bool = False) -> List[Dict]:
         """
         Search for relevant chunks and join them by place_id.
+        If place_ids is given, only chunks of those places are searched (e.g. places matching facet filters).
+        query_embedding and joined_places (place_id -> joined place) can be passed in to reuse work when
+        the same query is searched again with a larger n_results.
+        Errors are counted and give an empty list, or are raised if raise_errors so the caller can fall back.
         Returns a list of dictionaries containing joined text and metadata for each place.
         """
         try:
             # Get query embedding
-            query_embedding = self._get_embeddings(query)
+            if query_embedding is None:
+                query_embedding = self._get_embeddings(query)
 
             # Search in Chroma. Returns documents, metadata, distances
             filter_dict = None
@@ -88,11 +146,17 @@ class RetrieveChunkChroma:
                         }
                     ]
                 }
-            results = self.vector_store.query(
-                query_embeddings=[query_embedding],
-                n_results=n_results * 2,
-                where=filter_dict
-            )
+            if place_ids is not None:
+                place_filter = {'place_id': {'$in': list(place_ids)}}
+                filter_dict = {"$and": [filter_dict, place_filter]} if filter_dict else place_filter
+            start_time = time.perf_counter()
+            with trace.span("chroma_query", n_results=n_results * 2):
+                results = self.vector_store.query(
+                    query_embeddings=[query_embedding],
+                    n_results=n_results * 2,
+                    where=filter_dict
+                )
+            STAGE_LATENCY.observe(time.perf_counter() - start_time, stage="chroma_query")
 
             # Group chunks by place_id
             place_chunks = defaultdict(list)
@@ -105,41 +169,31 @@ class RetrieveChunkChroma:
                 })
 
             # For each place found, get all its chunks
+            if joined_places is None:
+                joined_places = {}
             joined_results = []
+            new_place_ids = [place_id for place_id in place_chunks if place_id not in joined_places]
+            start_time = time.perf_counter()
+            with trace.span("chunk_fetch", num_places=len(new_place_ids)):
+                for place_id in new_place_ids:
+                    joined_places[place_id] = self.get_joined_place(place_id)
+            STAGE_LATENCY.observe(time.perf_counter() - start_time, stage="chunk_fetch")
             for place_id, initial_chunks in place_chunks.items():
-                # Get all chunks for this place
-                all_chunks = self._get_all_chunks_for_place(place_id)
+                joined_place = joined_places[place_id]
+                if joined_place is None:
+                    continue
 
                 # Get the best score from initial search
                 best_score = min(chunk['score'] for chunk in initial_chunks)
-
-                # Join all chunks for this place
-                joined_text = ""
-                for chunk in all_chunks:
-                    first_lines, remaining_text = self._extract_first_lines(chunk['text'], self.n_first_lines)
-                    if chunk['metadata']['chunk_index'] == 0:
-                        joined_text += first_lines + "\n"
-                    joined_text += remaining_text
-
-                # Get place info from first chunk
-                place_info = all_chunks[0]['metadata']
-
-                joined_results.append({
-                    'place_id': place_id,
-                    'place_name': place_info['place_name'],
-                    'rating': place_info['rating'],
-                    'place_zone': place_info['place_zone'],
-                    'place_area': place_info['place_area'],
-                    'text': joined_text,
-                    'score': best_score,
-                    'num_chunks': len(all_chunks),
-                    'metadata': place_info
-                })
+                joined_results.append({**joined_place, 'score': best_score})
 
             # Sort results by rating
             joined_results.sort(key=lambda x: x['score'])
             return joined_results[:n_results]
 
         except Exception as e:
+            CHROMA_ERRORS.inc(operation="query")
             print(f"Error in retrieve_and_join_chunks: {e}")
+            if raise_errors:
+                raise
             return []
\ No newline at end of file
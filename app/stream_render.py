@@ -0,0 +1,92 @@
+"""
+Coalesce streamed tokens into fewer UI renders
+"""
+import time
+from typing import Callable, Dict
+
+from metrics import REGISTRY, COUNT_BUCKETS
+
+RENDERS = REGISTRY.histogram("food_bot_renders", "UI renders per streamed answer", buckets=COUNT_BUCKETS)
+RENDER_LAG = REGISTRY.histogram("food_bot_render_lag_seconds", "Time from last streamed token to final render")
+TOKEN_RATE = REGISTRY.histogram("food_bot_stream_tokens_per_second",
+                                "Tokens per second received from the provider and delivered to the browser",
+                                buckets=(5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000))
+
+
+class RenderScheduler:
+    def __init__(self, render_fn: Callable[[str], None], flush_interval: float = 0.05, flush_chars: int = 80,
+                 cursor: str = "▌"):
+        """
+        Buffer streamed tokens and re-render the full text only when flush_interval seconds have passed or
+        flush_chars new characters are pending since the last render.
+        render_fn is called with the text to display, e.g. st.empty().markdown
+        """
+        self.render_fn = render_fn
+        self.flush_interval = flush_interval
+        self.flush_chars = flush_chars
+        self.cursor = cursor
+
+        self.text = ""
+        self.pending_chars = 0
+        self.pending_tokens = 0
+        self.tokens_received = 0
+        self.tokens_delivered = 0
+        self.num_renders = 0
+        self.first_receive_time = None
+        self.last_receive_time = None
+        self.first_render_time = None
+        self.last_render_time = None
+
+    def add(self, token: str):
+        """Add a streamed token, rendering if a flush is due"""
+        now = time.perf_counter()
+        if self.first_receive_time is None:
+            self.first_receive_time = now
+        self.last_receive_time = now
+        self.text += token
+        self.tokens_received += 1
+        self.pending_tokens += 1
+        self.pending_chars += len(token)
+
+        if (self.last_render_time is None or now - self.last_render_time >= self.flush_interval
+                or self.pending_chars >= self.flush_chars):
+            self.flush()
+
+    def flush(self, final: bool = False):
+        """Render all text received so far"""
+        self.render_fn(self.text if final else self.text + self.cursor)
+        now = time.perf_counter()
+        if self.first_render_time is None:
+            self.first_render_time = now
+        self.last_render_time = now
+        self.tokens_delivered += self.pending_tokens
+        self.pending_tokens = 0
+        self.pending_chars = 0
+        self.num_renders += 1
+
+    def finish(self):
+        """Render final text without cursor and record the render metrics of the answer"""
+        self.flush(final=True)
+        stats = self.stats()
+        RENDERS.observe(stats["renders"])
+        if "render_lag_sec" in stats:
+            RENDER_LAG.observe(stats["render_lag_sec"])
+        for direction in ["received", "delivered"]:
+            tokens_per_sec = stats.get(f"{direction}_tokens_per_sec")
+            if tokens_per_sec is not None:
+                TOKEN_RATE.observe(tokens_per_sec, direction=direction)
+
+    def stats(self) -> Dict:
+        """Tokens per second received from the provider against tokens per second delivered to the browser"""
+        stats = {
+            "tokens_received": self.tokens_received,
+            "tokens_delivered": self.tokens_delivered,
+            "renders": self.num_renders,
+        }
+        if self.first_receive_time is not None:
+            receive_time = self.last_receive_time - self.first_receive_time
+            deliver_time = self.last_render_time - self.first_receive_time
+            stats["received_tokens_per_sec"] = round(self.tokens_received / receive_time, 1) if receive_time else None
+            stats["delivered_tokens_per_sec"] = round(self.tokens_delivered / deliver_time, 1) if deliver_time else None
+            stats["render_lag_sec"] = round(self.last_render_time - self.last_receive_time, 4)
+        return stats
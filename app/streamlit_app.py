@@ -1,10 +1,18 @@
 import streamlit as st
-from llm_gmap import FoodRecommendationBot
-import time
+from llm_gmap import FoodRecommendationBot, load_shared_indexes
+from query_cache import ResponseCache, RetrievalCache, DocumentStore
+from stream_render import RenderScheduler
+from rate_limiter import SlidingWindowRateLimiter, FirestoreRateLimitStore, client_address
+from log_writer import BackgroundLogWriter, FirestoreSink, JsonlSink, SQLiteSink, NullSink
+from tracing import Tracer
+from llm_scheduler import ScheduledClient, SchedulerRejected
+from embedding_batcher import BatchedEmbeddingClient
+from llm_backends import make_client
+from resilience import ResiliencePolicy
+from metrics import REGISTRY
 from dotenv import load_dotenv
 import os
-from datetime import datetime, timedelta, UTC
-import requests
+from datetime import datetime, UTC
 import firebase_admin
 from firebase_admin import credentials, firestore
 import pytz
@@ -36,62 +44,173 @@ if track_query:
 # LLM & embedding settings
 llm_model = "meta-llama/Meta-Llama-3.1-8B-Instruct-Turbo-128K"
 tool_model = "meta-llama/Meta-Llama-3.1-8B-Instruct-Turbo-128K"  # For query re-write and re-format
+# Backend of tool_model. Set to "ollama" or "llamacpp" with e.g. tool_model = "qwen2.5:3b" to run query re-write
+# and re-format on a local model, at LOCAL_LLM_BASE_URL if the server is not on its default port
+tool_backend = "together"
 embed_model_name = "BAAI/bge-large-en-v1.5"
 bm25_file = "rank_bm25result_k50"
 chroma_path = "chroma_bge_large_gmapfood_long_14Mar"
+facet_file = "facet_index"  # Optional facet table for pre-filtering
+if not os.path.exists(facet_file):
+    facet_file = None
 n_first_lines = 3
 
+# Response cache settings, shared across sessions for first-turn queries
+RESPONSE_CACHE_SIZE = 500  # Maximum number of cached answers
+RESPONSE_CACHE_TTL_SECONDS = 6 * 3600  # Time before a cached answer expires
+# Retrieval cache settings, shared across sessions for any turn resolving to the same query and subzones
+RETRIEVAL_CACHE_SIZE = 2000  # Maximum number of cached rankings
+RETRIEVAL_CACHE_TTL_SECONDS = 6 * 3600
+DOCUMENT_STORE_SIZE = 5000  # Maximum number of places with joined chunks kept in memory
+
+# Conversation memory per session: the last HISTORY_TURNS turns within HISTORY_TOKENS, with answers kept as the
+# places they recommended. Older turns are folded into a summary of HISTORY_SUMMARY_TOKENS, rewritten by tool_model
+# in the background if SUMMARIZE_HISTORY
+HISTORY_TURNS = 3
+HISTORY_TOKENS = 400
+HISTORY_SUMMARY_TOKENS = 150
+SUMMARIZE_HISTORY = True
+
+# Print a trace log line per request with timings of each stage
+TRACE_REQUESTS = True
+
+# Provider call scheduling, shared by all sessions. Calls beyond the limits wait in a queue where rewrites
+# go ahead of generations, and fail fast when the queue is full or the wait exceeds the timeout
+LLM_MAX_CONCURRENCY = 8  # Concurrent chat calls per model
+EMBED_MAX_CONCURRENCY = 16  # Concurrent embedding calls
+LLM_QUEUE_SIZE = 32
+LLM_QUEUE_TIMEOUT_SECONDS = 10
+TOOL_MAX_CONCURRENCY = 2  # Concurrent calls to a local tool_backend
+# Query embeddings of concurrent sessions are sent together, waiting up to EMBED_BATCH_WINDOW_MS for a batch of
+# EMBED_BATCH_SIZE. Set the window to None to send each query on its own
+EMBED_BATCH_SIZE = 32
+EMBED_BATCH_WINDOW_MS = 5
+
+# Resilience settings. Each request has a latency budget, and each provider call a timeout within it. Slow
+# rewrites, reformats and embeddings get a backup call after the HEDGE_PERCENTILE latency of recent calls.
+# Failed or late calls are retried on FALLBACK_MODEL, then the rewrite and reformat are skipped and a failed
+# embedding falls back to BM25 only
+REQUEST_BUDGET_SECONDS = 20
+STAGE_TIMEOUT_SECONDS = {"rewrite": 4, "reformat": 4, "embedding": 3, "generation": 10}  # Generation: first token
+HEDGE_PERCENTILE = 95
+FALLBACK_MODEL = "meta-llama/Llama-3.2-3B-Instruct-Turbo"  # Smaller model, None to disable
+
+# Metrics settings. Prometheus text format is served at http://<host>:METRICS_PORT/metrics if the port is set
+METRICS_PORT = 9100
+METRICS_HOST = "0.0.0.0"
+
+# Streaming render settings
+RENDER_INTERVAL_SECONDS = 0.05  # Minimum time between re-renders of the streamed answer
+RENDER_FLUSH_CHARS = 80  # Re-render earlier if this many new characters are pending
+
 # Rate limiting settings
 COOLDOWN_SECONDS = 2  # Time between queries
 MAX_QUERIES_PER_HOUR = 30  # Maximum queries per hour
 QUERY_WINDOW_HOURS = 1  # Time window for query counting
+RATE_LIMIT_PERSIST_SECONDS = 30  # Interval for writing query history to Firestore, if tracking queries
+# Reverse proxies in front of the app that append to X-Forwarded-For. Clients are keyed on the address added by
+# the outermost one, as entries further left are written by the client. 0 if clients connect directly
+TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS", "1"))
+
+# Query log settings. Logs go to Firestore if available, else to QUERY_LOG_FILE (.jsonl or .db) if set
+QUERY_LOG_FILE = None
+QUERY_LOG_QUEUE_SIZE = 1000  # Logs are dropped when this many are waiting to be written
+QUERY_LOG_BATCH_SIZE = 50
+QUERY_LOG_FLUSH_SECONDS = 2
 
-client = Together()
 vector_store = chromadb.PersistentClient(
     path=chroma_path,
     settings=Settings(anonymized_telemetry=False)
 ).get_collection("gmap_food")
 
 
-def get_client_ip():
-    """Get client IP address using an external API."""
+@st.cache_resource
+def get_response_cache():
+    """Response cache shared by all sessions of this process."""
+    return ResponseCache(max_size=RESPONSE_CACHE_SIZE, ttl_seconds=RESPONSE_CACHE_TTL_SECONDS)
+
+
+@st.cache_resource
+def get_retrieval_cache():
+    """Retrieval cache and document store shared by all sessions of this process."""
+    retrieval_cache = RetrievalCache(max_size=RETRIEVAL_CACHE_SIZE, ttl_seconds=RETRIEVAL_CACHE_TTL_SECONDS)
+    document_store = DocumentStore(max_size=DOCUMENT_STORE_SIZE, ttl_seconds=RETRIEVAL_CACHE_TTL_SECONDS)
+    return retrieval_cache, document_store
+
+
+@st.cache_resource
+def get_llm_client():
+    """Together client with per-model concurrency limits and batched embeddings shared by all sessions."""
+    client = ScheduledClient(Together(), model_limits={embed_model_name: EMBED_MAX_CONCURRENCY},
+                             default_limit=LLM_MAX_CONCURRENCY, max_queue_size=LLM_QUEUE_SIZE,
+                             queue_timeout=LLM_QUEUE_TIMEOUT_SECONDS)
+    if EMBED_BATCH_WINDOW_MS is None:
+        return client
+    return BatchedEmbeddingClient(client, max_batch_size=EMBED_BATCH_SIZE, max_wait_ms=EMBED_BATCH_WINDOW_MS)
+
+
+@st.cache_resource
+def get_tool_client():
+    """Client of a local tool_backend shared by all sessions, None if tools run on Together."""
+    if tool_backend == "together":
+        return None
+    return ScheduledClient(make_client(tool_backend), default_limit=TOOL_MAX_CONCURRENCY,
+                           max_queue_size=LLM_QUEUE_SIZE, queue_timeout=LLM_QUEUE_TIMEOUT_SECONDS)
+
+
+@st.cache_resource
+def get_resilience_policy():
+    """Latency budget and hedging policy shared by all sessions, so hedge delays learn from all requests."""
+    return ResiliencePolicy(budget_seconds=REQUEST_BUDGET_SECONDS, stage_timeouts=STAGE_TIMEOUT_SECONDS,
+                            hedge_percentile=HEDGE_PERCENTILE, fallback_model=FALLBACK_MODEL)
+
+
+@st.cache_resource
+def get_shared_indexes():
+    """BM25 index, facet index and subzone lookup loaded once and shared by all sessions."""
+    return load_shared_indexes(bm25_file, facet_file, vector_store, chroma_path)
+
+
+@st.cache_resource
+def get_rate_limiter():
+    """In-memory rate limiter shared by all sessions, persisted to Firestore in the background if available."""
+    store = FirestoreRateLimitStore(db, collection="ip_tracking") if track_query else None
+    return SlidingWindowRateLimiter(COOLDOWN_SECONDS, MAX_QUERIES_PER_HOUR, QUERY_WINDOW_HOURS * 3600,
+                                    store=store, persist_interval=RATE_LIMIT_PERSIST_SECONDS)
+
+
+def get_client_id():
+    """Identify client by the address added by the trusted proxy, falling back to the peer address or the session."""
+    address = client_address(st.context.headers.get("X-Forwarded-For", ""), TRUSTED_PROXY_HOPS,
+                             getattr(st.context, "ip_address", None))
+    return address or f"session_{st.session_state.session_start_id}"
+
+
+@st.cache_resource
+def get_log_writer():
+    """Background writer for query logs shared by all sessions."""
+    if track_query:
+        sink = FirestoreSink(db, collection="queries_new")
+    elif QUERY_LOG_FILE and QUERY_LOG_FILE.endswith(".db"):
+        sink = SQLiteSink(QUERY_LOG_FILE)
+    elif QUERY_LOG_FILE:
+        sink = JsonlSink(QUERY_LOG_FILE)
+    else:
+        sink = NullSink()
+    return BackgroundLogWriter(sink, max_queue_size=QUERY_LOG_QUEUE_SIZE, batch_size=QUERY_LOG_BATCH_SIZE,
+                               flush_interval=QUERY_LOG_FLUSH_SECONDS)
+
+
+@st.cache_resource
+def start_metrics_server():
+    """Start the metrics endpoint once per process."""
+    if METRICS_PORT is None:
+        return None
     try:
-        response = requests.get("https://api64.ipify.org?format=json")
-        return response.json().get("ip", "unknown")
-    except:
-        return "unknown"
-
-
-def load_ip_tracking(client_ip):
-    """Load IP tracking data from Firestore."""
-    doc_ref = db.collection("ip_tracking").document(client_ip)
-    doc = doc_ref.get()
-    return doc.to_dict() if doc.exists else {"last_query_time": None, "query_history": []}
-
-
-def save_ip_tracking(client_ip, tracking_data):
-    """Save IP tracking data to Firestore."""
-    db.collection("ip_tracking").document(client_ip).set(tracking_data)
-
-
-def save_query_to_firebase(session_id, query, full_response, timestamp):
-    """Save query details to Firestore."""
-    # db.collection("queries").add({
-    #     "ip": ip,
-    #     "query": query,
-    #     "timestamp": timestamp
-    # })
-    doc_ref = db.collection("queries_new").document(session_id)
-    # Create a dictionary for the new query
-    new_query = {
-        "query": query,
-        "response": full_response,
-        "timestamp": timestamp
-    }
-    # Use arrayUnion to add the new query to the 'queries' array
-    doc_ref.set({
-        "queries": firestore.ArrayUnion([new_query])
-    }, merge=True)
+        return REGISTRY.start_http_server(METRICS_PORT, host=METRICS_HOST)
+    except OSError as e:
+        print(f"Metrics server not started on port {METRICS_PORT}: {e}")
+        return None
 
 
 def initialize_session_state():
@@ -99,18 +218,31 @@ def initialize_session_state():
     if "messages" not in st.session_state:
         st.session_state.messages = []
     if "bot" not in st.session_state:
+        retrieval_cache, document_store = get_retrieval_cache()
         st.session_state.bot = FoodRecommendationBot(
             embded_model_name=embed_model_name,
             llm_model=llm_model,
+            tool_model=tool_model,
             bm25_file=bm25_file,
             vector_store=vector_store,
             n_first_lines=n_first_lines,
-            save_output=False
+            save_output=False,
+            facet_file=facet_file,
+            response_cache=get_response_cache(),
+            retrieval_cache=retrieval_cache,
+            document_store=document_store,
+            tracer=Tracer(enabled=TRACE_REQUESTS),
+            client_endpoint=get_llm_client(),
+            tool_client_endpoint=get_tool_client(),
+            max_history_turns=HISTORY_TURNS,
+            max_history_tokens=HISTORY_TOKENS,
+            max_summary_tokens=HISTORY_SUMMARY_TOKENS,
+            summarize_history=SUMMARIZE_HISTORY,
+            shared_indexes=get_shared_indexes(),
+            resilience=get_resilience_policy()
         )
-    if track_query:
-        if "ip_tracking" not in st.session_state:
-            client_ip = get_client_ip()
-            st.session_state.ip_tracking = load_ip_tracking(client_ip)
+    if "session_start_id" not in st.session_state:
+        st.session_state.session_start_id = str(int(datetime.now(UTC).timestamp()))
 
 
 def get_current_time():
@@ -118,66 +250,12 @@ def get_current_time():
     return datetime.now(SGT)
 
 
-def parse_timestamp(timestamp_str):
-    """Parse ISO timestamp string to datetime object in Singapore timezone."""
-    if not timestamp_str:
-        return datetime.min.replace(tzinfo=SGT)
-    try:
-        dt = datetime.fromisoformat(timestamp_str)
-        if dt.tzinfo is None:
-            dt = dt.replace(tzinfo=pytz.UTC)
-        return dt.astimezone(SGT)
-    except ValueError:
-        return datetime.min.replace(tzinfo=SGT)
-
-
-def can_make_query():
-    """Check if a new query can be made based on rate limits."""
-    current_time = get_current_time()
-
-    ip_data = st.session_state.ip_tracking
-    last_query_time = parse_timestamp(ip_data["last_query_time"])
-
-    # Check cooldown period
-    time_since_last_query = (current_time - last_query_time).total_seconds()
-    if time_since_last_query < COOLDOWN_SECONDS:
-        return False, f"Please wait {COOLDOWN_SECONDS - int(time_since_last_query)} seconds before making another query."
-
-    # Clean up old queries from history
-    cutoff_time = current_time - timedelta(hours=QUERY_WINDOW_HOURS)
-    ip_data["query_history"] = [
-        time for time in ip_data["query_history"]
-        if parse_timestamp(time) > cutoff_time
-    ]
-
-    # Check hourly limit
-    if len(ip_data["query_history"]) >= MAX_QUERIES_PER_HOUR:
-        next_query_time = parse_timestamp(ip_data["query_history"][0]) + timedelta(hours=QUERY_WINDOW_HOURS)
-        wait_time = next_query_time - current_time
-        minutes = int(wait_time.total_seconds() / 60)
-        return False, f"Query limit reached for your IP. Please wait {minutes} minutes before making another query."
-
-    return True, ""
-
-
-def update_query_tracking():
-    """Update query tracking after a successful query."""
-    current_time = get_current_time()
-    client_ip = get_client_ip()
-
-    # Update IP tracking
-    st.session_state.ip_tracking["last_query_time"] = current_time.isoformat()
-    st.session_state.ip_tracking["query_history"].append(current_time.isoformat())
-
-    # Save tracking data to Firebase
-    save_ip_tracking(client_ip, st.session_state.ip_tracking)
-
-
 # Initialize session state
+start_metrics_server()
 initialize_session_state()
-if "session_start_id" not in st.session_state:
-    st.session_state.session_start_id = str(int(datetime.now(UTC).timestamp()))
 session_start_id = st.session_state.session_start_id
+rate_limiter = get_rate_limiter()
+client_id = get_client_id()
 # Set page config
 st.set_page_config(
     page_title="Food Recommendation Chatbot",
@@ -212,20 +290,18 @@ with st.sidebar:
     st.title("Chat Controls")
     if st.button("Clear Chat History & Restart"):
         st.session_state.messages = []
-        st.session_state.bot.query_history = []
-        st.session_state.bot.full_history = []
+        st.session_state.bot.reset_history()
         st.rerun()
 
-    if track_query:
-        st.markdown("---")
-        st.markdown("### Usage Limits")
-        client_ip = get_client_ip()
-        queries_remaining = MAX_QUERIES_PER_HOUR - len(st.session_state.ip_tracking["query_history"])
-        st.markdown(f"Queries remaining for you: **{queries_remaining}**")
+    st.markdown("---")
+    st.markdown("### Usage Limits")
+    queries_remaining = rate_limiter.remaining(client_id)
+    st.markdown(f"Queries remaining for you: **{queries_remaining}**")
 
-        if st.session_state.ip_tracking["query_history"]:
-            reset_time = parse_timestamp(st.session_state.ip_tracking["query_history"][0]) + timedelta(hours=QUERY_WINDOW_HOURS)
-            st.markdown(f"Next reset at: **{reset_time.strftime('%I:%M:%S %p')} SGT**")
+    reset_timestamp = rate_limiter.reset_time(client_id)
+    if reset_timestamp:
+        reset_time = datetime.fromtimestamp(reset_timestamp, SGT)
+        st.markdown(f"Next reset at: **{reset_time.strftime('%I:%M:%S %p')} SGT**")
 
     st.markdown("---")
     st.markdown("### About")
@@ -244,12 +320,11 @@ with st.sidebar:
 
 # Chat input
 if prompt := st.chat_input("What kind of food are you looking for?"):
-    # Check rate limits
-    if track_query:
-        can_query, message = can_make_query()
-        if not can_query:
-            st.error(message)
-            st.stop()
+    # Check rate limits and count the query in one step, so parallel queries of a client cannot all pass the check
+    can_query, message = rate_limiter.try_acquire(client_id)
+    if not can_query:
+        st.error(message)
+        st.stop()
 
     # Add user message to chat history
     st.session_state.messages.append({"role": "user", "content": prompt})
@@ -260,24 +335,34 @@ if prompt := st.chat_input("What kind of food are you looking for?"):
     with st.chat_message("assistant"):
         message_placeholder = st.empty()
         full_response = ""
+        # Coalesce tokens so the growing answer is re-rendered at most every RENDER_INTERVAL_SECONDS
+        renderer = RenderScheduler(message_placeholder.markdown, flush_interval=RENDER_INTERVAL_SECONDS,
+                                   flush_chars=RENDER_FLUSH_CHARS)
 
         with st.spinner("Thinking..."):
-            for response in st.session_state.bot.get_response(prompt, st.session_state.messages):
-                if isinstance(response, str):
-                    full_response += response
-                    message_placeholder.markdown(full_response + "▌")
-                    time.sleep(0.01)  # Small delay for smoother streaming
-                else:
-                    full_response += response.get("sources", "")
-                    message_placeholder.markdown(full_response)
-
-            message_placeholder.markdown(full_response)
+            try:
+                for response in st.session_state.bot.get_response(prompt, st.session_state.messages):
+                    if isinstance(response, str):
+                        full_response += response
+                        renderer.add(response)
+                    else:
+                        full_response += response.get("sources", "")
+                        renderer.add(response.get("sources", ""))
+                        renderer.flush()
+            except SchedulerRejected:
+                # Too many queries in progress, ask user to retry without counting it against their limit
+                rate_limiter.refund(client_id)
+                st.session_state.messages.pop()
+                st.error("The assistant is busy right now. Please try again in a few seconds.")
+                st.stop()
+
+            renderer.finish()
             st.session_state.messages.append({"role": "assistant", "content": full_response})
 
-    # Save query to Firebase
-    if track_query:
-        current_time = get_current_time()
-        save_query_to_firebase(session_start_id, prompt, full_response, current_time)
-
-        # Update query tracking
-        update_query_tracking()
\ No newline at end of file
+    # Queue query log, written in the background
+    get_log_writer().submit({
+        "session_id": session_start_id,
+        "query": prompt,
+        "response": full_response,
+        "timestamp": get_current_time()
+    })
@@ -0,0 +1,35 @@
+import os
+import re
+import sys
+
+import pytest
+
+# Modules are run from the app folder and import each other as top-level modules
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+from benchmarks.synthetic_corpus import build_bm25, build_chroma, generate_places, load_zones  # noqa: E402
+from llm_backends import FakeClient  # noqa: E402
+
+# Stands in for nltk word_tokenize, whose punkt data is downloaded separately
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+EMBEDDING_DIM = 32
+
+
+@pytest.fixture
+def app_dir(monkeypatch):
+    """Run from the app folder, as the subzone lookup files are read relative to it"""
+    monkeypatch.chdir(APP_DIR)
+    return APP_DIR
+
+
+@pytest.fixture(scope="session")
+def corpus(tmp_path_factory):
+    """Chroma collection and BM25 file of a small synthetic corpus embedded with FakeClient"""
+    output_dir = tmp_path_factory.mktemp("corpus")
+    places = list(generate_places(40, zones=load_zones(os.path.join(APP_DIR, "sub_zone_nearby.json"))))
+    chroma_path = str(output_dir / "chroma")
+    collection = build_chroma(places, chroma_path, FakeClient(embedding_dim=EMBEDDING_DIM).embed)
+    bm25_file = str(output_dir / "rank_bm25result")
+    build_bm25(places, bm25_file, tokenize=TOKEN_PATTERN.findall)
+    return {"places": places, "bm25_file": bm25_file, "chroma_path": chroma_path, "collection": collection}
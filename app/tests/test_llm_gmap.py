@@ -0,0 +1,88 @@
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import llm_gmap
+from benchmarks.synthetic_corpus import build_chroma
+from conftest import EMBEDDING_DIM, TOKEN_PATTERN
+from llm_backends import FakeClient
+from llm_gmap import FoodRecommendationBot, get_index_version, load_shared_indexes
+from query_cache import ResponseCache
+
+ANSWER_TOKENS = 20
+ZONE_PATTERN = r"@ Zone: (.+?)\(Place ID"
+
+
+@pytest.fixture
+def make_bot(app_dir, corpus, monkeypatch):
+    """Bots on the synthetic corpus answering with FakeClient, sharing indexes like the servers do"""
+    monkeypatch.setattr(llm_gmap, "word_tokenize", TOKEN_PATTERN.findall)
+    shared_indexes = load_shared_indexes(corpus["bm25_file"], vector_store=corpus["collection"],
+                                         chroma_path=corpus["chroma_path"])
+
+    def make(**kwargs):
+        return FoodRecommendationBot(bm25_file=corpus["bm25_file"], vector_store=corpus["collection"],
+                                     client_endpoint=FakeClient(embedding_dim=EMBEDDING_DIM,
+                                                                answer_tokens=ANSWER_TOKENS),
+                                     shared_indexes=shared_indexes, print_source=True, **kwargs)
+    return make
+
+
+def ask(bot: FoodRecommendationBot, question: str, messages: list) -> tuple[list, dict]:
+    messages.append({"role": "user", "content": question})
+    responses = list(bot.get_response(question, messages))
+    tokens = [response for response in responses if isinstance(response, str)]
+    sources = [response for response in responses if not isinstance(response, str)]
+    messages.append({"role": "assistant", "content": "".join(tokens)})
+    return tokens, sources[0]
+
+
+def test_answers_with_places_in_the_asked_zone(make_bot, corpus):
+    zone = corpus["places"][0]["place_zone"]
+    bot = make_bot()
+    messages = []
+    tokens, sources = ask(bot, f"Where can I get chicken rice in {zone.lower()}", messages)
+
+    assert len(tokens) == ANSWER_TOKENS
+    source_zones = re.findall(ZONE_PATTERN, sources["sources"])
+    assert source_zones and source_zones[0] == zone
+    assert corpus["places"][0]["place_name"] in sources["sources"]
+
+    # Follow-up without a location keeps the zone of the conversation
+    _, follow_up_sources = ask(bot, "Any cafes with good coffee?", messages)
+    assert re.findall(ZONE_PATTERN, follow_up_sources["sources"])[0] == zone
+    assert bot.trace is llm_gmap.NULL_TRACE
+
+
+def test_replays_cached_answer(make_bot, corpus):
+    response_cache = ResponseCache(max_size=10, ttl_seconds=60)
+    question = f"Cheap laksa in {corpus['places'][1]['place_zone'].lower()}"
+    first = ask(make_bot(response_cache=response_cache), question, [])
+    assert ask(make_bot(response_cache=response_cache), question, []) == first
+    assert response_cache.hits == 1
+
+
+def test_shared_bot_serves_concurrent_retrievals(make_bot, corpus):
+    bot = make_bot()
+    zones = [place["place_zone"] for place in corpus["places"][:8]]
+    expected = [bot.retrieve("chicken rice", location=zone.lower()) for zone in zones]
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(lambda zone: bot.retrieve("chicken rice", location=zone.lower()), zones * 4))
+    assert results == expected * 4
+
+
+def test_index_version_changes_when_chroma_is_re_embedded(tmp_path, corpus):
+    places = corpus["places"][:3]
+    chroma_path = str(tmp_path / "chroma")
+    collection = build_chroma(places, chroma_path, FakeClient(embedding_dim=EMBEDDING_DIM).embed)
+    version = get_index_version(corpus["bm25_file"], vector_store=collection, chroma_path=chroma_path)
+    assert get_index_version(corpus["bm25_file"], vector_store=collection, chroma_path=chroma_path) == version
+
+    chunks = collection.get(include=["documents"])
+    collection.upsert(ids=chunks["ids"], documents=chunks["documents"],
+                      embeddings=[FakeClient(embedding_dim=EMBEDDING_DIM).embed(f"new {document}")
+                                  for document in chunks["documents"]])
+    assert collection.count() == len(chunks["ids"])
+    assert get_index_version(corpus["bm25_file"], vector_store=collection, chroma_path=chroma_path) != version
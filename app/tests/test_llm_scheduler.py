@@ -0,0 +1,75 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from llm_scheduler import QueueFullError, QueueTimeoutError, ScheduledClient
+
+MODEL = "test-model"
+
+
+class BlockingClient:
+    """Chat client whose calls wait until released"""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.started = threading.Semaphore(0)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, model, stream=False, **kwargs):
+        self.started.release()
+        self.release.wait(5)
+        return iter(["token"]) if stream else "answer"
+
+
+def start_call(scheduler: ScheduledClient, results: list) -> threading.Thread:
+    thread = threading.Thread(target=lambda: results.append(scheduler.chat.completions.create(model=MODEL)))
+    thread.start()
+    return thread
+
+
+def test_rejects_calls_when_queue_is_full():
+    client = BlockingClient()
+    scheduler = ScheduledClient(client, default_limit=1, max_queue_size=1, queue_timeout=5)
+    results = []
+    running = start_call(scheduler, results)
+    assert client.started.acquire(timeout=5)
+    waiting = start_call(scheduler, results)
+    while scheduler.stats()[MODEL]["waiting"] < 1:
+        time.sleep(0.01)
+
+    with pytest.raises(QueueFullError):
+        scheduler.chat.completions.create(model=MODEL)
+
+    client.release.set()
+    running.join()
+    waiting.join()
+    assert results == ["answer", "answer"]
+    assert scheduler.stats()[MODEL] == {"active": 0, "waiting": 0}
+
+
+def test_times_out_waiting_for_a_slot():
+    client = BlockingClient()
+    scheduler = ScheduledClient(client, default_limit=1, max_queue_size=4, queue_timeout=0.05)
+    running = start_call(scheduler, [])
+    assert client.started.acquire(timeout=5)
+
+    with pytest.raises(QueueTimeoutError):
+        scheduler.chat.completions.create(model=MODEL)
+    assert scheduler.stats()[MODEL] == {"active": 1, "waiting": 0}
+
+    client.release.set()
+    running.join()
+
+
+def test_stream_holds_its_slot_until_closed():
+    client = BlockingClient()
+    client.release.set()
+    scheduler = ScheduledClient(client, default_limit=1, max_queue_size=0, queue_timeout=0.05)
+    stream = scheduler.chat.completions.create(model=MODEL, stream=True)
+    with pytest.raises(QueueFullError):
+        scheduler.chat.completions.create(model=MODEL)
+
+    assert list(stream) == ["token"]
+    assert scheduler.chat.completions.create(model=MODEL) == "answer"
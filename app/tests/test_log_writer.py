@@ -0,0 +1,52 @@
+import json
+import threading
+
+from log_writer import BackgroundLogWriter, JsonlSink
+
+
+class BlockingSink:
+    """Sink whose first write waits until released, so records pile up in the queue"""
+
+    def __init__(self):
+        self.writing = threading.Event()
+        self.release = threading.Event()
+        self.records = []
+
+    def write_batch(self, records):
+        self.writing.set()
+        self.release.wait(5)
+        self.records.extend(records)
+
+    def close(self):
+        pass
+
+
+def test_jsonl_sink_round_trip(tmp_path):
+    path = tmp_path / "query_logs.jsonl"
+    writer = BackgroundLogWriter(JsonlSink(str(path)), batch_size=2, flush_interval=0.05)
+    records = [{"session_id": f"s{i}", "query": f"chicken rice {i}", "response": "Try Ah Hock 鸡饭"}
+               for i in range(5)]
+    for record in records:
+        assert writer.submit(record)
+    writer.flush()
+    writer.close()
+
+    with open(path, encoding="utf-8") as file:
+        assert [json.loads(line) for line in file] == records
+    assert writer.stats() == {"submitted": 5, "written": 5, "dropped": 0, "failed": 0, "queued": 0}
+
+
+def test_full_queue_drops_and_counts_records():
+    sink = BlockingSink()
+    writer = BackgroundLogWriter(sink, max_queue_size=1, batch_size=1, flush_interval=0.05)
+    assert writer.submit({"query": "first"})
+    assert sink.writing.wait(5)  # First record taken off the queue, writer is blocked in the sink
+
+    assert writer.submit({"query": "second"})
+    assert not writer.submit({"query": "third"})
+    assert writer.stats()["dropped"] == 1
+
+    sink.release.set()
+    writer.close()
+    assert [record["query"] for record in sink.records] == ["first", "second"]
+    assert writer.stats()["written"] == 2
@@ -0,0 +1,36 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from rate_limiter import SlidingWindowRateLimiter, client_address
+
+
+def test_concurrent_burst_stays_within_limit():
+    rate_limiter = SlidingWindowRateLimiter(cooldown_seconds=0, max_requests=5, window_seconds=3600)
+    start = threading.Barrier(16)
+
+    def acquire(_):
+        start.wait()
+        return rate_limiter.try_acquire("client")[0]
+
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        allowed = list(executor.map(acquire, range(16)))
+    assert sum(allowed) == 5
+    assert rate_limiter.remaining("client") == 0
+
+
+def test_refund_frees_the_request():
+    rate_limiter = SlidingWindowRateLimiter(cooldown_seconds=60, max_requests=5, window_seconds=3600)
+    assert rate_limiter.try_acquire("client") == (True, "")
+    allowed, message = rate_limiter.try_acquire("client")
+    assert not allowed and message.startswith("Please wait")
+
+    rate_limiter.refund("client")
+    assert rate_limiter.remaining("client") == 5
+    assert rate_limiter.try_acquire("client") == (True, "")
+
+
+def test_client_address_uses_entry_of_trusted_proxy():
+    assert client_address("1.1.1.1, 2.2.2.2, 3.3.3.3", 1, "10.0.0.1") == "3.3.3.3"
+    assert client_address("1.1.1.1, 2.2.2.2, 3.3.3.3", 2, "10.0.0.1") == "2.2.2.2"
+    assert client_address("3.3.3.3", 2, "10.0.0.1") == "10.0.0.1"
+    assert client_address("1.1.1.1", 0, "10.0.0.1") == "10.0.0.1"
@@ -0,0 +1,17 @@
+from stream_render import RENDERS, TOKEN_RATE, RenderScheduler
+
+
+def test_coalesces_tokens_and_records_metrics():
+    renders = []
+    num_answers = RENDERS.count()
+    num_received = TOKEN_RATE.count(direction="received")
+    renderer = RenderScheduler(renders.append, flush_interval=60, flush_chars=10)
+    for _ in range(12):
+        renderer.add("abc ")
+    renderer.finish()
+
+    # First token renders at once, then every 10 pending characters, then the final text without cursor
+    assert renders == ["abc ▌", "abc " * 4 + "▌", "abc " * 7 + "▌", "abc " * 10 + "▌", "abc " * 12]
+    assert renderer.stats()["tokens_delivered"] == 12
+    assert RENDERS.count() == num_answers + 1
+    assert TOKEN_RATE.count(direction="received") == num_received + 1
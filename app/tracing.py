@@ -0,0 +1,156 @@
+"""
+Lightweight per-request tracing with nested spans and pluggable exporters
+"""
+import json
+import time
+import uuid
+from collections import deque
+from typing import Dict, List
+
+
+class Span:
+    def __init__(self, name: str, attributes: Dict = None):
+        self.name = name
+        self.attributes = attributes or {}
+        self.children: List["Span"] = []
+        self.start_time = time.perf_counter()
+        self.end_time = None
+
+    @property
+    def duration_ms(self) -> float:
+        end_time = self.end_time if self.end_time is not None else time.perf_counter()
+        return (end_time - self.start_time) * 1000
+
+    def to_dict(self) -> Dict:
+        span_dict = {"name": self.name, "duration_ms": round(self.duration_ms, 2)}
+        if self.attributes:
+            span_dict["attributes"] = self.attributes
+        if self.children:
+            span_dict["children"] = [child.to_dict() for child in self.children]
+        return span_dict
+
+
+class _SpanContext:
+    def __init__(self, trace: "Trace", name: str, attributes: Dict):
+        self.trace = trace
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self) -> Span:
+        return self.trace.start_span(self.name, **self.attributes)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.trace.set(error=f"{exc_type.__name__}: {exc_value}")
+        self.trace.end_span()
+        return False
+
+
+class Trace:
+    def __init__(self, name: str, exporter=None, **attributes):
+        """Trace of a single request. The root span covers the whole request until finish() is called"""
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.timestamp = time.time()
+        self.exporter = exporter
+        self.root = Span(name, attributes)
+        self._stack = [self.root]
+
+    def span(self, name: str, **attributes) -> _SpanContext:
+        """Context manager timing a child span of the current span"""
+        return _SpanContext(self, name, attributes)
+
+    def start_span(self, name: str, **attributes) -> Span:
+        span = Span(name, attributes)
+        self._stack[-1].children.append(span)
+        self._stack.append(span)
+        return span
+
+    def end_span(self):
+        span = self._stack.pop()
+        span.end_time = time.perf_counter()
+
+    def set(self, **attributes):
+        """Set attributes on the current span"""
+        self._stack[-1].attributes.update(attributes)
+
+    def elapsed_ms(self) -> float:
+        """Time since start of the trace"""
+        return self.root.duration_ms
+
+    def finish(self):
+        """End all open spans and export the trace"""
+        while len(self._stack) > 1:
+            self.end_span()
+        if self.root.end_time is None:
+            self.root.end_time = time.perf_counter()
+            if self.exporter is not None:
+                try:
+                    self.exporter.export(self)
+                except Exception as e:
+                    print(f"Error exporting trace {self.trace_id}: {e}")
+
+    def to_dict(self) -> Dict:
+        return {"trace_id": self.trace_id, "timestamp": self.timestamp, **self.root.to_dict()}
+
+
+class _NullSpanContext:
+    def __enter__(self):
+        return None
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+class NullTrace:
+    """Trace that records nothing, used when tracing is disabled"""
+    _span_context = _NullSpanContext()
+
+    def span(self, name: str, **attributes) -> _NullSpanContext:
+        return self._span_context
+
+    def start_span(self, name: str, **attributes):
+        return None
+
+    def end_span(self):
+        pass
+
+    def set(self, **attributes):
+        pass
+
+    def elapsed_ms(self) -> float:
+        return 0.0
+
+    def finish(self):
+        pass
+
+
+NULL_TRACE = NullTrace()
+
+
+class LogLineExporter:
+    """Print each trace as a single JSON log line"""
+
+    def export(self, trace: Trace):
+        print(f"trace {json.dumps(trace.to_dict(), default=str)}")
+
+
+class InMemoryExporter:
+    def __init__(self, max_traces: int = 1000):
+        """Keep the most recent traces in memory, e.g. for benchmarks"""
+        self.traces = deque(maxlen=max_traces)
+
+    def export(self, trace: Trace):
+        self.traces.append(trace)
+
+
+class Tracer:
+    def __init__(self, enabled: bool = True, exporter=None):
+        """Create traces exported to exporter (any object with an export(trace) method).
+        Prints a log line per trace if no exporter is given"""
+        self.enabled = enabled
+        self.exporter = exporter if exporter is not None else LogLineExporter()
+
+    def start_trace(self, name: str, **attributes) -> Trace | NullTrace:
+        if not self.enabled:
+            return NULL_TRACE
+        return Trace(name, exporter=self.exporter, **attributes)
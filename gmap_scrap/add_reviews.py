@@ -1,47 +1,133 @@
-import sqlite3
-import pickle
+"""
+Fetch Google Maps reviews of filtered places with SerpAPI.
+Places are fetched concurrently within the SerpAPI hourly rate limit and searches left on the account. Raw
+responses are cached on disk by place_id and page token, so a rerun or a larger num_pages only spends searches
+on pages not fetched before. Reviews are appended to the reviews pack and their paths are saved to the database in
+batches.
+"""
+import asyncio
+import hashlib
 import json
-from serpapi import GoogleSearch
-
 import os
+import pickle
+import threading
+import time
+
+import requests
 from dotenv import load_dotenv
 
+import food_db
+from artifact_store import close_stores, write_artifact
+from rate_limit import RateLimiter, retry_with_backoff
+
 load_dotenv()
 serpApi_key = os.getenv('SERPAPI_KEY')
+# SerpAPI base URL, e.g. a local mock_serpapi_server.py
+SERPAPI_BASE_URL = os.getenv("SERPAPI_BASE_URL", "https://serpapi.com")
 
 num_pages = 2 # Number of pages of review to extract
-review_dir = "reviews"
+cache_dir = "reviews_cache"  # Raw SerpAPI responses, by place_id and page token
 
 # Add reviews for selected place_ids
 place_ids_file = "filered_place_ids.pkl"
-with open(place_ids_file, "rb") as file:
-    filter_place_ids = pickle.load(file)
-
-# Create/connect to an SQLite database
-conn = sqlite3.connect("food_places.db")
-cursor = conn.cursor()
-
-def fetch_reviews(place_id, num_pages=2):
+ignore_review_path = False  # Fetch reviews of places that already have them, e.g. after raising num_pages
+
+MAX_CONCURRENT_PLACES = 8  # Places fetched at once
+REQUESTS_PER_MINUTE = 60  # Upper bound, lowered to the account hourly rate limit
+MAX_RETRIES = 5  # Retries of a failed request, with exponential backoff
+DB_BATCH_SIZE = 50  # Places per database commit
+REQUEST_TIMEOUT = 60
+
+
+class RetryableError(Exception):
+    """Rate limited or server error, worth retrying"""
+
+
+class QuotaExhausted(Exception):
+    """No searches left on the SerpAPI account"""
+
+
+class SearchBudget:
+    def __init__(self, searches_left: int = None):
+        """Count of searches that can still be made, unlimited if None. Taken from the threads making requests"""
+        self.searches_left = searches_left
+        self.lock = threading.Lock()
+
+    def take(self):
+        with self.lock:
+            if self.searches_left is not None:
+                if self.searches_left <= 0:
+                    raise QuotaExhausted("No SerpAPI searches left")
+                self.searches_left -= 1
+
+
+def get_account_quota() -> tuple:
+    """Searches left and hourly rate limit of the SerpAPI account, None if unknown"""
+    try:
+        response = requests.get(f"{SERPAPI_BASE_URL}/account.json", params={"api_key": serpApi_key},
+                                timeout=REQUEST_TIMEOUT)
+        response.raise_for_status()
+        account = response.json()
+    except Exception as e:
+        print(f"Could not get SerpAPI account quota: {e}")
+        return None, None
+    return account.get("total_searches_left"), account.get("account_rate_limit_per_hour")
+
+
+def cache_path(place_id: str, page_token: str = None) -> str:
+    page_key = hashlib.sha1(page_token.encode("utf-8")).hexdigest()[:16] if page_token else "first"
+    return f"{cache_dir}/{place_id}/{page_key}.json"
+
+
+def search_reviews(params: dict) -> dict:
+    """One request to the SerpAPI Google Maps reviews endpoint"""
+    response = requests.get(f"{SERPAPI_BASE_URL}/search.json", params=params, timeout=REQUEST_TIMEOUT)
+    if response.status_code == 429 or response.status_code >= 500:
+        raise RetryableError(f"HTTP {response.status_code}: {response.text[:200]}")
+    response.raise_for_status()
+    return response.json()
+
+
+async def fetch_page(place_id: str, page_token: str, rate_limiter: RateLimiter, budget: SearchBudget) -> dict:
+    """Raw response of a page of reviews, from the cache if it was fetched before"""
+    path = cache_path(place_id, page_token)
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as file:
+            return json.load(file)
+    params = {
+        "engine": "google_maps_reviews",
+        "hl": "en",
+        "gl": "sg",
+        "place_id": place_id,
+        "api_key": serpApi_key,
+        "limit": 10  # Fetch 10 reviews per request
+    }
+    if page_token:
+        params["next_page_token"] = page_token  # Add token for next page
+
+    def search():
+        budget.take()  # Every attempt, retries included, counts against the account searches
+        return search_reviews(params)
+
+    results = await retry_with_backoff(lambda: asyncio.to_thread(search), max_retries=MAX_RETRIES,
+                                       retry_on=(RetryableError, requests.ConnectionError, requests.Timeout),
+                                       rate_limiter=rate_limiter)
+    if "error" not in results:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(results, file, ensure_ascii=False)
+    return results
+
+
+async def fetch_reviews(place_id: str, rate_limiter: RateLimiter, budget: SearchBudget, num_pages: int = 2):
     reviews_list = []
     seen_reviews = set()  # Track unique review snippets
     next_page_token = None  # Token for pagination
     for page in range(0, num_pages):
-        params = {
-            "engine": "google_maps_reviews",
-            "hl": "en",
-            "gl": "sg",
-            "place_id": place_id,
-            "api_key": serpApi_key,
-            "limit": 10  # Fetch 10 reviews per request
-        }
-        if next_page_token:
-            params["next_page_token"] = next_page_token  # Add token for next page
-
-        search = GoogleSearch(params)
-        results = search.get_dict()
+        results = await fetch_page(place_id, next_page_token, rate_limiter, budget)
 
         if "reviews" not in results or not results["reviews"]:
-            print("No more reviews found. Stopping pagination.")
+            print(f"No more reviews found for {place_id}. Stopping pagination.")
             break  # Stop if no new reviews are found
 
         new_reviews = 0  # Track how many new reviews are added
@@ -54,56 +140,104 @@ def fetch_reviews(place_id, num_pages=2):
                 new_reviews += 1
 
         if new_reviews == 0:
-            print("No new unique reviews found. Stopping pagination.")
+            print(f"No new unique reviews found for {place_id}. Stopping pagination.")
             break  # Stop if only duplicates are found
 
-        try:
-            next_page_token = results["serpapi_pagination"]["next_page_token"]
-        except:
-            next_page_token = None
+        next_page_token = results.get("serpapi_pagination", {}).get("next_page_token")
         if not next_page_token:
-            print("No next_page_token available. Stopping pagination.")
             break  # Stop if there are no more pages
 
     return reviews_list
 
-total_place_ids = len(filter_place_ids)
-count = 0
-ignore_review_path = False
-for place_id in filter_place_ids:
-    count += 1
-    print("--------------------------")
-    print(f"({count}/{total_place_ids}) Processing {place_id}. Checking if review_path exist.")
-    print("--------------------------")
-    cursor.execute("SELECT review_path, rating, num_reviews FROM places WHERE place_id = ?", (place_id,))
-    result = cursor.fetchone()
-
-    review_path, rating, num_reviews = result
-    if num_reviews <= 20:
-        print("Too little reviews.")
-        continue
-    if rating < 3:
-        print("Rating too low.")
-        continue
-    if review_path == "None" or ignore_review_path:
-        print(f"{place_id} does not have review_path. Finding reviews now.")
-        # Find reviews and add to json file
-        place_reviews = fetch_reviews(place_id, num_pages=num_pages)
-        num_reviews = len(place_reviews)
-        if num_reviews > 0:
-            print(f"Found {num_reviews} reviews for {place_id}.")
-            reviews_json_filename = f"{place_id}_reviews.json"
-            review_path = f"{review_dir}/{reviews_json_filename}"
-            with open(review_path, "w", encoding="utf-8") as file:
-                json.dump(place_reviews, file, indent=4, ensure_ascii=False)
-            print(f"Wrote reviews into {review_path}")
-            # Add review_path to database
-            cursor.execute("UPDATE places SET review_path = ? WHERE place_id = ?", (review_path, place_id))
-            conn.commit()
-            print(f"Added {place_id} review_path to database.")
+
+async def fetch_place(place_id: str, rate_limiter: RateLimiter, budget: SearchBudget,
+                      semaphore: asyncio.Semaphore) -> tuple:
+    """Reviews of a place, or None and the error if they could not be fetched"""
+    async with semaphore:
+        try:
+            return place_id, await fetch_reviews(place_id, rate_limiter, budget, num_pages=num_pages), None
+        except QuotaExhausted as e:
+            return place_id, None, e
+        except Exception as e:
+            print(f"Error fetching reviews for {place_id}: {e}")
+            return place_id, None, e
+
+
+def select_places(conn, place_ids: list) -> list:
+    """Filtered places with enough reviews and rating, and without reviews unless ignore_review_path"""
+    places = food_db.get_places(conn, place_ids)
+    selected = []
+    for place_id in place_ids:
+        if place_id not in places:
+            print(f"{place_id} not in database.")
+            continue
+        place = places[place_id]
+        if place["num_reviews"] <= 20 or place["rating"] < 3:
+            continue  # Too little reviews or rating too low
+        if place["review_path"] is None or ignore_review_path:
+            selected.append(place_id)
+    return selected
+
+
+async def run():
+    with open(place_ids_file, "rb") as file:
+        filter_place_ids = pickle.load(file)
+
+    conn = food_db.connect()
+    place_ids = select_places(conn, filter_place_ids)
+    searches_left, rate_limit_per_hour = get_account_quota()
+    requests_per_minute = REQUESTS_PER_MINUTE
+    if rate_limit_per_hour:
+        requests_per_minute = min(requests_per_minute, rate_limit_per_hour / 60)
+    print(f"Fetching reviews of {len(place_ids)} of {len(filter_place_ids)} places, "
+          f"{searches_left if searches_left is not None else 'unknown'} searches left, "
+          f"{requests_per_minute:.0f} requests per minute")
+
+    rate_limiter = RateLimiter(requests_per_minute)
+    budget = SearchBudget(searches_left)
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_PLACES)
+    start_time = time.perf_counter()
+    # Tasks are created here, as as_completed would start them in set order, so places are fetched in filter order
+    tasks = [asyncio.create_task(fetch_place(place_id, rate_limiter, budget, semaphore)) for place_id in place_ids]
+    updates = []
+    statuses = []
+    count = 0
+    num_added = 0
+    num_failed = 0
+    for task in asyncio.as_completed(tasks):
+        place_id, place_reviews, error = await task
+        count += 1
+        if place_reviews is None:
+            num_failed += 1
+            if not isinstance(error, QuotaExhausted):
+                statuses.append((place_id, "failed", str(error)))
+        elif place_reviews:
+            review_path = write_artifact("review_path", place_id,
+                                         json.dumps(place_reviews, indent=4, ensure_ascii=False))
+            print(f"({count}/{len(place_ids)}) Wrote {len(place_reviews)} reviews into {review_path}")
+            updates.append((review_path, place_id))
+            num_added += 1
         else:
-            print("No reviews found. Not adding to database")
-    else:
-        print(f"{place_id} already has review_path: {review_path}")
+            print(f"({count}/{len(place_ids)}) No reviews found for {place_id}. Not adding to database")
+            statuses.append((place_id, "no_reviews", None))
+        if len(updates) + len(statuses) >= DB_BATCH_SIZE:
+            food_db.set_paths(conn, "review_path", updates, stage="reviews")
+            food_db.set_status(conn, "reviews", statuses)
+            updates, statuses = [], []
+    food_db.set_paths(conn, "review_path", updates, stage="reviews")
+    food_db.set_status(conn, "reviews", statuses)
+    conn.close()
+    close_stores()
+
+    elapsed = time.perf_counter() - start_time
+    print(f"Added reviews of {num_added} places in {elapsed:.1f}s, {num_failed} failed")
+    if budget.searches_left is not None and budget.searches_left <= 0:
+        print("Stopped early, no SerpAPI searches left. Rerun when the quota resets.")
+
+
+def main():
+    asyncio.run(run())
+
 
-conn.close()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -1,34 +1,56 @@
 """
-Find and save summaries of places in database
+Find and save summaries of places in database.
+Summaries are requested concurrently with asyncio, rate limited and retried with backoff. A single writer appends the
+summaries to the summaries pack and updates the database in batches. Each saved summary is appended to a checkpoint
+file, so an interrupted run resumes without requesting it again.
 """
-import sqlite3
+import asyncio
+import hashlib
+import json
+import os
+import time
 from dotenv import load_dotenv
-from functions import open_json
-from together import Together
+from together import AsyncTogether
+from together.error import APIConnectionError, APIError, InvalidRequestError, RateLimitError, \
+    ServiceUnavailableError, Timeout
+from tqdm import tqdm
+import food_db
+from artifact_store import artifact_exists, close_stores, read_artifact_bytes, read_json_artifact, \
+    write_artifact
+from rate_limit import RateLimiter, retry_with_backoff
 from summary_prompts import summary_prompt
-from multiprocessing import Pool, cpu_count
 
 load_dotenv()
 
 summary_tokens = 2048
-summary_dir = "summaries_long"
-# os.mkdir(summary_dir)
+fallback_summary_tokens = 1024  # In case max_tokens too large
 summary_llm_model = "google/gemma-2-9b-it"
-client_endpoint = Together()
+CHECKPOINT_FILE = "summaries_long_checkpoint.jsonl"  # Saved summaries with the hash of their reviews
 
-def process_place(row):
-    """Process a single place and generate its summary."""
-    # Extract place information
-    _, place_id, place_name, address, place_area, place_zone, _, rating, _, detail_path, review_path, _, _ = row
-    print(f"Processing {place_id}")
-    
-    detail_data = open_json(detail_path)
+MAX_CONCURRENT_REQUESTS = 16  # LLM requests in flight
+REQUESTS_PER_MINUTE = 300  # Keep under the provider rate limit
+MAX_RETRIES = 5  # Retries of a failed request, with exponential backoff
+DB_BATCH_SIZE = 50  # Summaries per database commit
+# Also summarize again places whose review file changed since their summary was made
+CHECK_REVIEW_HASH = False
+RETRY_ERRORS = (RateLimitError, ServiceUnavailableError, APIConnectionError, Timeout, APIError)
+
+
+def review_hash(review_path: str, place_id: str) -> str:
+    """Hash of the reviews of a place"""
+    return hashlib.sha256(read_artifact_bytes(review_path, place_id)).hexdigest()
+
+def build_prompt(row) -> str:
+    """Summary prompt with the details and reviews of a place"""
+    place_name, address, place_area, place_zone, rating = (row["name"], row["address"], row["area"],
+                                                           row["sub_zone"], row["rating"])
+    detail_data = read_json_artifact(row["detail_path"], row["place_id"])
     place_types = "".join(place_type + "," for place_type in detail_data["types"])
     gmap_mrt_station = detail_data.get('gmap_results', {}).get('MRT/Subway Station', "")
     gmap_shopping_mall = detail_data.get('gmap_results', {}).get('Shopping Mall', "")
     onemap_buildings = detail_data.get('onemap_building', "")
     building_names = ''.join(building + ", " for building in onemap_buildings)
-    reviews = open_json(review_path)
+    reviews = read_json_artifact(row["review_path"], row["place_id"])
 
     full_review_text = (
         f"Name of place: {place_name}. Located at {place_area} area and {place_zone} zone in Singapore.\n"
@@ -40,7 +62,6 @@ def process_place(row):
         f"It is classified as {place_types}. \n")
 
     # Extract information from reviews
-    print(f'Extracting reviews for {place_id}')
     review_count = 0
     for review in reviews:
         review_count += 1
@@ -64,73 +85,137 @@ def process_place(row):
 
     Answer:"""
     
-    print(f'Sending summary prompt into LLM for {place_id}')
-    # Sending full prompt into model
+    return summary_prompt_template
+
+async def request_summary(client: AsyncTogether, rate_limiter: RateLimiter, prompt: str) -> str:
+    """Get summary from LLM, retrying with smaller max_tokens if the request is rejected"""
     format_message = [
         {
             "role": "user",
-            "content": summary_prompt_template
+            "content": prompt
         }
     ]
-    
+
+    async def create(max_tokens: int):
+        return await retry_with_backoff(
+            lambda: client.chat.completions.create(
+                model=summary_llm_model,
+                messages=format_message,
+                stream=False,
+                max_tokens=max_tokens,
+            ),
+            max_retries=MAX_RETRIES, retry_on=RETRY_ERRORS, rate_limiter=rate_limiter)
+
     try:
-        stream = client_endpoint.chat.completions.create(
-            model=summary_llm_model,
-            messages=format_message,
-            stream=False,
-            max_tokens=summary_tokens,
-        )
-    except:
+        response = await create(summary_tokens)
+    except InvalidRequestError:
         # In case max_tokens too large
-        stream = client_endpoint.chat.completions.create(
-            model=summary_llm_model,
-            messages=format_message,
-            stream=False,
-            max_tokens=1024,
-        )
-    
-    summary_response = stream.choices[0].message.content
-    print(f'Saving summary response into file for {place_id}')
-    
-    # Create summary file
-    summary_json_filename = f"{place_id}_summary.txt"
-    summary_path = f"{summary_dir}/{summary_json_filename}"
-    with open(summary_path, "w") as file:
-        file.write(summary_response)
-
-    # Update database
-    conn = sqlite3.connect("food_places.db")
-    cursor = conn.cursor()
-    cursor.execute("UPDATE places SET summary_long_path = ? WHERE place_id = ?", (summary_path, place_id))
-    conn.commit()
+        response = await create(fallback_summary_tokens)
+    return response.choices[0].message.content
+
+async def summarize_place(row, client: AsyncTogether, rate_limiter: RateLimiter, semaphore: asyncio.Semaphore,
+                          results: asyncio.Queue):
+    """Summarize a place and pass the summary to the writer"""
+    place_id = row["place_id"]
+    async with semaphore:
+        try:
+            summary = await request_summary(client, rate_limiter, build_prompt(row))
+            await results.put((place_id, summary, review_hash(row["review_path"], place_id), None))
+        except Exception as e:
+            print(f"Error summarizing {place_id}: {e}")
+            await results.put((place_id, None, None, str(e)))
+
+async def write_summaries(results: asyncio.Queue, conn, num_places: int) -> int:
+    """Single writer saving summaries, checkpoint entries and database updates in batches"""
+    updates = []
+    num_saved = 0
+    with open(CHECKPOINT_FILE, "a", encoding="utf-8") as checkpoint, \
+            tqdm(total=num_places, desc="Summarizing places") as progress:
+        for _ in range(num_places):
+            place_id, summary, summary_review_hash, error = await results.get()
+            progress.update(1)
+            if summary is None:
+                food_db.set_status(conn, "summary", [(place_id, "failed", error)])
+                continue
+            summary_path = write_artifact("summary_long_path", place_id, summary)
+            checkpoint.write(json.dumps({"place_id": place_id, "summary_path": summary_path,
+                                         "review_hash": summary_review_hash}) + "\n")
+            checkpoint.flush()
+            updates.append((summary_path, place_id))
+            num_saved += 1
+            if len(updates) >= DB_BATCH_SIZE:
+                food_db.set_paths(conn, "summary_long_path", updates, stage="summary")
+                updates = []
+        food_db.set_paths(conn, "summary_long_path", updates, stage="summary")
+    return num_saved
+
+def load_checkpoint() -> dict:
+    """Checkpoint entries by place_id, latest entry of each place"""
+    entries = {}
+    if os.path.exists(CHECKPOINT_FILE):
+        with open(CHECKPOINT_FILE, "r", encoding="utf-8") as file:
+            for line in file:
+                if line.strip():
+                    entry = json.loads(line)
+                    entries[entry["place_id"]] = entry
+    return entries
+
+def find_places_to_summarize(conn, rows: list) -> list:
+    """
+    Places without summary or, with CHECK_REVIEW_HASH, with changed reviews. Summaries saved in the checkpoint by
+    an interrupted run are added to the database instead of being requested again.
+    """
+    entries = load_checkpoint()
+    recovered = []
+    baseline_entries = []
+    to_summarize = []
+    for row in rows:
+        place_id, review_path, summary_path = row["place_id"], row["review_path"], row["summary_long_path"]
+        entry = entries.get(place_id)
+        if entry is not None and not artifact_exists(entry["summary_path"], place_id):
+            entry = None
+        if summary_path is None and entry is not None:
+            recovered.append((entry["summary_path"], place_id))
+            summary_path = entry["summary_path"]
+        if summary_path is None:
+            to_summarize.append(row)
+        elif CHECK_REVIEW_HASH:
+            current_hash = review_hash(review_path, place_id)
+            if entry is None:
+                # Summarized before hashes were recorded, taken as up to date
+                baseline_entries.append({"place_id": place_id, "summary_path": summary_path,
+                                         "review_hash": current_hash})
+            elif entry["review_hash"] != current_hash:
+                to_summarize.append(row)
+    food_db.set_paths(conn, "summary_long_path", recovered, stage="summary")
+    if baseline_entries:
+        with open(CHECKPOINT_FILE, "a", encoding="utf-8") as checkpoint:
+            checkpoint.write("".join(json.dumps(entry) + "\n" for entry in baseline_entries))
+    print(f"Recovered {len(recovered)} summaries from checkpoint")
+    return to_summarize
+
+async def run():
+    conn = food_db.connect()
+    rows = list(food_db.iter_places_with_reviews(conn))
+    to_summarize = find_places_to_summarize(conn, rows)
+    print(f"Summarizing {len(to_summarize)} places with up to {MAX_CONCURRENT_REQUESTS} concurrent requests")
+
+    client = AsyncTogether(max_retries=0)  # Retries are done by retry_with_backoff
+    rate_limiter = RateLimiter(REQUESTS_PER_MINUTE)
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    results = asyncio.Queue()
+    start_time = time.perf_counter()
+    writer = asyncio.create_task(write_summaries(results, conn, len(to_summarize)))
+    await asyncio.gather(*(summarize_place(row, client, rate_limiter, semaphore, results) for row in to_summarize))
+    num_saved = await writer
     conn.close()
-    
-    print(f'Saved file and added to database for {place_id}!')
-    return place_id
+    close_stores()
+
+    elapsed = time.perf_counter() - start_time
+    print(f"Summarized {num_saved} places in {elapsed:.1f}s, {len(to_summarize) - num_saved} failed")
 
 def main():
-    """Main function to process places in parallel."""
-    # Create/connect to an SQLite database
-    conn = sqlite3.connect("food_places.db")
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT *
-        FROM places
-        WHERE review_path != 'None'
-        AND summary_long_path IS NULL
-    """)
-    results = cursor.fetchall()
-    conn.close()
-    
-    # Determine number of processes (use 75% of available CPU cores)
-    num_processes = max(1, int(cpu_count() * 0.75))
-    print(f"Using {num_processes} processes")
-    
-    # Process places in parallel
-    with Pool(processes=num_processes) as pool:
-        processed_places = pool.map(process_place, results)
-    
-    print(f"Processed {len(processed_places)} places")
+    asyncio.run(run())
 
 if __name__ == "__main__":
     main()
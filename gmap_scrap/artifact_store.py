@@ -0,0 +1,286 @@
+"""
+Append-only packed store of place details, reviews and summaries, instead of one file per place.
+A pack file holds (key, data) records one after another, keyed by place_id, with an index file of their offsets.
+Reads are zero-copy slices of a memory map of the pack, and bulk reads go through records in file order.
+The database path columns hold the pack path, e.g. review_path = "reviews.pack"; other paths are read as files.
+
+Pack the files of the current directories and point the database paths at the packs:
+    python artifact_store.py --db food_places.db
+"""
+import argparse
+import json
+import mmap
+import os
+import struct
+import time
+import zlib
+
+import food_db
+
+RECORD_HEADER = struct.Struct("<4sHII")  # Magic, key length, data length, CRC32 of data
+RECORD_MAGIC = b"APK1"
+PACK_SUFFIX = ".pack"
+# Pack of each path column
+PACKS = {
+    "detail_path": "details.pack",
+    "review_path": "reviews.pack",
+    "summary_long_path": "summaries_long.pack",
+}
+WINDOW_SIZE = 500  # Rows sorted by pack offset at a time by iter_in_pack_order
+
+
+class ArtifactStore:
+    def __init__(self, path: str):
+        """
+        Open or create the pack file at path and its index at path + ".idx". Putting a key again appends a new
+        record that replaces the old one. Records written after the last index update, e.g. by an interrupted run,
+        are recovered from the pack, and a partly written last record is dropped. Files are only created by put,
+        so a missing pack reads as empty.
+        """
+        self.path = path
+        self.index_path = path + ".idx"
+        self.index = {}  # key -> (offset of data, length of data)
+        self._recovered = []  # Records missing from the index file, written to it on the first put
+        self._index_size = 0  # Bytes of whole lines in the index file
+        self.end = self._load_index() if os.path.exists(path) else 0
+        self._file = open(path, "rb") if os.path.exists(path) else None
+        self._index_file = None
+        self._map = None
+
+    def _load_index(self) -> int:
+        """Load the index and recover records after it. Returns the end of the last whole record"""
+        size = os.path.getsize(self.path)
+        end = 0
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "rb") as file:
+                lines = file.read().split(b"\n")
+            # The last item is empty, or a line torn by an interrupted write whose record is recovered below
+            for line in lines[:-1]:
+                try:
+                    key, offset, length = line.decode("utf-8").rsplit("\t", 2)
+                    offset, length = int(offset), int(length)
+                except ValueError:
+                    continue
+                if offset + length <= size:  # Else the data was never flushed
+                    self.index[key] = (offset, length)
+                    end = max(end, offset + length)
+            self._index_size = os.path.getsize(self.index_path) - len(lines[-1])
+        with open(self.path, "rb") as file:
+            file.seek(end)
+            while True:
+                header = file.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    break
+                magic, key_length, data_length, crc = RECORD_HEADER.unpack(header)
+                key = file.read(key_length)
+                data = file.read(data_length)
+                if magic != RECORD_MAGIC or len(data) < data_length or zlib.crc32(data) != crc:
+                    break
+                data_offset = end + RECORD_HEADER.size + key_length
+                self._recovered.append((key.decode("utf-8"), data_offset, data_length))
+                self.index[self._recovered[-1][0]] = (data_offset, data_length)
+                end = data_offset + data_length
+        if self._recovered:
+            print(f"Recovered {len(self._recovered)} records of {self.path} missing from its index")
+        return end
+
+    def _open_for_write(self):
+        """Open the pack and index for appending, repairing what an interrupted write left behind"""
+        if self._file is not None:
+            self._file.close()
+        self._file = open(self.path, "r+b" if os.path.exists(self.path) else "w+b")
+        # Drop a partly written last record and a torn last index line, then index the recovered records
+        self._file.truncate(self.end)
+        with open(self.index_path, "ab") as file:
+            file.truncate(self._index_size)
+        self._index_file = open(self.index_path, "a", encoding="utf-8")
+        for key, offset, length in self._recovered:
+            self._index_file.write(f"{key}\t{offset}\t{length}\n")
+        self._index_file.flush()
+        self._recovered = []
+        self._map = None
+
+    def put(self, key: str, data: bytes | str):
+        """Append data for key, written through to the OS so readers and the database can refer to it"""
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        key_bytes = key.encode("utf-8")
+        if self._index_file is None:
+            # Repair only when writing, as readers may open the pack during a write
+            self._open_for_write()
+        self._file.seek(self.end)
+        self._file.write(RECORD_HEADER.pack(RECORD_MAGIC, len(key_bytes), len(data), zlib.crc32(data)))
+        self._file.write(key_bytes)
+        self._file.write(data)
+        self._file.flush()
+        offset = self.end + RECORD_HEADER.size + len(key_bytes)
+        self.end = offset + len(data)
+        self.index[key] = (offset, len(data))
+        self._index_file.write(f"{key}\t{offset}\t{len(data)}\n")
+        self._index_file.flush()
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.index
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def keys(self):
+        return self.index.keys()
+
+    def _view(self, offset: int, length: int) -> memoryview:
+        if length == 0:
+            return memoryview(b"")  # Empty files cannot be memory-mapped
+        if self._map is None or len(self._map) < offset + length:
+            # Remap to cover appended records. Views of the old map stay valid until released
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return memoryview(self._map)[offset:offset + length]
+
+    def get(self, key: str) -> memoryview:
+        """Data of key as a view of the memory-mapped pack, without copying"""
+        offset, length = self.index[key]
+        return self._view(offset, length)
+
+    def get_text(self, key: str) -> str:
+        return str(self.get(key), "utf-8")
+
+    def items(self, keys=None):
+        """(key, data view) of keys, or of all keys, in file order so the pack is read sequentially"""
+        keys = self.index.keys() if keys is None else [key for key in keys if key in self.index]
+        for key in sorted(keys, key=lambda key: self.index[key][0]):
+            yield key, self.get(key)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+        if self._index_file is not None:
+            self._index_file.close()
+        self._map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+_stores = {}
+
+
+def get_store(path: str) -> ArtifactStore:
+    """Store of a pack path, opened once per process"""
+    if path not in _stores:
+        _stores[path] = ArtifactStore(path)
+    return _stores[path]
+
+
+def close_stores():
+    for store in _stores.values():
+        store.close()
+    _stores.clear()
+
+
+def is_pack(path: str) -> bool:
+    return path is not None and path.endswith(PACK_SUFFIX)
+
+
+def write_artifact(column: str, place_id: str, data: bytes | str) -> str:
+    """Append an artifact of a place to the pack of a path column. Returns the path to save in the column"""
+    path = PACKS[column]
+    get_store(path).put(place_id, data)
+    return path
+
+
+def read_artifact_bytes(path: str, place_id: str) -> bytes:
+    if is_pack(path):
+        return bytes(get_store(path).get(place_id))
+    with open(path, "rb") as file:
+        return file.read()
+
+
+def read_artifact(path: str, place_id: str) -> str:
+    """Text of an artifact, from a pack or from a file"""
+    if is_pack(path):
+        return get_store(path).get_text(place_id)
+    with open(path, "r", encoding="utf-8") as file:
+        return file.read()
+
+
+def read_json_artifact(path: str, place_id: str):
+    return json.loads(read_artifact(path, place_id))
+
+
+def artifact_exists(path: str, place_id: str) -> bool:
+    if is_pack(path):
+        return os.path.exists(path) and place_id in get_store(path)
+    return os.path.exists(path)
+
+
+def iter_in_pack_order(rows, column: str, window_size: int = WINDOW_SIZE):
+    """
+    Place rows taken window_size at a time and reordered by the pack offset of their artifact in a path column,
+    so reading the artifacts goes through each pack sequentially
+    """
+    def offset(row):
+        path = row[column]
+        if is_pack(path):
+            return path, get_store(path).index.get(row["place_id"], (-1, 0))[0]
+        return path, 0
+
+    window = []
+    for row in rows:
+        window.append(row)
+        if len(window) >= window_size:
+            yield from sorted(window, key=offset)
+            window = []
+    yield from sorted(window, key=offset)
+
+
+def iter_place_artifacts(rows, column: str, window_size: int = WINDOW_SIZE):
+    """(row, text) of the artifact in a path column for each place row, read in pack order"""
+    for row in iter_in_pack_order(rows, column, window_size):
+        yield row, read_artifact(row[column], row["place_id"])
+
+
+def pack_files(conn, column: str, remove_files: bool = False) -> int:
+    """Move the files of a path column into its pack and point the column at the pack"""
+    rows = conn.execute(f"SELECT place_id, {column} FROM places WHERE {column} IS NOT NULL ORDER BY id").fetchall()
+    updates = []
+    num_packed = 0
+    for row in rows:
+        place_id, path = row["place_id"], row[column]
+        if is_pack(path):
+            continue
+        if not os.path.exists(path):
+            print(f"Missing {path} of {place_id}")
+            continue
+        updates.append((write_artifact(column, place_id, read_artifact_bytes(path, place_id)), place_id))
+        num_packed += 1
+        if len(updates) >= food_db.FETCH_SIZE:
+            food_db.set_paths(conn, column, updates)
+            updates = []
+    food_db.set_paths(conn, column, updates)
+    if remove_files:
+        for row in rows:
+            if not is_pack(row[column]) and os.path.exists(row[column]):
+                os.remove(row[column])
+    return num_packed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default=food_db.DB_PATH, help="SQLite database with the paths to pack")
+    parser.add_argument("--remove-files", action="store_true", help="Delete the files once packed")
+    args = parser.parse_args()
+
+    conn = food_db.connect(args.db)
+    for column, pack_path in PACKS.items():
+        start_time = time.perf_counter()
+        num_packed = pack_files(conn, column, remove_files=args.remove_files)
+        print(f"Packed {num_packed} files of {column} into {pack_path} in {time.perf_counter() - start_time:.1f}s")
+    close_stores()
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,29 @@
 """
-Create or update Chroma database from embedded summaries
+Create or update Chroma database from embedded summaries.
+Rows are streamed from SQLite, chunks of several places are embedded per request with a few requests in flight
+and added to Chroma in bulk. Added places are appended to a checkpoint file, so a rerun after a crash resumes
+where it stopped.
 """
-import sqlite3
 from dotenv import load_dotenv
 import chromadb
 from chromadb.config import Settings
 from together import Together
 import os
 import re
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from tqdm import tqdm
-import uuid
+import food_db
+from artifact_store import iter_in_pack_order, read_artifact
 
 load_dotenv()
 # Configuration
 DB_PATH = "food_places.db"  # Path to your SQLite database
 CHROMA_PATH = "chroma_gmapfood"  # Path to Chroma database
+CHECKPOINT_FILE = "chroma_gmapfood_checkpoint.txt"  # place_ids already in Chroma, one per line
 TOGETHER_API_KEY = os.getenv("TOGETHER_API_KEY")  # Set your Together API key
-client = Together()
+# Embedding API base URL, e.g. a local stub_embedding_server.py. Together API if not set
+EMBED_BASE_URL = os.getenv("EMBED_BASE_URL")
 
 model_name = "BAAI/bge-large-en-v1.5"
 MAX_TOKENS = 440 # 512 - 72 tokens (for 1st 3 lines)
@@ -24,20 +31,20 @@ TOKEN_RATIO = 1.5  # 1 word ≈ 1.5 tokens
 MAX_WORDS = int(MAX_TOKENS / TOKEN_RATIO)  # Maximum words per chunk
 n_first_lines = 3 # Lines containing Name, Location and Type information
 
-# Initialize Chroma client and collection
-chroma_client = chromadb.PersistentClient(path=CHROMA_PATH, settings=Settings(anonymized_telemetry=False))
-try:
-    collection = chroma_client.get_collection("gmap_food")
-except:
-    collection = chroma_client.create_collection("gmap_food")
+EMBED_BATCH_SIZE = 64  # Chunks per embedding request, whole places are kept in one request
+MAX_CONCURRENT_REQUESTS = 4  # Embedding requests in flight
+MAX_RETRIES = 5  # Retries of a failed embedding request, with exponential backoff
+CHROMA_BATCH_SIZE = 1000  # Chunks per Chroma insert
 
-def get_embeddings(text: str) -> list[float]:
-    """Get embeddings for a text using Together API."""
+
+def get_embeddings(client: Together, texts: list[str]) -> list[list[float]]:
+    """Get embeddings for a list of texts with one embedding request."""
     response = client.embeddings.create(
-        input=text,
+        input=texts,
         model=model_name
     )
-    return response.data[0].embedding
+    data = sorted(response.data, key=lambda item: item.index)
+    return [item.embedding for item in data]
 
 def split_into_words(text: str) -> list[str]:
     """Split text into words while preserving punctuation and spacing."""
@@ -89,113 +96,157 @@ def chunk_text(text: str, max_words: int = MAX_WORDS) -> list[str]:
 
     return chunks
 
-def get_existing_place_ids():
-    """Fetch existing place_ids from Chroma to avoid duplicates."""
+def get_existing_place_ids(collection) -> set:
+    """Fetch place_ids in Chroma and in the checkpoint file to avoid duplicates."""
+    place_ids = set()
+    if os.path.exists(CHECKPOINT_FILE):
+        with open(CHECKPOINT_FILE, "r", encoding="utf-8") as file:
+            place_ids.update(line.strip() for line in file if line.strip())
     try:
         results = collection.get(include=['metadatas'])
-        return set([metadata["place_id"] for metadata in results['metadatas']])
-    except:
-        return set()
-
-def process_place(place_id: str, place_name: str, address: str, place_area: str, 
-                 place_zone: str, place_type: str, rating: float, summary_path: str) -> tuple[bool, str]:
-    """Process a single place and add its chunks to Chroma."""
-    try:
-        with open(summary_path, "r", encoding="utf-8") as file:
-            text = file.read()
-
-        # Split text into chunks
-        chunks = chunk_text(text)
-        print(f"Split text into {len(chunks)} chunks")
-        
-        # Store each chunk in Chroma
-        text_chunks = []
-        embedding_chunks = []
-        meta_data_chunks = []
-        # id_chunks = []
-
-        for chunk_idx, chunk in enumerate(chunks):
-            # Get embeddings for the chunk
-            embedding = get_embeddings(chunk)
-            
-            # Store in Chroma with chunk information
-            meta_data = {
-                "place_id": place_id,
-                "place_name": place_name,
-                "address": address,
-                "place_area": place_area,
-                "place_zone": place_zone,
-                "place_type": place_type,
-                "rating": rating,
-                "chunk_index": chunk_idx,
-                "total_chunks": len(chunks)
-            }
-            text_chunks.append(chunk)
-            embedding_chunks.append(embedding)
-            meta_data_chunks.append(meta_data)
-            # id_chunks.append(f"{place_id}_chunk_{chunk_idx}")
-
-        id_chunks = [str(uuid.uuid4()) for _ in text_chunks]
-        collection.add(
-            documents=text_chunks,
-            embeddings=embedding_chunks,
-            metadatas=meta_data_chunks,
-            ids=id_chunks
-        )
-        print(f"Added {len(chunks)} chunks  for {place_id} to Chroma.")
-            
-        return True, f"Successfully processed {place_id} with {len(chunks)} chunks"
+        place_ids.update(metadata["place_id"] for metadata in results['metadatas'])
     except Exception as e:
-        return False, f"Error processing {place_id}: {str(e)}"
+        print(f"Could not read place_ids from Chroma: {e}")
+    return place_ids
+
+def stream_places(conn, skip_place_ids: set):
+    """Yield rows of places with summaries in pack order, skipping places already in Chroma."""
+    rows = (row for row in food_db.iter_places_with_summary(conn) if row["place_id"] not in skip_place_ids)
+    yield from iter_in_pack_order(rows, "summary_long_path")
+
+def get_place_chunks(row) -> dict:
+    """Read the summary of a place and split it into chunks with their metadata."""
+    place_id = row["place_id"]
+    text = read_artifact(row["summary_long_path"], place_id)
+
+    chunks = chunk_text(text)
+    meta_data_chunks = [
+        {
+            "place_id": place_id,
+            "place_name": row["name"],
+            "address": row["address"],
+            "place_area": row["area"],
+            "place_zone": row["sub_zone"],
+            "place_type": row["type"],
+            "rating": row["rating"],
+            "chunk_index": chunk_idx,
+            "total_chunks": len(chunks)
+        }
+        for chunk_idx in range(len(chunks))
+    ]
+    # Ids are fixed per chunk, so re-adding a place after a crash overwrites instead of duplicating it
+    id_chunks = [f"{place_id}_chunk_{chunk_idx}" for chunk_idx in range(len(chunks))]
+    return {"place_id": place_id, "documents": chunks, "metadatas": meta_data_chunks, "ids": id_chunks}
+
+def batch_places(rows, failures: list):
+    """Group chunks of whole places into batches of about EMBED_BATCH_SIZE chunks."""
+    batch = []
+    num_chunks = 0
+    for row in rows:
+        try:
+            place = get_place_chunks(row)
+        except Exception as e:
+            failures.append(f"Error processing {row['place_id']}: {str(e)}")
+            continue
+        batch.append(place)
+        num_chunks += len(place["documents"])
+        if num_chunks >= EMBED_BATCH_SIZE:
+            yield batch
+            batch = []
+            num_chunks = 0
+    if batch:
+        yield batch
+
+def embed_places(client: Together, batch: list[dict]) -> list[dict]:
+    """Embed the chunks of a batch of places in one request, retrying with backoff on errors."""
+    texts = [chunk for place in batch for chunk in place["documents"]]
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            embeddings = get_embeddings(client, texts)
+            break
+        except Exception:
+            if attempt == MAX_RETRIES:
+                raise
+            time.sleep(2 ** attempt)
+    start = 0
+    for place in batch:
+        place["embeddings"] = embeddings[start:start + len(place["documents"])]
+        start += len(place["documents"])
+    return batch
+
+def add_places(collection, conn, places: list[dict], checkpoint_file) -> int:
+    """Add chunks of places to Chroma with one insert and record the places in the checkpoint file."""
+    if not places:
+        return 0
+    collection.upsert(
+        documents=[chunk for place in places for chunk in place["documents"]],
+        embeddings=[embedding for place in places for embedding in place["embeddings"]],
+        metadatas=[meta_data for place in places for meta_data in place["metadatas"]],
+        ids=[chunk_id for place in places for chunk_id in place["ids"]]
+    )
+    checkpoint_file.write("".join(f"{place['place_id']}\n" for place in places))
+    checkpoint_file.flush()
+    food_db.set_status(conn, "embedding", [(place["place_id"], "done", None) for place in places])
+    return sum(len(place["documents"]) for place in places)
 
 def main():
+    client = Together(base_url=EMBED_BASE_URL, max_retries=0)  # Retries are done by embed_places
+    # Initialize Chroma client and collection
+    chroma_client = chromadb.PersistentClient(path=CHROMA_PATH, settings=Settings(anonymized_telemetry=False))
+    collection = chroma_client.get_or_create_collection("gmap_food")
+
     # Get existing place IDs
-    existing_place_ids = get_existing_place_ids()
+    existing_place_ids = get_existing_place_ids(collection)
     print(f"Found {len(existing_place_ids)} existing places in Chroma")
-    
-    # Get all places from database
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT *
-        FROM places
-        WHERE summary_long_path != 'None'
-    """)
-    rows = cursor.fetchall()
-    conn.close()
 
-    total_places = len(rows)
+    conn = food_db.connect(DB_PATH)
+    total_places = food_db.count_places_with_summary(conn)
     print(f"Processing {total_places} places...")
 
-    successes = []
+    num_places = 0
+    num_chunks = 0
     failures = []
+    pending = {}  # Embedding request future -> batch of places
+    to_add = []  # Embedded places waiting for a Chroma insert
+    progress = tqdm(total=total_places, desc="Processing places")
+    progress.update(min(len(existing_place_ids), total_places))
+    start_time = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS) as executor, \
+            open(CHECKPOINT_FILE, "a", encoding="utf-8") as checkpoint:
+        batches = batch_places(stream_places(conn, existing_place_ids), failures)
+        while True:
+            # Keep a few batches queued, so rows are not read much faster than they are embedded
+            for batch in batches:
+                pending[executor.submit(embed_places, client, batch)] = batch
+                if len(pending) >= 2 * MAX_CONCURRENT_REQUESTS:
+                    break
+            if not pending:
+                break
+            done_futures, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done_futures:
+                batch = pending.pop(future)
+                try:
+                    to_add.extend(future.result())
+                except Exception as e:
+                    failures.extend(f"Error embedding {place['place_id']}: {str(e)}" for place in batch)
+                    food_db.set_status(conn, "embedding", [(place["place_id"], "failed", str(e)) for place in batch])
+            if pending and sum(len(place["documents"]) for place in to_add) < CHROMA_BATCH_SIZE:
+                continue
+            num_chunks += add_places(collection, conn, to_add, checkpoint)
+            num_places += len(to_add)
+            progress.update(len(to_add))
+            progress.set_postfix(chunks_per_sec=f"{num_chunks / (time.perf_counter() - start_time):.1f}")
+            to_add = []
+    progress.close()
+    conn.close()
 
-    # Process each place sequentially with a progress bar
-    for row in tqdm(rows, desc="Processing places"):
-        _, place_id, place_name, address, place_area, place_zone, place_type, rating, _, detail_path, review_path, _, summary_path = row
-        
-        print(f"\nProcessing {place_id} ({place_name})")
-        
-        if place_id in existing_place_ids:
-            print(f"Skipping {place_id}, already in Chroma.")
-            successes.append(f"Skipped {place_id}, already in Chroma.")
-            continue
-
-        success, message = process_place(
-            place_id, place_name, address, place_area, 
-            place_zone, place_type, rating, summary_path
-        )
-        
-        if success:
-            successes.append(message)
-        else:
-            failures.append(message)
-            print(f"Error: {message}")
-
-    print(f"\nProcessing complete!")
-    print(f"Successfully processed: {len(successes)} places")
+    elapsed = time.perf_counter() - start_time
+    print("\nProcessing complete!")
+    print(f"Added {num_chunks} chunks of {num_places} places in {elapsed:.1f}s "
+          f"({num_chunks / max(elapsed, 1e-9):.1f} chunks/s)")
     if failures:
-        print(f"Failed to process {len(failures)} places:")
+        print(f"Failed to process {len(failures)} places, rerun to retry them:")
         for failure in failures:
             print(failure)
 
@@ -0,0 +1,149 @@
+"""
+Extract structured facets (cuisine, price band, rating, place type, dietary) for each summarised place
+and save them as a compact facet table with bitmap indexes for pre-filtering in the chatbot
+"""
+import pickle
+import re
+import numpy as np
+from tqdm import tqdm
+import food_db
+from artifact_store import iter_place_artifacts
+
+DB_PATH = "food_places.db"  # Path to your SQLite database
+FACET_FILE = "facet_index"  # Output file, copy to app folder together with BM25 file
+
+# Keywords used to tag each facet value. Saved into the facet file so the chatbot query parser
+# matches query phrases against the same vocabulary
+facet_keywords = {
+    "cuisine": {
+        "japanese": ["japanese", "sushi", "ramen", "izakaya", "omakase", "yakiniku", "udon", "donburi"],
+        "korean": ["korean", "kbbq"],
+        "chinese": ["chinese", "cantonese", "sichuan", "szechuan", "dim sum", "teochew", "hainanese", "zi char"],
+        "thai": ["thai"],
+        "vietnamese": ["vietnamese", "pho"],
+        "indonesian": ["indonesian"],
+        "malay": ["malay", "nasi lemak"],
+        "peranakan": ["peranakan", "nyonya"],
+        "indian": ["indian", "biryani", "north indian", "south indian"],
+        "middle eastern": ["middle eastern", "lebanese", "turkish", "persian", "arabic"],
+        "mediterranean": ["mediterranean", "greek"],
+        "italian": ["italian", "pizza", "pasta", "trattoria"],
+        "french": ["french", "bistro"],
+        "spanish": ["spanish", "tapas"],
+        "swiss": ["swiss", "fondue"],
+        "mexican": ["mexican", "taco", "tacos"],
+        "latin american": ["latin american", "peruvian", "brazilian", "argentinian"],
+        "african": ["african", "ethiopian", "moroccan"],
+        "american": ["american", "burger", "burgers"],
+        "western": ["western", "european"],
+        "steakhouse": ["steak", "steakhouse"],
+        "seafood": ["seafood", "crab", "oyster"],
+    },
+    "place_type": {
+        "cafe": ["cafe", "cafes", "coffee"],
+        "bar": ["bar", "bars", "pub", "cocktail", "wine bar"],
+        "bakery": ["bakery", "bakeries", "patisserie"],
+        "dessert": ["dessert", "desserts", "ice cream", "gelato"],
+        "hawker": ["hawker", "food court", "kopitiam", "coffee shop"],
+    },
+    "dietary": {
+        "halal": ["halal", "muslim-friendly", "muslim friendly"],
+        "vegetarian": ["vegetarian"],
+        "vegan": ["vegan", "plant-based"],
+    },
+}
+
+# Upper bound of price per person (in SGD) for each price band
+price_bands = {
+    "budget": 15,
+    "moderate": 40,
+    "upscale": 80,
+    "fine dining": float("inf"),
+}
+
+# Skip negated mentions such as "not halal" or "non-halal"
+negation_lookbehind = r"(?<!not )(?<!non-)(?<!non )(?<!no )"
+
+
+def get_summary_field(text: str, field: str) -> str:
+    """Get value of a 'Field: value' line in a summary"""
+    match = re.search(rf"^\s*{field}\s*:\s*(.*)$", text, flags=re.IGNORECASE | re.MULTILINE)
+    return match.group(1).strip() if match else ""
+
+
+def match_keywords(text: str, keywords: dict, skip_negated: bool = False) -> list:
+    """Return facet values whose keywords appear in text"""
+    values = []
+    for value, words in keywords.items():
+        for word in words:
+            pattern = rf"\b{re.escape(word)}\b"
+            if skip_negated:
+                pattern = negation_lookbehind + pattern
+            if re.search(pattern, text):
+                values.append(value)
+                break
+    return values
+
+
+def get_price_band(price_text: str) -> str | None:
+    """Convert a price range such as '$20-50 per person' into a price band using the midpoint"""
+    prices = [float(price) for price in re.findall(r"\d+(?:\.\d+)?", price_text.replace(",", ""))]
+    if not prices:
+        return None
+    midpoint = (min(prices[:2]) + max(prices[:2])) / 2
+    for band, upper in price_bands.items():
+        if midpoint <= upper:
+            return band
+    return None
+
+
+conn = food_db.connect(DB_PATH)
+rows = list(food_db.iter_places_with_summary(conn))
+conn.close()
+
+place_ids = []
+ratings = np.full(len(rows), np.nan, dtype=np.float32)
+facet_members = {facet: {value: [] for value in keywords} for facet, keywords in facet_keywords.items()}
+facet_members["price_band"] = {band: [] for band in price_bands}
+for row_idx, (row, text) in enumerate(tqdm(iter_place_artifacts(rows, "summary_long_path"), total=len(rows),
+                                           desc="Extracting facets")):
+    place_id, place_type, rating = row["place_id"], row["type"], row["rating"]
+    text = text.lower()
+    place_ids.append(place_id)
+    if rating is not None:
+        ratings[row_idx] = rating
+
+    # Cuisine and place type from Google Maps type and summary classification
+    type_text = f"{str(place_type).lower()} {get_summary_field(text, 'type')}"
+    for facet in ["cuisine", "place_type"]:
+        for value in match_keywords(type_text, facet_keywords[facet]):
+            facet_members[facet][value].append(row_idx)
+    # Dietary information can be mentioned anywhere in summary
+    for value in match_keywords(text, facet_keywords["dietary"], skip_negated=True):
+        facet_members["dietary"][value].append(row_idx)
+
+    price_band = get_price_band(get_summary_field(text, "price range"))
+    if price_band:
+        facet_members["price_band"][price_band].append(row_idx)
+
+# Bitmap index per facet value, packed into bits
+num_places = len(place_ids)
+bitmaps = {}
+for facet, members in facet_members.items():
+    bitmaps[facet] = {}
+    for value, row_indices in members.items():
+        bitmap = np.zeros(num_places, dtype=bool)
+        bitmap[row_indices] = True
+        bitmaps[facet][value] = np.packbits(bitmap)
+    counts = ", ".join(f"{value}: {len(row_indices)}" for value, row_indices in members.items())
+    print(f"{facet} -> {counts}")
+
+with open(FACET_FILE, "wb") as facet_file:
+    pickle.dump({
+        "place_ids": place_ids,
+        "num_places": num_places,
+        "rating": ratings,
+        "bitmaps": bitmaps,
+        "keywords": facet_keywords,
+    }, facet_file)
+print(f"Saved facets of {num_places} places to {FACET_FILE}")
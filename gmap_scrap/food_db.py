@@ -0,0 +1,219 @@
+"""
+Schema, migrations and queries of the food places SQLite database shared by the pipeline scripts.
+Missing paths are NULL, place_id is unique and rows are read by column name.
+
+Migrate an existing database to the current schema version:
+    python food_db.py --db food_places.db
+"""
+import argparse
+import sqlite3
+
+DB_PATH = "food_places.db"  # Path to your SQLite database
+PLACE_COLUMNS = ("place_id", "name", "address", "area", "sub_zone", "type", "rating", "num_reviews",
+                 "detail_path", "review_path", "summary_path", "summary_long_path")
+PATH_COLUMNS = ("detail_path", "review_path", "summary_path", "summary_long_path")
+FETCH_SIZE = 500  # Rows read at a time by the iter_ functions
+
+
+def _create_places(conn: sqlite3.Connection):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS places (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            place_id TEXT,
+            name TEXT,
+            address TEXT,
+            area TEXT,
+            sub_zone TEXT,
+            type TEXT,
+            rating REAL,
+            num_reviews REAL,
+            detail_path TEXT,
+            review_path TEXT,
+            summary_path TEXT,
+            summary_long_path TEXT
+        )
+    """)
+    # Tables created with the missing comma after summary_path have no summary_long_path column
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(places)")}
+    if "summary_long_path" not in columns:
+        conn.execute("ALTER TABLE places ADD COLUMN summary_long_path TEXT")
+
+
+def _missing_paths_as_null(conn: sqlite3.Connection):
+    for column in PATH_COLUMNS:
+        conn.execute(f"UPDATE places SET {column} = NULL WHERE {column} = 'None'")
+
+
+def _unique_place_id(conn: sqlite3.Connection):
+    # Index place_id first, else the lookup of duplicates scans the table for every row
+    conn.execute("CREATE INDEX IF NOT EXISTS places_place_id_tmp ON places (place_id, id)")
+    # Keep the first row of each place, with paths found only in its duplicates
+    for column in PATH_COLUMNS:
+        conn.execute(f"""
+            UPDATE places SET {column} = (
+                SELECT duplicate.{column} FROM places AS duplicate
+                WHERE duplicate.place_id = places.place_id AND duplicate.{column} IS NOT NULL
+                ORDER BY duplicate.id LIMIT 1
+            )
+            WHERE {column} IS NULL
+        """)
+    num_deleted = conn.execute(
+        "DELETE FROM places WHERE id NOT IN (SELECT MIN(id) FROM places GROUP BY place_id)").rowcount
+    if num_deleted:
+        print(f"Removed {num_deleted} duplicate places")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS places_place_id ON places (place_id)")
+    conn.execute("DROP INDEX places_place_id_tmp")
+
+
+def _add_status(conn: sqlite3.Connection):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS place_status (
+            place_id TEXT NOT NULL,
+            stage TEXT NOT NULL,
+            status TEXT NOT NULL,
+            error TEXT,
+            updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (place_id, stage)
+        )
+    """)
+    # Partial indexes of the rows each stage reads, so its query does not scan places
+    conn.execute("CREATE INDEX IF NOT EXISTS places_with_summary ON places (id) WHERE summary_long_path IS NOT NULL")
+    conn.execute("CREATE INDEX IF NOT EXISTS places_with_reviews ON places (id) WHERE review_path IS NOT NULL")
+
+
+# Schema version i + 1 is reached by running MIGRATIONS[i], the version is kept in PRAGMA user_version
+MIGRATIONS = [_create_places, _missing_paths_as_null, _unique_place_id, _add_status]
+
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """
+    Run migrations newer than the database schema version, each in its own transaction. The version is read again
+    after taking the write lock, so scripts started at the same time do not run the same migration twice
+    """
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    while version < len(MIGRATIONS):
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version >= len(MIGRATIONS):
+                conn.commit()  # Migrated by another connection while waiting for the lock
+                break
+            MIGRATIONS[version](conn)
+            version += 1
+            conn.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        print(f"Migrated database to schema version {version}")
+    return max(version, len(MIGRATIONS))
+
+
+def connect(db_path: str = DB_PATH) -> sqlite3.Connection:
+    """Connection in WAL mode with rows readable by column name, migrated to the current schema"""
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode = WAL")  # Readers do not block the writer of another script
+    conn.execute("PRAGMA synchronous = NORMAL")
+    migrate(conn)
+    return conn
+
+
+def _iter_rows(cursor: sqlite3.Cursor):
+    while True:
+        rows = cursor.fetchmany(FETCH_SIZE)
+        if not rows:
+            return
+        yield from rows
+
+
+def iter_places_with_summary(conn: sqlite3.Connection):
+    """Places with a long summary, read FETCH_SIZE rows at a time"""
+    return _iter_rows(conn.execute("SELECT * FROM places WHERE summary_long_path IS NOT NULL ORDER BY id"))
+
+
+def count_places_with_summary(conn: sqlite3.Connection) -> int:
+    return conn.execute("SELECT COUNT(*) FROM places WHERE summary_long_path IS NOT NULL").fetchone()[0]
+
+
+def iter_places_with_reviews(conn: sqlite3.Connection):
+    """Places with reviews, read FETCH_SIZE rows at a time"""
+    return _iter_rows(conn.execute("SELECT * FROM places WHERE review_path IS NOT NULL ORDER BY id"))
+
+
+def get_place_ids(conn: sqlite3.Connection) -> set:
+    return {row[0] for row in conn.execute("SELECT place_id FROM places")}
+
+
+def get_places(conn: sqlite3.Connection, place_ids: list) -> dict:
+    """Places by place_id, looked up in the place_id index"""
+    places = {}
+    place_ids = list(place_ids)
+    for start in range(0, len(place_ids), FETCH_SIZE):
+        batch = place_ids[start:start + FETCH_SIZE]
+        cursor = conn.execute(f"SELECT * FROM places WHERE place_id IN ({', '.join('?' * len(batch))})", batch)
+        places.update((row["place_id"], row) for row in cursor)
+    return places
+
+
+def insert_places(conn: sqlite3.Connection, places: list[dict]) -> int:
+    """Insert places, given as dicts of PLACE_COLUMNS, in one transaction. Places already in the database are
+    skipped. Returns the number of places inserted"""
+    with conn:
+        cursor = conn.executemany(
+            f"INSERT OR IGNORE INTO places ({', '.join(PLACE_COLUMNS)}) "
+            f"VALUES ({', '.join('?' * len(PLACE_COLUMNS))})",
+            [tuple(place.get(column) for column in PLACE_COLUMNS) for place in places])
+    return cursor.rowcount
+
+
+def set_paths(conn: sqlite3.Connection, column: str, updates: list[tuple[str, str]], stage: str = None):
+    """Set a path column of (path, place_id) pairs in one transaction, marking stage done for them if given"""
+    if column not in PATH_COLUMNS:
+        raise ValueError(f"Unknown path column {column}, expected one of {PATH_COLUMNS}")
+    if not updates:
+        return
+    with conn:
+        conn.executemany(f"UPDATE places SET {column} = ? WHERE place_id = ?", updates)
+        if stage is not None:
+            _set_status(conn, stage, [(place_id, "done", None) for _, place_id in updates])
+
+
+def _set_status(conn: sqlite3.Connection, stage: str, statuses: list[tuple]):
+    conn.executemany("""
+        INSERT INTO place_status (place_id, stage, status, error, updated_at) VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+        ON CONFLICT (place_id, stage) DO UPDATE SET
+            status = excluded.status, error = excluded.error, updated_at = excluded.updated_at
+    """, [(place_id, stage, status, error) for place_id, status, error in statuses])
+
+
+def set_status(conn: sqlite3.Connection, stage: str, statuses: list[tuple]):
+    """Record (place_id, status, error) of a pipeline stage, e.g. "reviews", "summary" or "embedding" """
+    if statuses:
+        with conn:
+            _set_status(conn, stage, statuses)
+
+
+def get_status(conn: sqlite3.Connection, stage: str) -> dict:
+    """Status of each place in a pipeline stage, by place_id"""
+    return {row["place_id"]: row["status"]
+            for row in conn.execute("SELECT place_id, status FROM place_status WHERE stage = ?", (stage,))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default=DB_PATH, help="SQLite database to migrate")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    conn.close()
+    conn = connect(args.db)
+    new_version = conn.execute("PRAGMA user_version").fetchone()[0]
+    num_places = conn.execute("SELECT COUNT(*) FROM places").fetchone()[0]
+    conn.close()
+    print(f"{args.db}: schema version {version} -> {new_version}, {num_places} places")
+
+
+if __name__ == "__main__":
+    main()
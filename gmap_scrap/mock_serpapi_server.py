@@ -0,0 +1,90 @@
+"""
+Local mock of the SerpAPI Google Maps reviews and account endpoints for trying add_reviews.py without spending
+searches. Each place has --pages pages of 10 reviews, and a fraction of requests get HTTP 429.
+
+Usage:
+    python mock_serpapi_server.py --port 8766 --latency 0.5 --searches-left 100
+    SERPAPI_KEY=mock SERPAPI_BASE_URL=http://localhost:8766 python add_reviews.py
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class MockSerpApiHandler(BaseHTTPRequestHandler):
+    latency = 0.5
+    num_pages = 3
+    error_probability = 0.0
+    searches_left = 100
+    rate_limit_per_hour = 6000
+    num_searches = 0
+    lock = threading.Lock()
+
+    def send_json(self, status: int, data: dict):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        if url.path == "/account.json":
+            self.send_json(200, {"total_searches_left": self.searches_left,
+                                 "account_rate_limit_per_hour": self.rate_limit_per_hour})
+            return
+        if url.path != "/search.json" or params.get("engine") != "google_maps_reviews":
+            self.send_json(404, {"error": "Not found"})
+            return
+        time.sleep(self.latency)
+        handler = type(self)  # Counts are kept on the class, which may be a subclass with its own settings
+        with handler.lock:
+            if random.random() < self.error_probability or handler.searches_left <= 0:
+                self.send_json(429, {"error": "Too many requests"})
+                return
+            handler.searches_left -= 1
+            handler.num_searches += 1
+        place_id = params["place_id"]
+        page = int(params.get("next_page_token", "page0")[len("page"):])
+        results = {"reviews": [{"snippet": f"Review {page * 10 + i} of {place_id}", "rating": 1 + (i % 5)}
+                               for i in range(10)]}
+        if page + 1 < self.num_pages:
+            results["serpapi_pagination"] = {"next_page_token": f"page{page + 1}"}
+        self.send_json(200, results)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--latency", type=float, default=0.5, help="Seconds per search")
+    parser.add_argument("--pages", type=int, default=3, help="Pages of reviews per place")
+    parser.add_argument("--error-probability", type=float, default=0.0, help="Fraction of searches rate limited")
+    parser.add_argument("--searches-left", type=int, default=100)
+    parser.add_argument("--rate-limit-per-hour", type=int, default=6000)
+    args = parser.parse_args()
+
+    MockSerpApiHandler.latency = args.latency
+    MockSerpApiHandler.num_pages = args.pages
+    MockSerpApiHandler.error_probability = args.error_probability
+    MockSerpApiHandler.searches_left = args.searches_left
+    MockSerpApiHandler.rate_limit_per_hour = args.rate_limit_per_hour
+    server = ThreadingHTTPServer(("localhost", args.port), MockSerpApiHandler)
+    print(f"Mock SerpAPI at http://localhost:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(f"Served {MockSerpApiHandler.num_searches} searches")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,39 +1,217 @@
-from rank_bm25 import BM25Okapi
+"""
+Build the BM25 index of place summaries.
+Summaries are streamed from the database and tokenized in chunks by a process pool. Each chunk returns its term
+counts, which are merged in chunk order into postings of each term, and the index is written as a numpy .npz file
+of plain arrays instead of a pickled rank_bm25 object. Scores match rank_bm25.BM25Okapi, which --verify checks by
+loading the index with the chatbot's loader in app/bm25_index.py.
+
+    python rankBM25_generation.py --db food_places.db --workers 4 --verify
+"""
+import argparse
+import importlib.util
+import math
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import nltk
+import numpy as np
 from nltk.tokenize import word_tokenize
-import sqlite3
-import pickle
 from tqdm import tqdm
-import nltk
 
-nltk.download('punkt_tab')
+import food_db
+from artifact_store import iter_place_artifacts
+
 DB_PATH = "food_places.db"  # Path to your SQLite database
-conn = sqlite3.connect(DB_PATH)
-cursor = conn.cursor()
-cursor.execute("""
-    SELECT *
-    FROM places
-    WHERE summary_long_path != 'None'
-""")
-rows = cursor.fetchall()
-conn.close()
-doc_list = []
-doc_info_list = []
-for row in tqdm(rows, desc="Processing places"):
-    _, place_id, place_name, address, place_area, place_zone, place_type, rating, _, detail_path, review_path, _, summary_path = row
-    with open(summary_path, "r", encoding="utf-8") as file:
-        text = file.read()
-    doc_text = word_tokenize(text.lower())
-    doc_info = {
-        'place_id': place_id,
-        'place_name': place_name
+OUTPUT_FILE = "rank_bm25result_k50"
+FORMAT_VERSION = 1
+CHUNK_SIZE = 256  # Summaries tokenized per task
+NUM_WORKERS = os.cpu_count()
+# BM25Okapi parameters, same defaults as rank_bm25
+K1 = 1.5
+B = 0.75
+EPSILON = 0.25
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app")
+VERIFY_QUERIES = ["chicken rice", "cheap halal food near bugis", "cafe with good coffee and cakes",
+                  "fine dining japanese omakase", "spicy korean fried chicken in tampines", "vegetarian"]
+
+
+def tokenize_chunk(texts: list[str]) -> tuple:
+    """
+    Term counts of a chunk of documents: terms of the chunk in order of first occurrence, length of each
+    document, and (document, term, count) triples with documents and terms numbered within the chunk
+    """
+    terms = {}
+    doc_lens = []
+    docs, term_ids, counts = [], [], []
+    for doc, text in enumerate(texts):
+        tokens = word_tokenize(text.lower())
+        doc_lens.append(len(tokens))
+        frequencies = {}
+        for token in tokens:
+            frequencies[token] = frequencies.get(token, 0) + 1
+        for token, count in frequencies.items():
+            docs.append(doc)
+            term_ids.append(terms.setdefault(token, len(terms)))
+            counts.append(count)
+    return (list(terms), np.array(doc_lens, dtype=np.int32), np.array(docs, dtype=np.int32),
+            np.array(term_ids, dtype=np.int32), np.array(counts, dtype=np.int32))
+
+
+def iter_chunks(conn, chunk_size: int):
+    """Lists of (place_id, name) and summaries of chunk_size places, read in pack order"""
+    doc_infos, texts = [], []
+    for row, text in iter_place_artifacts(food_db.iter_places_with_summary(conn), "summary_long_path"):
+        doc_infos.append((row["place_id"], row["name"]))
+        texts.append(text)
+        if len(texts) >= chunk_size:
+            yield doc_infos, texts
+            doc_infos, texts = [], []
+    if texts:
+        yield doc_infos, texts
+
+
+def tokenize_parallel(chunks, num_workers: int):
+    """Tokenize chunks in a process pool with a bounded number of pending chunks, yielding results in order"""
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        pending = deque()
+        for doc_infos, texts in chunks:
+            pending.append((doc_infos, executor.submit(tokenize_chunk, texts)))
+            if len(pending) >= 2 * num_workers:
+                doc_infos, future = pending.popleft()
+                yield doc_infos, future.result()
+        while pending:
+            doc_infos, future = pending.popleft()
+            yield doc_infos, future.result()
+
+
+def build_index(results) -> dict:
+    """
+    Merge term counts of tokenized chunks into the arrays of the index. Terms are numbered in order of first
+    occurrence, like the idf of rank_bm25, and postings of each term are sorted by document
+    """
+    term_ids = {}
+    place_ids, place_names = [], []
+    doc_lens, docs, terms, counts = [], [], [], []
+    num_docs = 0
+    for doc_infos, (chunk_terms, chunk_doc_lens, chunk_docs, chunk_term_ids, chunk_counts) in results:
+        global_ids = np.array([term_ids.setdefault(term, len(term_ids)) for term in chunk_terms], dtype=np.int32)
+        place_ids.extend(place_id for place_id, _ in doc_infos)
+        place_names.extend(name for _, name in doc_infos)
+        doc_lens.append(chunk_doc_lens)
+        docs.append(chunk_docs + num_docs)
+        terms.append(global_ids[chunk_term_ids])
+        counts.append(chunk_counts)
+        num_docs += len(chunk_doc_lens)
+
+    doc_len = np.concatenate(doc_lens) if doc_lens else np.zeros(0, dtype=np.int32)
+    docs = np.concatenate(docs) if docs else np.zeros(0, dtype=np.int32)
+    terms = np.concatenate(terms) if terms else np.zeros(0, dtype=np.int32)
+    counts = np.concatenate(counts) if counts else np.zeros(0, dtype=np.int32)
+    order = np.argsort(terms, kind="stable")  # Postings stay sorted by document within a term
+    doc_freq = np.bincount(terms, minlength=len(term_ids))
+    term_offsets = np.zeros(len(term_ids) + 1, dtype=np.int64)
+    np.cumsum(doc_freq, out=term_offsets[1:])
+
+    # Same idf as BM25Okapi._calc_idf, with math.log and summed in term order so scores match exactly
+    idf = [math.log(num_docs - freq + 0.5) - math.log(freq + 0.5) for freq in doc_freq.tolist()]
+    average_idf = sum(idf) / len(idf) if idf else 0.0
+    idf = np.array(idf, dtype=np.float64)
+    idf[idf < 0] = EPSILON * average_idf
+
+    return {
+        "format_version": np.array(FORMAT_VERSION),
+        "place_ids": np.array(place_ids, dtype=str),
+        "place_names": np.array(place_names, dtype=str),
+        # Tokens never contain whitespace, so terms are stored as one newline-separated UTF-8 buffer
+        "terms": np.frombuffer("\n".join(term_ids).encode("utf-8"), dtype=np.uint8),
+        "idf": idf,
+        "term_offsets": term_offsets,
+        "posting_docs": docs[order],
+        "posting_counts": counts[order],
+        "doc_len": doc_len,
+        "avgdl": np.array(doc_len.sum() / num_docs if num_docs else 0.0),
+        "k1": np.array(K1),
+        "b": np.array(B),
     }
-    doc_list.append(doc_text)
-    doc_info_list.append(doc_info)
 
-# Initialize BM25
-bm25 = BM25Okapi(doc_list)
 
-#To save bm25 object
-with open('rank_bm25result_k50', 'wb') as bm25result_file:
-    # pickle.dump(bm25, bm25result_file)
-    pickle.dump({"bm25": bm25, "doc_infos": doc_info_list}, bm25result_file)
\ No newline at end of file
+def load_bm25(bm25_file: str) -> tuple:
+    """
+    Scorer and doc_infos of a BM25 file loaded by app/bm25_index.py, the only implementation of the scoring, so
+    --verify checks the scores the chatbot serves. The app folder is not on the path of these scripts
+    """
+    spec = importlib.util.spec_from_file_location("bm25_index", os.path.join(APP_DIR, "bm25_index.py"))
+    bm25_index = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(bm25_index)
+    return bm25_index.load_bm25(bm25_file)
+
+
+def verify(conn, output_file: str) -> bool:
+    """Compare scores of the written index with rank_bm25.BM25Okapi built serially from the same summaries"""
+    from rank_bm25 import BM25Okapi
+
+    index, doc_infos = load_bm25(output_file)
+    doc_list = []
+    place_ids = []
+    for row, text in iter_place_artifacts(food_db.iter_places_with_summary(conn), "summary_long_path"):
+        doc_list.append(word_tokenize(text.lower()))
+        place_ids.append(row["place_id"])
+    if place_ids != [doc_info["place_id"] for doc_info in doc_infos]:
+        print("Verify failed: documents differ from the index")
+        return False
+    bm25 = BM25Okapi(doc_list, k1=K1, b=B, epsilon=EPSILON)
+    max_diff = 0.0
+    for query in VERIFY_QUERIES:
+        tokens = word_tokenize(query.lower())
+        max_diff = max(max_diff, float(np.max(np.abs(bm25.get_scores(tokens) - index.get_scores(tokens)),
+                                              initial=0.0)))
+    ok = max_diff <= 1e-9
+    print(f"Verify {'passed' if ok else 'failed'}: max score difference with rank_bm25 {max_diff:.3g} "
+          f"over {len(VERIFY_QUERIES)} queries and {len(place_ids)} documents")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default=DB_PATH, help="SQLite database of places with summaries")
+    parser.add_argument("--output", default=OUTPUT_FILE, help="BM25 index file to write")
+    parser.add_argument("--workers", type=int, default=NUM_WORKERS, help="Tokenizer processes")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="Summaries per tokenizer task")
+    parser.add_argument("--verify", action="store_true", help="Check scores against rank_bm25 after the build")
+    args = parser.parse_args()
+
+    nltk.download('punkt_tab')
+    conn = food_db.connect(args.db)
+    num_places = food_db.count_places_with_summary(conn)
+    start_time = time.perf_counter()
+    results = tokenize_parallel(iter_chunks(conn, args.chunk_size), args.workers)
+    progress = tqdm(total=num_places, desc="Processing places")
+
+    def track(results):
+        for doc_infos, result in results:
+            progress.update(len(doc_infos))
+            yield doc_infos, result
+
+    index = build_index(track(results))
+    progress.close()
+    # Written through a file object so numpy does not add .npz to the file name
+    with open(args.output, "wb") as file:
+        np.savez(file, **index)
+    elapsed = time.perf_counter() - start_time
+
+    num_docs = len(index["doc_len"])
+    num_tokens = int(index["doc_len"].sum())
+    print(f"Indexed {num_docs} places, {num_tokens} tokens and {len(index['idf'])} terms in {elapsed:.1f}s "
+          f"({num_docs / elapsed:.0f} places/s, {num_tokens / elapsed:.0f} tokens/s) "
+          f"into {args.output} ({os.path.getsize(args.output) / 1e6:.1f} MB)")
+
+    ok = verify(conn, args.output) if args.verify else True
+    conn.close()
+    if not ok:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
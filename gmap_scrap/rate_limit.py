@@ -0,0 +1,41 @@
+"""
+Rate limiting and retries for asyncio API calls of the scraping and summary scripts
+"""
+import asyncio
+import random
+import time
+
+
+class RateLimiter:
+    def __init__(self, requests_per_minute: float):
+        """Space out calls to acquire so at most requests_per_minute calls start per minute"""
+        self.interval = 60 / requests_per_minute
+        self.next_time = 0.0
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            now = time.monotonic()
+            wait = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+async def retry_with_backoff(call, max_retries: int = 5, retry_on: tuple = (Exception,), base_delay: float = 1.0,
+                             max_delay: float = 60.0, rate_limiter: RateLimiter = None):
+    """
+    Await call() until it succeeds, retrying errors in retry_on up to max_retries times with exponential backoff
+    and jitter. Each attempt waits for rate_limiter first if given.
+    """
+    for attempt in range(max_retries + 1):
+        if rate_limiter is not None:
+            await rate_limiter.acquire()
+        try:
+            return await call()
+        except retry_on as e:
+            if attempt == max_retries:
+                raise
+            delay = min(max_delay, base_delay * 2 ** attempt) * random.uniform(0.5, 1.0)
+            print(f"Retrying in {delay:.1f}s after error: {e}")
+            await asyncio.sleep(delay)
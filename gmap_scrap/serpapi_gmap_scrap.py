@@ -1,11 +1,11 @@
 import json
 from serpapi import GoogleSearch
-import sqlite3
+import food_db
+from artifact_store import close_stores, write_artifact
 
 import os
 from dotenv import load_dotenv
-import geopandas as gpd
-from functions import get_subzone
+from subzone_assigner import SubzoneAssigner
 
 load_dotenv()
 serpApi_key = os.getenv('SERPAPI_KEY')
@@ -16,9 +16,9 @@ area_json_filename = "sg_area_centroids.json"
 with open(area_json_filename, "r", encoding="utf-8") as file:
     area_data = json.load(file)
 
-# Load the GeoJSON file
+# Load the GeoJSON file and index its subzones
 geojson_path = "sg_subzones.geojson"  # Replace with your file path
-gdf = gpd.read_file(geojson_path)
+subzone_assigner = SubzoneAssigner(geojson_path)
 
 cuisines_in_singapore = [
     # Southeast Asian Cuisines
@@ -40,34 +40,10 @@ cuisines_in_singapore = [
 ]
 place_type_list = [cuisine +" restaurants" for cuisine in cuisines_in_singapore]
 place_type_list.extend(["bar", "cafe", "dessert"])
-detail_dir = "details"
 log_file = "log.txt"
 
-os.makedirs(detail_dir, exist_ok=True)
-
-# Create/connect to an SQLite database
-conn = sqlite3.connect("food_places.db")
-cursor = conn.cursor()
-
-# Initialize SQLite database
-cursor.execute("""
-    CREATE TABLE IF NOT EXISTS places (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        place_id TEXT,
-        name TEXT,
-        address TEXT,
-        area TEXT,
-        sub_zone TEXT,
-        type TEXT,
-        rating REAL,
-        num_reviews REAL,
-        detail_path TEXT,
-        review_path TEXT,
-        summary_path TEXT
-        summary_long_path TEXT
-    )
-""")
-conn.commit()
+# Create/connect to an SQLite database, creating or migrating the places table
+conn = food_db.connect()
 
 # Function to fetch restaurant data
 def fetch_food_places(query, lat, lon, start=0):
@@ -85,17 +61,8 @@ def fetch_food_places(query, lat, lon, start=0):
     search = GoogleSearch(params)
     return search.get_dict()
 
-def place_exists(place_id):
-    """Check if a place already exists in the database."""
-    cursor.execute("SELECT 1 FROM places WHERE place_id = ?", (place_id,))
-    return cursor.fetchone() is not None
-
-def save_to_db(place_id, name, address, area, sub_zone, type, rating, num_reviews,
-               detail_path, review_path, summary_path, summary_long_path):
-    """Save a new place to the database if not a duplicate."""
-    cursor.execute("INSERT INTO places (place_id, name, address, area, sub_zone, type, rating, num_reviews, detail_path, review_path, summary_path, summary_long_path) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
-                   (place_id, name, address, area, sub_zone, type, rating, num_reviews, detail_path, review_path, summary_path, summary_long_path))
-    conn.commit()
+# place_ids in the database, so duplicates are skipped without a query per place
+existing_place_ids = food_db.get_place_ids(conn)
 
 for area in area_data:
     for place_type in place_type_list:
@@ -115,7 +82,13 @@ for area in area_data:
                 print(f"Error fetching results for {gmap_query} at start {start}: {e}")
                 continue
             if "local_results" in gmap_results:
-                for place in gmap_results["local_results"]:
+                local_results = gmap_results["local_results"]
+                # Subzones of the whole page in one lookup
+                sub_zones = subzone_assigner.assign([(place.get("gps_coordinates", {}).get("latitude", None),
+                                                      place.get("gps_coordinates", {}).get("longitude", None))
+                                                     for place in local_results])
+                new_places = []
+                for place, sub_zone in zip(local_results, sub_zones):
 
                     place_id = place.get("place_id", "Null")
                     name = place.get("title", "Null")
@@ -123,32 +96,25 @@ for area in area_data:
                     rating = place.get("rating", 0)
                     num_reviews = place.get("reviews", 0)
                     type = place.get("type", "Null")
-                    place_lat = place.get("gps_coordinates", {}).get("latitude", None)
-                    place_lon = place.get("gps_coordinates", {}).get("longitude", None)
-                    sub_zone = get_subzone(gdf, place_lat, place_lon)
 
                     print(f"Processing {name} in {address}")
-                    # If place_id not in database
-                    if not place_exists(place_id) and sub_zone:
-                        no_pass_bool = False
+                    # If place_id not in database or earlier on this page
+                    if place_id not in existing_place_ids and sub_zone:
+                        existing_place_ids.add(place_id)
                         print(f"{name} in {address} not in database. Adding to database.")
                         places_count += 1
-                        # Save place details to json file
-                        detail_json_filename = f"{place_id}.json"
-                        detail_path = f"{detail_dir}/{detail_json_filename}"
-                        with open(detail_path, "w", encoding="utf-8") as file:
-                            json.dump(place, file, indent=4, ensure_ascii=False)
-
-                        # Save information and paths to database
-                        # placeholder values
-                        review_path = "None"
-                        summary_path = "None"
-                        summary_long_path = None
-                        save_to_db(place_id, name, address, area_name, sub_zone, type, rating, num_reviews,
-                                   detail_path, review_path, summary_path, summary_long_path)
-                        print(f"Done processing for {name}.")
+                        # Append place details to the details pack
+                        detail_path = write_artifact("detail_path", place_id,
+                                                     json.dumps(place, indent=4, ensure_ascii=False))
+
+                        # Save information and paths to database, other paths are NULL until made
+                        new_places.append({"place_id": place_id, "name": name, "address": address, "area": area_name,
+                                           "sub_zone": sub_zone, "type": type, "rating": rating,
+                                           "num_reviews": num_reviews, "detail_path": detail_path})
                     else:
                         print(f"{name} in {address} in database. Skipping.")
+                food_db.insert_places(conn, new_places)
+                print(f"Added {len(new_places)} places to database.")
             else:
                 print(f"No results found for {gmap_query}. Moving to next search.")
                 break
@@ -161,8 +127,4 @@ for area in area_data:
         with open(log_file, "a") as file:
             file.write((log_txt + "\n"))
 
-
-
-
-
-
+close_stores()
@@ -0,0 +1,72 @@
+"""
+Local stub of the embeddings API for trying create_embed_chroma.py without Together.
+Returns deterministic unit vectors for each input after a fixed latency per request.
+
+Usage:
+    python stub_embedding_server.py --port 8765 --latency 0.2
+    TOGETHER_API_KEY=stub EMBED_BASE_URL=http://localhost:8765/v1 python create_embed_chroma.py
+"""
+import argparse
+import hashlib
+import json
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+
+
+def embed(text: str, dim: int) -> list[float]:
+    """Deterministic unit vector for text"""
+    seed = int.from_bytes(hashlib.sha1(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dim)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+class StubEmbeddingHandler(BaseHTTPRequestHandler):
+    dim = 1024
+    latency = 0.2
+    num_requests = 0
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/embeddings"):
+            self.send_error(404)
+            return
+        payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        texts = payload["input"] if isinstance(payload["input"], list) else [payload["input"]]
+        time.sleep(self.latency)
+        type(self).num_requests += 1  # Kept on the class, which may be a subclass with its own settings
+        body = json.dumps({
+            "object": "list",
+            "model": payload.get("model"),
+            "data": [{"object": "embedding", "index": i, "embedding": embed(text, self.dim)}
+                     for i, text in enumerate(texts)],
+        }).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds per request")
+    parser.add_argument("--dim", type=int, default=1024, help="Embedding dimension")
+    args = parser.parse_args()
+
+    StubEmbeddingHandler.dim = args.dim
+    StubEmbeddingHandler.latency = args.latency
+    server = ThreadingHTTPServer(("localhost", args.port), StubEmbeddingHandler)
+    print(f"Stub embeddings API at http://localhost:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(f"Served {StubEmbeddingHandler.num_requests} requests")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""
+Assign Singapore subzones to coordinates in batches, using a spatial index over the subzone polygons
+"""
+import re
+import geopandas as gpd
+import numpy as np
+
+SUBZONE_NAME_PATTERN = re.compile(r"<th>SUBZONE_N</th>\s*<td>(.*?)</td>")
+
+
+def get_subzone_name(description: str) -> str:
+    """Subzone name in the HTML attribute table of a subzone feature, title-cased as used by the chatbot"""
+    match = SUBZONE_NAME_PATTERN.search(description)
+    return match.group(1).strip().title() if match else None
+
+
+class SubzoneAssigner:
+    def __init__(self, geojson_path: str = "sg_subzones.geojson", precision: int = 6):
+        """
+        Load subzone polygons and build their STRtree index once. Subzones are memoized per coordinate rounded
+        to precision decimal places (6 is about 0.1 m), so places seen again in other searches are not looked up.
+        """
+        gdf = gpd.read_file(geojson_path)
+        self.subzone_names = [get_subzone_name(description) for description in gdf["Description"]]
+        self.sindex = gdf.sindex
+        self.precision = precision
+        self.cache = {}
+
+    def _key(self, lat: float, lon: float):
+        if lat is None or lon is None:
+            return None
+        return round(lat, self.precision), round(lon, self.precision)
+
+    def assign(self, coordinates: list[tuple]) -> list:
+        """Subzone names of (latitude, longitude) pairs, None for missing coordinates or points outside subzones"""
+        keys = [self._key(lat, lon) for lat, lon in coordinates]
+        new_keys = list({key for key in keys if key is not None and key not in self.cache})
+        if new_keys:
+            lats, lons = np.array(new_keys).T
+            # Point-in-polygon test of all new points in one query
+            point_idx, polygon_idx = self.sindex.query(gpd.points_from_xy(lons, lats), predicate="intersects")
+            subzones = [None] * len(new_keys)
+            for point, polygon in zip(point_idx, polygon_idx):
+                if subzones[point] is None:
+                    subzones[point] = self.subzone_names[polygon]
+            self.cache.update(zip(new_keys, subzones))
+        return [self.cache.get(key) if key is not None else None for key in keys]
+
+    def get_subzone(self, lat: float, lon: float) -> str:
+        return self.assign([(lat, lon)])[0]
@@ -0,0 +1,47 @@
+import os
+import sys
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+# Scripts are run from the gmap_scrap folder and import each other as top-level modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import artifact_store  # noqa: E402
+import food_db  # noqa: E402
+
+
+@pytest.fixture
+def work_dir(tmp_path, monkeypatch):
+    """Run in an empty folder, as the scripts write their files relative to it"""
+    monkeypatch.chdir(tmp_path)
+    yield tmp_path
+    artifact_store.close_stores()
+
+
+@pytest.fixture
+def make_db(work_dir):
+    """Create food_places.db with places given as dicts of food_db.PLACE_COLUMNS"""
+    def make(places):
+        conn = food_db.connect(food_db.DB_PATH)
+        food_db.insert_places(conn, places)
+        return conn
+    return make
+
+
+@pytest.fixture
+def serve():
+    """Start an HTTP handler class on a free local port, returning its base URL"""
+    servers = []
+
+    def start(handler) -> str:
+        server = ThreadingHTTPServer(("localhost", 0), handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f"http://localhost:{server.server_address[1]}"
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
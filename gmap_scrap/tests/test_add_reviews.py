@@ -0,0 +1,127 @@
+import asyncio
+import hashlib
+import json
+import os
+import pickle
+import threading
+
+import pytest
+
+import add_reviews
+import food_db
+from artifact_store import read_json_artifact
+from mock_serpapi_server import MockSerpApiHandler
+from rate_limit import RateLimiter
+
+
+@pytest.fixture
+def mock_serpapi(serve, monkeypatch):
+    """Local mock of SerpAPI with 3 pages of 10 reviews per place, used by add_reviews through SERPAPI_BASE_URL"""
+    def start(searches_left: int = 1000, pages: int = 3):
+        handler = type("Handler", (MockSerpApiHandler,), {
+            "latency": 0.0, "num_pages": pages, "searches_left": searches_left,
+            "rate_limit_per_hour": 10 ** 9, "num_searches": 0, "lock": threading.Lock()})
+        monkeypatch.setattr(add_reviews, "SERPAPI_BASE_URL", serve(handler))
+        return handler
+
+    monkeypatch.setattr(add_reviews, "REQUESTS_PER_MINUTE", 60000)
+    return start
+
+
+@pytest.fixture
+def places(make_db):
+    """Database of 4 places with enough reviews, and the pickle of their place_ids"""
+    place_ids = [f"p{i}" for i in range(4)]
+    make_db([{"place_id": place_id, "name": place_id, "rating": 4.5, "num_reviews": 100} for place_id in place_ids]
+            ).close()
+    with open(add_reviews.place_ids_file, "wb") as file:
+        pickle.dump(place_ids, file)
+    return place_ids
+
+
+def get_reviews() -> dict:
+    conn = food_db.connect()
+    reviews = {row["place_id"]: read_json_artifact(row["review_path"], row["place_id"])
+               for row in food_db.iter_places_with_reviews(conn)}
+    conn.close()
+    return reviews
+
+
+def test_run_fetches_pages_and_rerun_uses_cache(work_dir, places, mock_serpapi, monkeypatch):
+    handler = mock_serpapi()
+    add_reviews.main()
+    assert handler.num_searches == len(places) * add_reviews.num_pages
+    reviews = get_reviews()
+    assert sorted(reviews) == places
+    for place_id, place_reviews in reviews.items():
+        assert [review["snippet"] for review in place_reviews] == [f"Review {i} of {place_id}" for i in range(20)]
+
+    monkeypatch.setattr(add_reviews, "ignore_review_path", True)
+    add_reviews.main()
+    assert handler.num_searches == len(places) * add_reviews.num_pages  # Served from reviews_cache
+    assert get_reviews() == reviews
+
+
+def write_cached_page(place_id: str, page_token: str | None, snippets: list, next_page_token: str = None):
+    page_key = hashlib.sha1(page_token.encode("utf-8")).hexdigest()[:16] if page_token else "first"
+    os.makedirs(f"{add_reviews.cache_dir}/{place_id}", exist_ok=True)
+    results = {"reviews": [{"snippet": snippet} for snippet in snippets]}
+    if next_page_token:
+        results["serpapi_pagination"] = {"next_page_token": next_page_token}
+    with open(f"{add_reviews.cache_dir}/{place_id}/{page_key}.json", "w", encoding="utf-8") as file:
+        json.dump(results, file)
+
+
+def fetch_reviews(place_id: str, num_pages: int) -> list:
+    budget = add_reviews.SearchBudget(None)
+    return asyncio.run(add_reviews.fetch_reviews(place_id, RateLimiter(60000), budget, num_pages=num_pages))
+
+
+def test_fetch_reviews_dedups_and_stops_on_duplicate_page(work_dir, mock_serpapi):
+    handler = mock_serpapi()
+    write_cached_page("p0", None, ["a", "b", "a", "c"], next_page_token="page1")
+    write_cached_page("p0", "page1", ["b", "c"], next_page_token="page2")
+    reviews = fetch_reviews("p0", num_pages=5)
+    assert [review["snippet"] for review in reviews] == ["a", "b", "c"]
+    assert handler.num_searches == 0  # Stopped at the page of duplicates without requesting page2
+
+
+def test_fetch_reviews_stops_at_last_page(work_dir, mock_serpapi):
+    handler = mock_serpapi(pages=2)
+    reviews = fetch_reviews("p0", num_pages=5)
+    assert len(reviews) == 20
+    assert handler.num_searches == 2
+
+
+def test_quota_exhausted_stops_run(work_dir, places, mock_serpapi, monkeypatch):
+    # One place at a time, so the first place gets both its pages and the second only its first page
+    monkeypatch.setattr(add_reviews, "MAX_CONCURRENT_PLACES", 1)
+    handler = mock_serpapi(searches_left=add_reviews.num_pages + 1)
+    add_reviews.main()
+    assert handler.num_searches == add_reviews.num_pages + 1
+    assert sorted(get_reviews()) == places[:1]
+    conn = food_db.connect()
+    assert food_db.get_status(conn, "reviews") == {"p0": "done"}  # Others not marked failed, so a rerun fetches them
+    conn.close()
+
+    handler = mock_serpapi(searches_left=100)
+    add_reviews.main()
+    # Pages fetched before are cached, and the saved place is not fetched again
+    assert handler.num_searches == (len(places) - 1) * add_reviews.num_pages - 1
+    assert sorted(get_reviews()) == places
+
+
+def test_retries_are_charged_to_budget(work_dir, mock_serpapi, monkeypatch):
+    calls = []
+
+    def search_reviews(params):
+        calls.append(params)
+        raise add_reviews.RetryableError("HTTP 429")
+
+    monkeypatch.setattr(add_reviews, "search_reviews", search_reviews)
+    monkeypatch.setattr("rate_limit.random.uniform", lambda a, b: 0.0)
+    budget = add_reviews.SearchBudget(3)
+    with pytest.raises(add_reviews.QuotaExhausted):
+        asyncio.run(add_reviews.fetch_page("p0", None, RateLimiter(60000), budget))
+    assert len(calls) == 3
+    assert budget.searches_left == 0
@@ -0,0 +1,115 @@
+import chromadb
+import numpy as np
+import pytest
+from chromadb.config import Settings
+
+import create_embed_chroma
+import food_db
+from artifact_store import write_artifact
+from stub_embedding_server import StubEmbeddingHandler, embed
+
+DIM = 8
+
+
+def summary(place_id: str, num_words: int) -> str:
+    first_lines = f"Name of place: {place_id}\nLocated in Bedok\nType: cafe"
+    return first_lines + "\n" + " ".join(f"{place_id}_word{i}" for i in range(num_words))
+
+
+@pytest.fixture
+def embed_build(work_dir, serve, monkeypatch):
+    """create_embed_chroma pointed at the stub embeddings API through EMBED_BASE_URL, with small batches.
+    Returns the list of texts of each embedding request"""
+    handler = type("Handler", (StubEmbeddingHandler,), {"dim": DIM, "latency": 0.0, "num_requests": 0})
+    monkeypatch.setattr(create_embed_chroma, "EMBED_BASE_URL", serve(handler) + "/v1")
+    monkeypatch.setenv("TOGETHER_API_KEY", "stub")
+    # Chroma shares clients by path, so a relative path would reach the database of an earlier test
+    monkeypatch.setattr(create_embed_chroma, "CHROMA_PATH", str(work_dir / "chroma_gmapfood"))
+    monkeypatch.setattr(create_embed_chroma, "EMBED_BATCH_SIZE", 5)
+    monkeypatch.setattr(create_embed_chroma, "CHROMA_BATCH_SIZE", 7)
+    monkeypatch.setattr(create_embed_chroma, "MAX_WORDS", 50)
+
+    requests = []
+    get_embeddings = create_embed_chroma.get_embeddings
+
+    def record(client, texts):
+        requests.append(list(texts))
+        return get_embeddings(client, texts)
+
+    monkeypatch.setattr(create_embed_chroma, "get_embeddings", record)
+    return requests
+
+
+def add_places(conn, num_words: dict):
+    food_db.insert_places(conn, [{"place_id": place_id, "name": place_id, "address": "1 Bedok Road", "area": "Bedok",
+                                  "sub_zone": "Bedok North", "type": "cafe", "rating": 4.0,
+                                  "summary_long_path": write_artifact("summary_long_path", place_id,
+                                                                      summary(place_id, words))}
+                                 for place_id, words in num_words.items()])
+
+
+def get_collection():
+    client = chromadb.PersistentClient(path=create_embed_chroma.CHROMA_PATH,
+                                       settings=Settings(anonymized_telemetry=False))
+    return client.get_collection("gmap_food")
+
+
+def place_of(chunk: str) -> str:
+    return chunk.split("\n", 1)[0].removeprefix("Name of place: ")
+
+
+def test_build_keeps_places_whole_and_maps_embeddings(embed_build):
+    # 1 to 4 chunks per place with MAX_WORDS of 50 (words and spaces are counted)
+    num_words = {f"p{i}": 10 + 25 * (i % 4) for i in range(12)}
+    conn = food_db.connect()
+    add_places(conn, num_words)
+    create_embed_chroma.main()
+
+    places_per_request = [{place_of(chunk) for chunk in texts} for texts in embed_build]
+    for place_id in num_words:
+        assert sum(place_id in places for places in places_per_request) == 1  # All chunks in one request
+
+    results = get_collection().get(include=["documents", "embeddings", "metadatas"])
+    assert {metadata["place_id"] for metadata in results["metadatas"]} == set(num_words)
+    for chunk_id, document, embedding, metadata in zip(results["ids"], results["documents"], results["embeddings"],
+                                                       results["metadatas"]):
+        assert place_of(document) == metadata["place_id"]
+        assert chunk_id == f"{metadata['place_id']}_chunk_{metadata['chunk_index']}"
+        np.testing.assert_allclose(embedding, embed(document, DIM), rtol=1e-6)
+    assert food_db.get_status(conn, "embedding") == {place_id: "done" for place_id in num_words}
+    conn.close()
+
+
+def test_chunk_ids_are_deterministic(monkeypatch):
+    row = {"place_id": "p1", "name": "p1", "address": "1 Bedok Road", "area": "Bedok", "sub_zone": "Bedok North",
+           "type": "cafe", "rating": 4.0, "summary_long_path": "summaries_long.pack"}
+    text = summary("p1", 400)
+    monkeypatch.setattr(create_embed_chroma, "read_artifact", lambda path, place_id: text)
+    first, second = create_embed_chroma.get_place_chunks(row), create_embed_chroma.get_place_chunks(row)
+    chunks = create_embed_chroma.chunk_text(text)
+    assert len(chunks) > 1
+    assert first["ids"] == second["ids"] == [f"p1_chunk_{i}" for i in range(len(chunks))]
+    assert first["documents"] == chunks
+    assert [metadata["chunk_index"] for metadata in first["metadatas"]] == list(range(len(chunks)))
+
+
+def test_rerun_skips_places_in_checkpoint(embed_build):
+    conn = food_db.connect()
+    add_places(conn, {f"p{i}": 30 for i in range(5)})
+    create_embed_chroma.main()
+    num_chunks = get_collection().count()
+
+    embed_build.clear()
+    add_places(conn, {f"q{i}": 30 for i in range(3)})
+    create_embed_chroma.main()
+    assert {place_of(chunk) for texts in embed_build for chunk in texts} == {"q0", "q1", "q2"}
+
+    # Places in the checkpoint are skipped even if Chroma lost them, e.g. read from a stale copy
+    embed_build.clear()
+    get_collection().delete(where={"place_id": "p0"})
+    create_embed_chroma.main()
+    assert embed_build == []
+    assert get_collection().count() == num_chunks + 3 * len(create_embed_chroma.chunk_text(summary("q0", 30))) - \
+        len(create_embed_chroma.chunk_text(summary("p0", 30)))
+    conn.close()
+
@@ -0,0 +1,34 @@
+import sqlite3
+import threading
+import time
+
+import food_db
+
+
+def test_concurrent_connections_run_each_migration_once(work_dir, monkeypatch):
+    runs = []
+
+    def make_migration(i):
+        def migration(conn):
+            runs.append(i)
+            time.sleep(0.05)  # Long enough for the other connection to read the old version
+        return migration
+
+    monkeypatch.setattr(food_db, "MIGRATIONS", [make_migration(i) for i in range(3)])
+    start = threading.Barrier(2)
+
+    def connect():
+        conn = sqlite3.connect("food_places.db", timeout=30)
+        start.wait()
+        food_db.migrate(conn)
+        conn.close()
+
+    threads = [threading.Thread(target=connect) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(runs) == [0, 1, 2]
+    conn = sqlite3.connect("food_places.db")
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == 3
+    conn.close()
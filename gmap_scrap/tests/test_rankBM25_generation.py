@@ -0,0 +1,78 @@
+import re
+
+import numpy as np
+import pytest
+from rank_bm25 import BM25Okapi
+
+import food_db
+import rankBM25_generation
+from artifact_store import write_artifact
+
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+DOCS = [
+    "Chicken rice, chicken wings and more chicken!",
+    "Cheap halal food near Bugis. Good nasi lemak.",
+    "Cafe with good coffee and cakes, good for work.",
+    "",
+    "Fine dining Japanese omakase, good sake.",
+    "Spicy Korean fried chicken in Tampines; good value.",
+    "Vegetarian cafe with good salads and good coffee.",
+]
+QUERIES = [
+    "chicken rice",
+    "good good good",  # Repeated term, in more than half of the documents so its idf is floored
+    "cheap halal bugis",
+    "coffee coffee cakes",
+    "unknownword",  # Out of vocabulary
+    "pizza and chicken",
+    "",
+]
+
+
+def tokenize(text: str) -> list[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+@pytest.fixture
+def bm25_file(tmp_path, monkeypatch):
+    """npz index of DOCS tokenized in chunks of 3 documents and merged, as the build does"""
+    monkeypatch.setattr(rankBM25_generation, "word_tokenize", TOKEN_PATTERN.findall)
+    results = []
+    for start in range(0, len(DOCS), 3):
+        doc_infos = [(f"p{i}", f"Place {i}") for i in range(start, min(start + 3, len(DOCS)))]
+        results.append((doc_infos, rankBM25_generation.tokenize_chunk(DOCS[start:start + 3])))
+    path = str(tmp_path / "rank_bm25result_k50")
+    with open(path, "wb") as file:
+        np.savez(file, **rankBM25_generation.build_index(results))
+    return path
+
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_scores_match_rank_bm25(bm25_file, query):
+    expected = BM25Okapi([tokenize(doc) for doc in DOCS]).get_scores(tokenize(query))
+
+    bm25, _ = rankBM25_generation.load_bm25(bm25_file)
+    assert type(bm25).__name__ == "BM25Index"
+    np.testing.assert_allclose(bm25.get_scores(tokenize(query)), expected, rtol=0, atol=1e-6)
+
+
+def test_doc_infos_keep_document_order(bm25_file):
+    _, doc_infos = rankBM25_generation.load_bm25(bm25_file)
+    assert doc_infos == [{"place_id": f"p{i}", "place_name": f"Place {i}"} for i in range(len(DOCS))]
+
+
+def test_verify_checks_the_built_index(make_db, monkeypatch):
+    monkeypatch.setattr(rankBM25_generation, "word_tokenize", TOKEN_PATTERN.findall)
+    conn = make_db([{"place_id": f"p{i}", "name": f"Place {i}"} for i in range(len(DOCS))])
+    food_db.set_paths(conn, "summary_long_path", [(write_artifact("summary_long_path", f"p{i}", doc), f"p{i}")
+                                                  for i, doc in enumerate(DOCS)])
+    results = [(doc_infos, rankBM25_generation.tokenize_chunk(texts))
+               for doc_infos, texts in rankBM25_generation.iter_chunks(conn, 3)]
+    with open("rank_bm25result_k50", "wb") as file:
+        np.savez(file, **rankBM25_generation.build_index(results))
+    assert rankBM25_generation.verify(conn, "rank_bm25result_k50")
+
+    monkeypatch.setattr(rankBM25_generation, "K1", 1.2)  # Reference built with other parameters than the index
+    assert not rankBM25_generation.verify(conn, "rank_bm25result_k50")
+    conn.close()